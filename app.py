@@ -1,24 +1,60 @@
-from contextlib import asynccontextmanager
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager, suppress
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pymongo.errors import ExecutionTimeout
 
-from database import init_db
+from database import close_db, pool_monitor
 from routers.auth import router as auth_router
-from routers.patients import router as patients_router
-from config import Settings
+from routers.patients import router as patients_router, group_cache, response_cache
+from routers.health import router as health_router
+from config import get_settings
+from services.auth import revocation_sync_loop, password_pool, token_cache
+from services.metrics import registry, GaugeCallback, MetricsMiddleware
+from services.compression import CompressionMiddleware
+from services.guardrails import expensive_limiter
+from services.warmup import readiness, warm_up
+from services.change_stream import PatientChangeWatcher
 
-settings = Settings()
+settings = get_settings()
+
+# a checkpointed token only helps a cache that outlives the process
+change_watcher = PatientChangeWatcher(
+    settings.CHANGE_STREAM_PRE_IMAGES, settings.CHANGE_STREAM_CHECKPOINT_SECONDS, settings.CHANGE_STREAM_RETRY_SECONDS,
+    persist_token=settings.CACHE_BACKEND == "redis",
+)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await init_db()
-    yield
+    await warm_up(settings.WARMUP_ENABLED)
+    tasks = [asyncio.create_task(revocation_sync_loop(settings.REVOCATION_SYNC_INTERVAL_SECONDS))]
+    if settings.CHANGE_STREAM_ENABLED:
+        tasks.append(asyncio.create_task(change_watcher.run()))
+    try:
+        yield
+    finally:
+        # stop taking traffic from the load balancer before tearing down
+        readiness.ready = False
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with suppress(asyncio.CancelledError):
+                await task
+        password_pool.shutdown()
+        close_db()
 
 
 app = FastAPI(lifespan=lifespan)
 
 
+@app.exception_handler(ExecutionTimeout)
+async def query_timeout(request: Request, exc: ExecutionTimeout):
+    # a query that ran past MONGO_MAX_TIME_MS was stopped by the server
+    return JSONResponse(status_code=503, content={"detail": "Query took too long, narrow it down or retry shortly"})
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # allow all origins temporarily 
@@ -28,6 +64,48 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if settings.COMPRESSION_ENABLED:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=settings.COMPRESSION_MINIMUM_SIZE,
+        gzip_level=settings.COMPRESSION_GZIP_LEVEL,
+        brotli_quality=settings.COMPRESSION_BROTLI_QUALITY,
+    )
+
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, sample_rate=settings.METRICS_SAMPLE_RATE)
+
+registry.register(GaugeCallback(
+    "mongodb_pool_connections", "Motor connection pool usage", ("state",),
+    lambda: {(state,): value for state, value in pool_monitor.stats(settings.mongo_pool_size()).items()},
+))
+registry.register(GaugeCallback(
+    "password_hash_pool", "bcrypt worker pool usage", ("state",),
+    lambda: {(state,): value for state, value in password_pool.stats().items() if state != "kind"},
+))
+registry.register(GaugeCallback(
+    "expensive_requests", "Per-doctor limiter for expensive endpoints", ("state",),
+    lambda: {(state,): value for state, value in expensive_limiter.stats().items()},
+))
+registry.register(GaugeCallback(
+    "patient_change_stream_total", "Patient change stream events handled and restarts", ("kind",),
+    lambda: {(kind,): value for kind, value in change_watcher.stats().items()},
+    metric_type="counter",
+))
+registry.register(GaugeCallback(
+    "cache_lookups_total", "Cache hits and misses since start", ("cache", "result"),
+    lambda: {
+        ("token", "hit"): token_cache.hits, ("token", "miss"): token_cache.misses,
+        ("group", "hit"): group_cache.hits, ("group", "miss"): group_cache.misses,
+        ("response", "hit"): response_cache.hits, ("response", "miss"): response_cache.misses,
+    },
+    metric_type="counter",
+))
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 def hello():
     return {'message':'Patient Management System API'}
@@ -38,3 +116,4 @@ def about():
 
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
 app.include_router(patients_router, prefix="/patients", tags=["patients"])
+app.include_router(health_router, prefix="/health", tags=["health"])
@@ -0,0 +1,80 @@
+"""Deterministic synthetic patients for benchmarks and load tests.
+
+The same (count, seed) always yields the same documents. Diagnosis history
+lengths follow a long-tailed distribution: most patients have a handful of
+entries, a few chronic patients have dozens. Documents are returned as
+MongoDB stores Patients, including derived fields and disease tokens.
+"""
+import random
+from datetime import datetime, timedelta
+
+from beanie.odm.utils.encoder import Encoder
+
+from models.patient import DiagnosisEntry, compute_bmi, compute_verdict, latest_diagnosis
+
+DISEASES = ["Diabetes", "Type 2 Diabetes", "Hypertension", "Asthma", "Migraine", "Influenza", "Bronchitis",
+            "Arthritis", "Anemia", "Hypothyroidism", "Depression", "Eczema", "Gastritis", "Pneumonia", "Covid-19"]
+CONDITIONS = ["Stable", "Chronic", "Severe", "Mild", "Recovered"]
+CITIES = ["Kathmandu", "Pokhara", "Lalitpur", "Bharatpur", "Biratnagar", "Birgunj", "Dharan", "Butwal"]
+NOTES = ["follow up in 3 months", "responding well to treatment", "refer to specialist", "adjust dosage",
+         "patient reports mild side effects", "repeat blood work", None]
+HISTORY_START = datetime(2015, 1, 1)
+HISTORY_DAYS = 3650
+MAX_DIAGNOSES = 60
+
+
+def history_length(rng: random.Random, mean: float) -> int:
+    # exponential around the mean, truncated to whole entries and capped, so the tail holds a few long chronic histories
+    return min(MAX_DIAGNOSES, int(rng.expovariate(1 / mean)))
+
+
+def generate_patients(count: int, seed: int = 7, doctors: int = 1, mean_diagnoses: float = 4.0, start: int = 0) -> list:
+    """Raw patient documents P{start}..P{start + count - 1}, spread round-robin over bench_doctor_0..N."""
+    encoder = Encoder()
+    docs = []
+    for i in range(start, start + count):
+        # one generator per patient keeps every document independent of how the range is batched
+        rng = random.Random(f"{seed}:{i}")
+        history = []
+        for _ in range(history_length(rng, mean_diagnoses)):
+            history.append({
+                "disease": rng.choice(DISEASES),
+                "condition": rng.choice(CONDITIONS),
+                "diagnosis_on": HISTORY_START + timedelta(days=rng.randrange(HISTORY_DAYS)),
+                "notes": rng.choice(NOTES),
+            })
+        entries = [DiagnosisEntry.model_validate(entry) for entry in history]
+        height = round(rng.uniform(1.4, 2.0), 2) if rng.random() > 0.05 else None
+        weight = round(rng.uniform(40, 130), 1) if rng.random() > 0.05 else None
+        bmi = compute_bmi(height, weight)
+        latest = latest_diagnosis(entries)
+        docs.append(encoder.encode({
+            "_id": f"P{i:07d}",
+            "name": f"Patient {i}",
+            "city": rng.choice(CITIES),
+            "age": rng.randint(1, 99),
+            "gender": rng.choice(["male", "female", "others"]),
+            # a few records lack measurements, as imported legacy data does
+            "height": height,
+            "weight": weight,
+            "doctor_id": doctor_id(i % doctors),
+            "diagnoses_history": [entry.model_dump() for entry in entries],
+            "bmi": bmi,
+            "verdict": compute_verdict(bmi),
+            "latest_condition": latest.condition if latest else None,
+            "latest_diagnosis_date": latest.diagnosis_on if latest else None,
+            "revision": 0,
+        }))
+    return docs
+
+
+def doctor_id(index: int) -> str:
+    return f"bench_doctor_{index}"
+
+
+async def load(collection, count: int, seed: int = 7, doctors: int = 1, mean_diagnoses: float = 4.0, batch_size: int = 5000):
+    """Insert the dataset into a Motor (or mongomock_motor) collection in batches, replacing what was there."""
+    await collection.delete_many({})
+    for start in range(0, count, batch_size):
+        docs = generate_patients(min(batch_size, count - start), seed, doctors, mean_diagnoses, start)
+        await collection.insert_many(docs, ordered=False)
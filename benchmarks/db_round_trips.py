@@ -0,0 +1,141 @@
+"""Count MongoDB operations per request for the patient and register routes, before and after.
+
+"before" replays the database calls the handlers used to make (fetch the
+document, check doctor_id in Python, then write); "after" sends the request
+through the app. Operations are counted at the mongomock collection, one per
+command a real server would receive.
+
+    python benchmarks/db_round_trips.py
+"""
+import asyncio
+import functools
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "mongodb://localhost:27017")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+import httpx  # noqa: E402
+from beanie import init_beanie  # noqa: E402
+from mongomock.collection import Collection  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+from app import app  # noqa: E402
+from models.doctor import Doctor  # noqa: E402
+from models.patient import Patient  # noqa: E402
+from models.revoked_token import RevokedToken  # noqa: E402
+from routers import auth as auth_router  # noqa: E402
+from services.auth import get_current_doctor, password_pool  # noqa: E402
+
+OPERATIONS = ("find", "find_one", "insert_one", "insert_many", "update_one", "replace_one",
+              "find_one_and_update", "find_one_and_delete", "delete_one", "count_documents", "aggregate")
+
+counted = []
+_depth = threading.local()
+
+
+def count_operations():
+    # mongomock implements some operations on top of others; only the outermost call is a command
+    def wrap(name, method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            depth = getattr(_depth, "value", 0)
+            if depth == 0:
+                counted.append(name)
+            _depth.value = depth + 1
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                _depth.value = depth
+        return wrapper
+
+    for name in OPERATIONS:
+        setattr(Collection, name, wrap(name, getattr(Collection, name)))
+
+
+async def measure(action) -> list:
+    counted.clear()
+    await action()
+    return list(counted)
+
+
+def patient(patient_id: str, doctor_id: str = "bench_doctor") -> Patient:
+    return Patient(id=patient_id, name="Alice", city="A", age=30, gender="female", height=1.6, weight=60, doctor_id=doctor_id)
+
+
+# the pre-change handlers' database calls
+async def before_view():
+    found = await Patient.get("P001")
+    assert found.doctor_id == "bench_doctor"
+
+
+async def before_create():
+    assert await Patient.get("P100") is None
+    await patient("P100").create()
+
+
+async def before_edit():
+    found = await Patient.get("P001")
+    found.weight = 70
+    await found.save()
+
+
+async def before_delete():
+    found = await Patient.get("P002")
+    await found.delete()
+
+
+async def before_register():
+    assert await Doctor.find_one(Doctor.username == "new_doctor") is None
+    await Doctor(username="new_doctor", password="hash").create()
+
+
+async def main():
+    client = AsyncMongoMockClient()
+    await init_beanie(database=client.get_database("bench"), document_models=[Doctor, Patient, RevokedToken])
+    count_operations()
+    app.dependency_overrides[get_current_doctor] = lambda: "bench_doctor"
+    auth_router.get_password_hash = lambda password: "hash"
+
+    async def inline_run(func, *func_args):
+        return func(*func_args)
+    password_pool.run = inline_run
+
+    async def reset():
+        await Patient.get_motor_collection().delete_many({})
+        await Doctor.get_motor_collection().delete_many({})
+        await patient("P001").insert()
+        await patient("P002").insert()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        async def request(method, url, **kwargs):
+            response = await http.request(method, url, **kwargs)
+            assert response.status_code < 300, response.text
+
+        body = {"id": "P100", "name": "Alice", "city": "A", "age": 30, "gender": "female"}
+        routes = [
+            ("GET /patients/patient/{id}", before_view, lambda: request("GET", "/patients/patient/P001")),
+            ("POST /patients/create", before_create, lambda: request("POST", "/patients/create", json=body)),
+            ("PUT /patients/edit/{id} city", before_edit, lambda: request("PUT", "/patients/edit/P001", json={"city": "B"})),
+            ("PUT /patients/edit/{id} weight", before_edit, lambda: request("PUT", "/patients/edit/P001", json={"weight": 70})),
+            ("DELETE /patients/delete/{id}", before_delete, lambda: request("DELETE", "/patients/delete/P002")),
+            ("POST /auth/register", before_register,
+             lambda: request("POST", "/auth/register", json={"username": "new_doctor", "password": "secret"})),
+        ]
+
+        print(f"{'route':<32} {'before':>6} {'after':>6}  after ops")
+        for name, before, after in routes:
+            await reset()
+            before_ops = await measure(before)
+            await reset()
+            after_ops = await measure(after)
+            print(f"{name:<32} {len(before_ops):>6} {len(after_ops):>6}  {', '.join(after_ops)}")
+    app.dependency_overrides = {}
+    password_pool.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+"""Benchmark: legacy chained /filter predicates vs the $elemMatch diagnosis filter.
+
+The legacy query matches disease, condition and date against any diagnosis, so
+it returns patients where they come from different entries. This reports how
+many documents (and bytes) each query sends back, its median latency and the
+explain() key/document counts. Needs a real mongod.
+
+    python benchmarks/diagnosis_filter.py --uri mongodb://localhost:27017 --sizes 10000,100000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bson  # noqa: E402
+from pymongo import ASCENDING, MongoClient  # noqa: E402
+
+from benchmarks.disease_search import DOCTOR, seed  # noqa: E402
+from services.filters import diagnosis_filter  # noqa: E402
+
+
+def legacy_query(disease: str, condition: str, months: int) -> dict:
+    return {
+        "doctor_id": DOCTOR,
+        "diagnoses_history.disease": {"$regex": disease, "$options": "i"},
+        "diagnoses_history.condition": condition,
+        "diagnoses_history.diagnosis_on": {"$gte": datetime.combine(date.today() - timedelta(days=months * 30), datetime.min.time())},
+    }
+
+
+def measure(collection, query: dict, runs: int):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        docs = list(collection.find(query))
+        timings.append((time.perf_counter() - start) * 1000)
+    size = sum(len(bson.encode(doc)) for doc in docs)
+    stats = collection.find(query).explain()["executionStats"]
+    return statistics.median(timings), len(docs), size, stats["totalKeysExamined"], stats["totalDocsExamined"]
+
+
+def main(args):
+    client = MongoClient(args.uri)
+    collection = client[args.db]["patients"]
+    rng = random.Random(args.seed)
+    new_query = {"doctor_id": DOCTOR, **diagnosis_filter(args.disease, "exact", args.condition, args.months)}
+    print(f"{'diagnoses':>10} {'query':<10} {'median ms':>10} {'docs':>8} {'bytes':>12} {'keys':>10} {'examined':>10}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        seed(collection, size, rng, conditions=("Stable", "Chronic", "Severe"))
+        collection.create_index([("doctor_id", ASCENDING), ("diagnoses_history.disease_token", ASCENDING),
+                                 ("diagnoses_history.condition", ASCENDING), ("diagnoses_history.diagnosis_on", ASCENDING)])
+        for name, query in (("legacy", legacy_query(args.disease, args.condition, args.months)), ("elemMatch", new_query)):
+            median, count, nbytes, keys, examined = measure(collection, query, args.runs)
+            print(f"{size:>10} {name:<10} {median:>10.1f} {count:>8} {nbytes:>12} {keys:>10} {examined:>10}")
+    if not args.keep:
+        client.drop_database(args.db)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default=os.environ.get("DATABASE_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="medix_bench")
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--disease", default="Diabetes")
+    parser.add_argument("--condition", default="Chronic")
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch database afterwards")
+    main(parser.parse_args())
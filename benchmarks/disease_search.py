@@ -0,0 +1,93 @@
+"""Benchmark: legacy unanchored /filter disease regex vs the indexed disease_token search.
+
+Needs a real mongod (mongomock has no indexes). Seeds a scratch database with
+one doctor's patients carrying 5 diagnoses each, then times every search mode
+and reports the keys/documents examined from explain().
+
+    python benchmarks/disease_search.py --uri mongodb://localhost:27017 --sizes 10000,100000,1000000
+"""
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import ASCENDING, MongoClient  # noqa: E402
+
+from benchmarks.dataset import DISEASES  # noqa: E402
+from models.patient import normalize_disease  # noqa: E402
+
+DIAGNOSES_PER_PATIENT = 5
+DOCTOR = "bench_doctor"
+
+
+def seed(collection, diagnoses: int, rng: random.Random, conditions=("Stable",)):
+    collection.drop()
+    collection.create_index([("doctor_id", ASCENDING), ("diagnoses_history.disease_token", ASCENDING)])
+    collection.create_index([("doctor_id", ASCENDING), ("diagnoses_history.disease", ASCENDING)])
+    batch = []
+    start = datetime(2020, 1, 1)
+    for i in range(diagnoses // DIAGNOSES_PER_PATIENT):
+        history = []
+        for _ in range(DIAGNOSES_PER_PATIENT):
+            disease = rng.choice(DISEASES)
+            history.append({"disease": disease, "disease_token": normalize_disease(disease), "condition": rng.choice(conditions),
+                            "diagnosis_on": start + timedelta(days=rng.randrange((datetime.now() - start).days))})
+        batch.append({"_id": f"P{i:07d}", "name": f"Patient {i}", "doctor_id": DOCTOR, "diagnoses_history": history})
+        if len(batch) == 5000:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+
+
+def queries(term: str) -> dict:
+    token = normalize_disease(term)
+    return {
+        "legacy regex/i": {"diagnoses_history.disease": {"$regex": term, "$options": "i"}},
+        "token contains": {"diagnoses_history.disease_token": {"$regex": re.escape(token)}},
+        "token prefix": {"diagnoses_history.disease_token": {"$regex": f"^{re.escape(token)}"}},
+        "token exact": {"diagnoses_history.disease_token": token},
+    }
+
+
+def measure(collection, predicate: dict, runs: int):
+    query = {"doctor_id": DOCTOR, **predicate}
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        count = sum(1 for _ in collection.find(query, {"_id": 1}))
+        timings.append((time.perf_counter() - start) * 1000)
+    stats = collection.find(query, {"_id": 1}).explain()["executionStats"]
+    return statistics.median(timings), count, stats["totalKeysExamined"], stats["totalDocsExamined"]
+
+
+def main(args):
+    client = MongoClient(args.uri)
+    collection = client[args.db]["patients"]
+    rng = random.Random(args.seed)
+    print(f"{'diagnoses':>10} {'mode':<16} {'median ms':>10} {'matches':>9} {'keys':>10} {'docs':>10}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        seed(collection, size, rng)
+        for mode, predicate in queries(args.term).items():
+            median, count, keys, docs = measure(collection, predicate, args.runs)
+            print(f"{size:>10} {mode:<16} {median:>10.1f} {count:>9} {keys:>10} {docs:>10}")
+    if not args.keep:
+        client.drop_database(args.db)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default=os.environ.get("DATABASE_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="medix_bench")
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--term", default="Diabetes")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch database afterwards")
+    main(parser.parse_args())
@@ -0,0 +1,102 @@
+"""Rows per second and peak Python memory of the patient export, per format and flattening.
+
+Two measurements per format:
+
+- "encode" feeds services.exporter.encode_chunks --patients documents cycled
+  from one pre-generated batch, so it isolates the exporter from the
+  database. Its peak memory (tracemalloc) should stay flat as --patients
+  grows with a fixed --batch-size.
+- "db" runs the whole export_patients over a seeded collection: mongomock by
+  default, or a scratch database on a real mongod with --uri. mongomock
+  builds the whole result set in Python before the first document, so its
+  memory grows with the dataset and its rows/s is far below a local mongod's.
+
+    python benchmarks/export_throughput.py --patients 20000 --batch-size 1000
+    python benchmarks/export_throughput.py --uri mongodb://localhost:27017 --patients 200000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "mongodb://localhost:27017")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+import motor.motor_asyncio  # noqa: E402
+from beanie import init_beanie  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+from benchmarks import dataset  # noqa: E402
+from models.patient import Patient  # noqa: E402
+from services.exporter import encode_chunks, export_patients, parquet_available  # noqa: E402
+
+SCRATCH_DB = "patient_benchmarks"
+
+
+def row_count(docs, flatten: str) -> int:
+    return sum(1 if flatten == "patient" else max(1, len(doc["diagnoses_history"])) for doc in docs)
+
+
+async def cycled(pool: list, count: int):
+    for i in range(count):
+        yield pool[i % len(pool)]
+
+
+async def drain(chunks) -> int:
+    output = 0
+    async for chunk in chunks:
+        output += len(chunk)
+    return output
+
+
+async def measure(make_chunks) -> tuple:
+    """(seconds, output bytes, peak traced bytes) of an export, timed on a separate untraced run."""
+    start = time.perf_counter()
+    output = await drain(make_chunks())
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    await drain(make_chunks())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, output, peak
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", help="real mongod to seed a scratch database on; mongomock when omitted")
+    parser.add_argument("--patients", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--mean-diagnoses", type=float, default=4.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    client = motor.motor_asyncio.AsyncIOMotorClient(args.uri) if args.uri else AsyncMongoMockClient()
+    await init_beanie(database=client.get_database(SCRATCH_DB), document_models=[Patient])
+    await dataset.load(Patient.get_motor_collection(), args.patients, args.seed, 1, args.mean_diagnoses)
+
+    pool = dataset.generate_patients(args.batch_size, args.seed, 1, args.mean_diagnoses)
+    seeded = dataset.generate_patients(args.patients, args.seed, 1, args.mean_diagnoses)
+    formats = ["csv", "ndjson"] + (["parquet"] if parquet_available() else [])
+    print(f"{'source':<7} {'format':<8} {'flatten':<10} {'rows':>9} {'rows/s':>10} {'MB out':>8} {'peak MB':>8}")
+    for export_format in formats:
+        for flatten in ("patient", "diagnosis"):
+            full, partial = divmod(args.patients, len(pool))
+            sources = {
+                "encode": (lambda: encode_chunks(cycled(pool, args.patients), export_format, flatten, args.batch_size),
+                           full * row_count(pool, flatten) + row_count(pool[:partial], flatten)),
+                "db": (lambda: export_patients(dataset.doctor_id(0), export_format, flatten, args.batch_size),
+                       row_count(seeded, flatten)),
+            }
+            for source, (make_chunks, rows) in sources.items():
+                elapsed, output, peak = await measure(make_chunks)
+                print(f"{source:<7} {export_format:<8} {flatten:<10} {rows:>9} {rows / elapsed:>10.0f} "
+                      f"{output / 1e6:>8.1f} {peak / 1e6:>8.1f}")
+    if args.uri:
+        await client.drop_database(SCRATCH_DB)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+"""Load test: /patients/view latency while a storm of logins hits bcrypt.
+
+Runs the app in-process (one event loop, like a single uvicorn worker) against
+mongomock and compares p50/p99 of /patients/view with and without concurrent
+logins, once with bcrypt inline on the event loop and once through the
+password hash pool.
+
+    python benchmarks/login_storm.py --requests 150 --rate 30 --logins 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "mongodb://localhost:27017")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+import httpx  # noqa: E402
+from beanie import init_beanie  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+from app import app  # noqa: E402
+from benchmarks.results import percentile  # noqa: E402
+from models.doctor import Doctor  # noqa: E402
+from models.patient import Patient  # noqa: E402
+from models.revoked_token import RevokedToken  # noqa: E402
+from services.auth import create_access_token, get_password_hash, password_pool  # noqa: E402
+
+
+async def seed(patients: int):
+    client = AsyncMongoMockClient()
+    await init_beanie(database=client.get_database("bench"), document_models=[Doctor, Patient, RevokedToken])
+    await Doctor(username="storm_doctor", password=get_password_hash("storm-password")).create()
+    for i in range(patients):
+        await Patient(id=f"P{i:05d}", name=f"Patient {i}", city="Kathmandu", age=20 + i % 60, gender="female",
+                      height=1.6, weight=60, doctor_id="storm_doctor").create()
+
+
+async def view_latencies(http, token, requests, rate):
+    # open loop: latency is measured from each request's scheduled send time, so a
+    # blocked event loop shows up as latency instead of silently delaying the sender
+    latencies = []
+    t0 = time.perf_counter()
+
+    async def one(i):
+        scheduled = t0 + i / rate
+        await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+        response = await http.get("/patients/view", params={"limit": 50}, headers={"Authorization": f"Bearer {token}"})
+        latencies.append((time.perf_counter() - scheduled) * 1000)
+        response.raise_for_status()
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return latencies
+
+
+async def login_storm(http, logins):
+    body = {"username": "storm_doctor", "password": "storm-password"}
+    responses = await asyncio.gather(*(http.post("/auth/login", json=body) for _ in range(logins)))
+    return sum(r.status_code == 200 for r in responses)
+
+
+async def run_scenario(http, token, args, storm):
+    if not storm:
+        return await view_latencies(http, token, args.requests, args.rate), 0
+    storm_task = asyncio.create_task(login_storm(http, args.logins))
+    latencies = await view_latencies(http, token, args.requests, args.rate)
+    return latencies, await storm_task
+
+
+async def main(args):
+    await seed(args.patients)
+    token = create_access_token(data={"sub": "storm_doctor"})
+    transport = httpx.ASGITransport(app=app)
+    pooled_run = password_pool.run
+
+    async def inline_run(func, *func_args):
+        return func(*func_args)
+
+    print(f"{'mode':<8} {'storm':<6} {'p50 ms':>8} {'p99 ms':>8} {'logins ok':>10}")
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        for mode in ("inline", "pool"):
+            password_pool.run = inline_run if mode == "inline" else pooled_run
+            for storm in (False, True):
+                latencies, ok = await run_scenario(http, token, args, storm)
+                print(f"{mode:<8} {str(storm):<6} {statistics.median(latencies):>8.1f} {percentile(latencies, 99):>8.1f} {ok:>10}")
+    password_pool.run = pooled_run
+    password_pool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=150)
+    parser.add_argument("--rate", type=float, default=30, help="/patients/view requests per second")
+    parser.add_argument("--logins", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,82 @@
+"""Bytes on the wire and estimated latency on slow mobile links for /patients/view.
+
+Pages of patients with a realistic diagnoses_history are fetched in-process,
+full and with ?fields=, uncompressed, gzipped and (with brotli installed)
+brotli-compressed. Link time is modelled as one round trip plus the
+compressed body over the link's downstream bandwidth, added to the measured
+server time; TCP slow start and TLS are left out, so real links are slower.
+
+    python benchmarks/payload_size.py --patients 500 --limit 100
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "mongodb://localhost:27017")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+import httpx  # noqa: E402
+from beanie import init_beanie  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+from app import app  # noqa: E402
+from benchmarks.serialization import raw_documents  # noqa: E402
+from models.patient import Patient  # noqa: E402
+from routers.patients import response_cache  # noqa: E402
+from services.auth import get_current_doctor  # noqa: E402
+from services.compression import brotli  # noqa: E402
+
+# (downstream kbit/s, round trip ms), after Chrome DevTools' network presets
+LINKS = {"3G": (750, 100), "slow 3G": (400, 400)}
+
+
+async def seed(patients: int, diagnoses: int, seed: int):
+    await init_beanie(database=AsyncMongoMockClient().get_database("bench"), document_models=[Patient])
+    docs = raw_documents(patients, diagnoses, random.Random(seed))
+    await Patient.insert_many([Patient.model_validate(doc) for doc in docs])
+
+
+async def fetch(http, params: dict, accept_encoding: str, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        # measure rendering, not the response cache
+        await response_cache.clear()
+        start = time.perf_counter()
+        async with http.stream("GET", "/patients/view", params=params, headers={"Accept-Encoding": accept_encoding}) as response:
+            body = b"".join([chunk async for chunk in response.aiter_raw()])
+        timings.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+    return len(body), statistics.median(timings)
+
+
+async def main(args):
+    await seed(args.patients, args.diagnoses, args.seed)
+    app.dependency_overrides[get_current_doctor] = lambda: "bench_doctor"
+    encodings = ["identity", "gzip"] + (["br"] if brotli is not None else [])
+    shapes = {"full": {}, f"fields={args.fields}": {"fields": args.fields}}
+
+    link_columns = "".join(f" {name + ' ms':>12}" for name in LINKS)
+    print(f"{'shape':<38} {'encoding':<9} {'bytes':>9} {'server ms':>10}{link_columns}")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as http:
+        for shape, params in shapes.items():
+            for encoding in encodings:
+                size, server_ms = await fetch(http, {"limit": args.limit, **params}, encoding, args.repeat)
+                links = "".join(f" {server_ms + rtt + size * 8 / kbps:>12.0f}" for kbps, rtt in LINKS.values())
+                print(f"{shape:<38} {encoding:<9} {size:>9} {server_ms:>10.1f}{links}")
+    app.dependency_overrides = {}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=500)
+    parser.add_argument("--diagnoses", type=int, default=10)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--fields", default="name,verdict,latest_condition")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,73 @@
+"""Benchmark result files and regression comparison.
+
+A result file is JSON: {"kind", "params", "environment", "results": {name: metrics}},
+where every entry has at least throughput (operations per second) and p95_ms.
+"""
+import json
+import platform
+import statistics
+import sys
+from datetime import datetime, timezone
+
+LOWER_IS_WORSE = ("throughput",)
+HIGHER_IS_WORSE = ("p95_ms",)
+
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(latencies_ms: list, elapsed_s: float) -> dict:
+    """Throughput and latency percentiles for operations measured over elapsed_s seconds."""
+    if not latencies_ms:
+        return {"operations": 0, "throughput": 0.0, "p50_ms": None, "p95_ms": None, "p99_ms": None}
+    return {
+        "operations": len(latencies_ms),
+        "throughput": round(len(latencies_ms) / elapsed_s, 2),
+        "mean_ms": round(statistics.fmean(latencies_ms), 4),
+        "p50_ms": round(percentile(latencies_ms, 50), 4),
+        "p95_ms": round(percentile(latencies_ms, 95), 4),
+        "p99_ms": round(percentile(latencies_ms, 99), 4),
+    }
+
+
+def write_results(path: str, kind: str, params: dict, results: dict):
+    payload = {
+        "kind": kind,
+        "params": params,
+        "environment": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        },
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
+
+
+def read_results(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """One row per shared benchmark and metric, flagged when it got worse by more than threshold (0.1 = 10%)."""
+    rows = []
+    for name in sorted(baseline["results"].keys() & current["results"].keys()):
+        before, after = baseline["results"][name], current["results"][name]
+        for metric in LOWER_IS_WORSE + HIGHER_IS_WORSE:
+            if not before.get(metric) or after.get(metric) is None:
+                continue
+            change = (after[metric] - before[metric]) / before[metric]
+            worse = -change if metric in LOWER_IS_WORSE else change
+            rows.append({
+                "benchmark": name,
+                "metric": metric,
+                "baseline": before[metric],
+                "current": after[metric],
+                "change": round(change, 4),
+                "regression": worse > threshold,
+            })
+    return rows
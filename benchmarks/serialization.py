@@ -0,0 +1,86 @@
+"""Microbenchmark: per-document cost of the model response path vs the raw orjson fast path.
+
+Model path: validate the raw document into Patient (as Beanie does on read),
+then jsonable_encoder + json.dumps (as FastAPI does on response).
+Fast path: serialize_raw_patient on the projected dict + orjson.dumps.
+
+    python benchmarks/serialization.py --docs 5000 --diagnoses 10
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "mongodb://localhost:27017")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+import orjson  # noqa: E402
+from beanie import init_beanie  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+from models.patient import Patient  # noqa: E402
+from services.serialization import raw_projection, serialize_raw_patient  # noqa: E402
+
+
+def raw_documents(count: int, diagnoses: int, rng: random.Random) -> list:
+    docs = []
+    for i in range(count):
+        history = [{"disease": rng.choice(["Flu", "Asthma", "Type 2 Diabetes"]), "condition": "Stable",
+                    "diagnosis_on": datetime(2020, 1, 1) + timedelta(days=rng.randrange(1500)), "notes": "follow up in 3 months"}
+                   for _ in range(diagnoses)]
+        doc = {"_id": f"P{i:06d}", "name": f"Patient {i}", "city": "Kathmandu", "age": 20 + i % 60, "gender": "female",
+               "height": 1.6, "weight": 50 + i % 50, "doctor_id": "bench_doctor", "diagnoses_history": history}
+        docs.append(doc)
+    return docs
+
+
+def model_path(docs: list) -> int:
+    total = 0
+    for doc in docs:
+        total += len(json.dumps(jsonable_encoder(Patient.model_validate(doc))))
+    return total
+
+
+def fast_path(docs: list, projection: dict) -> int:
+    total = 0
+    for doc in docs:
+        total += len(orjson.dumps(serialize_raw_patient(doc, projection)))
+    return total
+
+
+def timed(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+async def main(args):
+    await init_beanie(database=AsyncMongoMockClient().get_database("bench"), document_models=[Patient])
+    rng = random.Random(args.seed)
+    projection = raw_projection()
+    base = raw_documents(args.docs, args.diagnoses, rng)
+    # documents as stored today carry their derived fields and disease tokens
+    stored = [Patient.model_validate(doc).model_dump(by_alias=True, exclude={"revision_id"}) for doc in base]
+
+    print(f"{'path':<36} {'us/doc':>8}")
+    for label, docs in (("legacy documents", base), ("documents with stored fields", stored)):
+        model_s = min(timed(model_path, copy.deepcopy(docs)) for _ in range(args.repeat))
+        fast_s = min(timed(fast_path, copy.deepcopy(docs), projection) for _ in range(args.repeat))
+        print(f"{'model  / ' + label:<36} {model_s / args.docs * 1e6:>8.1f}")
+        print(f"{'fast   / ' + label:<36} {fast_s / args.docs * 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--diagnoses", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    asyncio.run(main(parser.parse_args()))
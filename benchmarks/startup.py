@@ -0,0 +1,124 @@
+"""Time-to-first-request of a fresh worker, with and without the startup warmup.
+
+Each run is a new Python process, so imports are cold, as after a deploy. It
+imports the app and runs its lifespan: Beanie init, then with
+WARMUP_ENABLED=true also bcrypt, JWT and the Mongo pool. It then sends the
+first login and the first authenticated /patients/view, and a second login
+as the steady-state reference. The database is mongomock by default, or a
+real mongod with --uri, whose first requests also pay for opening
+connections.
+
+    python benchmarks/startup.py --runs 5
+    python benchmarks/startup.py --runs 5 --uri mongodb://localhost:27017
+"""
+import time
+
+PROCESS_START = time.perf_counter()
+
+import argparse  # noqa: E402
+import asyncio  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import statistics  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRATCH_DB = "startup_benchmark"
+USERNAME = "startup_doctor"
+PASSWORD = "startup-password"
+METRICS = ("import_ms", "startup_ms", "first_login_ms", "first_view_ms", "second_login_ms", "time_to_first_request_ms")
+
+
+def elapsed_ms(start: float) -> float:
+    return (time.perf_counter() - start) * 1000
+
+
+async def child(uri: str, password_hash: str) -> dict:
+    sys.path.insert(0, ROOT)
+    start = time.perf_counter()
+    import httpx
+    import motor.motor_asyncio
+    from mongomock_motor import AsyncMongoMockClient
+
+    import database
+    from app import app
+    from services.warmup import readiness
+    result = {"import_ms": elapsed_ms(start)}
+
+    doctor = {"username": USERNAME, "password": password_hash}
+    patient = {"_id": "P0000001", "name": "Alice", "city": "A", "age": 30, "gender": "female", "doctor_id": USERNAME}
+    if uri:
+        # seeded with a throwaway client, so the app's own pool starts empty
+        seeding = motor.motor_asyncio.AsyncIOMotorClient(uri)
+        await seeding.drop_database(SCRATCH_DB)
+        await seeding[SCRATCH_DB]["doctors"].insert_one(doctor)
+        await seeding[SCRATCH_DB]["patients"].insert_one(patient)
+        seeding.close()
+    else:
+        database._client = AsyncMongoMockClient()
+        await database.get_database()["doctors"].insert_one(doctor)
+        await database.get_database()["patients"].insert_one(patient)
+
+    start = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        result["startup_ms"] = elapsed_ms(start)
+        result["warmup_ms"] = dict(readiness.steps)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            start = time.perf_counter()
+            response = await http.post("/auth/login", json={"username": USERNAME, "password": PASSWORD})
+            assert response.status_code == 200, response.text
+            result["first_login_ms"] = elapsed_ms(start)
+            result["time_to_first_request_ms"] = elapsed_ms(PROCESS_START)
+
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+            start = time.perf_counter()
+            assert (await http.get("/patients/view", headers=headers)).status_code == 200
+            result["first_view_ms"] = elapsed_ms(start)
+
+            start = time.perf_counter()
+            await http.post("/auth/login", json={"username": USERNAME, "password": PASSWORD})
+            result["second_login_ms"] = elapsed_ms(start)
+    return result
+
+
+def run_child(uri: str, password_hash: str, warmup: bool) -> dict:
+    env = {**os.environ, "WARMUP_ENABLED": "true" if warmup else "false", "MONGO_DB_NAME": SCRATCH_DB}
+    env.setdefault("SECRET_KEY", "benchmark-secret")
+    env["DATABASE_URL"] = uri or env.get("DATABASE_URL", "mongodb://localhost:27017")
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--password-hash", password_hash]
+    if uri:
+        command += ["--uri", uri]
+    output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", help="real mongod to seed a scratch database on; mongomock when omitted")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--password-hash", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(child(args.uri, args.password_hash))))
+        return
+
+    from passlib.context import CryptContext
+    rounds = int(os.environ.get("BCRYPT_ROUNDS", 12))
+    password_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds).hash(PASSWORD)
+
+    print(f"{'warmup':<7} " + " ".join(f"{metric.removesuffix('_ms'):>24}" for metric in METRICS))
+    for warmup in (False, True):
+        runs = [run_child(args.uri, password_hash, warmup) for _ in range(args.runs)]
+        medians = [statistics.median(run[metric] for run in runs) for metric in METRICS]
+        print(f"{'on' if warmup else 'off':<7} " + " ".join(f"{value:>24.1f}" for value in medians))
+        if warmup:
+            steps = {step: statistics.median(run["warmup_ms"][step] for run in runs) for step in runs[0]["warmup_ms"]}
+            print("warmup steps (median ms): " + ", ".join(f"{step} {ms:.1f}" for step, ms in steps.items()))
+
+
+if __name__ == "__main__":
+    main()
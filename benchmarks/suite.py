@@ -0,0 +1,222 @@
+"""Benchmark suite: microbenchmarks, a concurrent load driver and regression comparison.
+
+Both runners seed a deterministic dataset (benchmarks/dataset.py) into
+mongomock by default or into a scratch database on a real mongod with --uri,
+and write their results as JSON.
+
+    python benchmarks/suite.py micro --patients 2000 --output micro.json
+    python benchmarks/suite.py load --patients 20000 --doctors 20 --concurrency 32 --duration 30 --output load.json
+    python benchmarks/suite.py compare baseline.json load.json --threshold 0.10
+
+compare prints every shared metric and exits with status 1 when throughput
+dropped or p95 latency grew by more than the threshold.
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "mongodb://localhost:27017")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+import httpx  # noqa: E402
+import motor.motor_asyncio  # noqa: E402
+import orjson  # noqa: E402
+from beanie import init_beanie  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+from benchmarks import dataset  # noqa: E402
+from benchmarks.results import compare, read_results, summarize, write_results  # noqa: E402
+from models.doctor import Doctor  # noqa: E402
+from models.patient import DiagnosisEntry, Patient, compute_bmi, compute_verdict, latest_diagnosis  # noqa: E402
+from models.patient_stats import PatientStats  # noqa: E402
+from models.revoked_token import RevokedToken  # noqa: E402
+from services.grouping import GROUP_KEYS, group_pipeline  # noqa: E402
+from services.serialization import raw_projection, serialize_raw_patient  # noqa: E402
+from services.stats import stats_pipeline  # noqa: E402
+
+SCRATCH_DB = "patient_benchmarks"
+
+
+async def setup_database(args):
+    client = motor.motor_asyncio.AsyncIOMotorClient(args.uri) if args.uri else AsyncMongoMockClient()
+    await init_beanie(database=client.get_database(SCRATCH_DB), document_models=[Doctor, Patient, RevokedToken, PatientStats])
+    await dataset.load(Patient.get_motor_collection(), args.patients, args.seed, args.doctors, args.mean_diagnoses)
+    return client
+
+
+def time_each(func, items) -> list:
+    """Run func on every item and return per-call milliseconds."""
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        func(item)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def model_serialization(doc: dict):
+    json.dumps(jsonable_encoder(Patient.model_validate(doc)))
+
+
+def derived_fields(doc: dict):
+    bmi = compute_bmi(doc["height"], doc["weight"])
+    compute_verdict(bmi)
+    latest_diagnosis([DiagnosisEntry.model_validate(entry) for entry in doc["diagnoses_history"]])
+
+
+async def run_micro(args) -> dict:
+    await setup_database(args)
+    docs = dataset.generate_patients(args.patients, args.seed, args.doctors, args.mean_diagnoses)
+    projection = raw_projection()
+    results = {}
+
+    def record(name, func, items):
+        rounds = [time_each(func, copy.deepcopy(items)) for _ in range(args.repeat)]
+        samples = [ms for latencies in rounds for ms in latencies]
+        results[name] = summarize(samples, sum(samples) / 1000)
+
+    record("serialize.model", model_serialization, docs)
+    record("serialize.fast", lambda doc: orjson.dumps(serialize_raw_patient(doc, projection)), docs)
+    record("derived_fields", derived_fields, docs)
+
+    collection = Patient.get_motor_collection()
+    for by in GROUP_KEYS:
+        samples = []
+        for _ in range(args.repeat):
+            for doctor in range(args.doctors):
+                start = time.perf_counter()
+                await collection.aggregate(group_pipeline(dataset.doctor_id(doctor), by, members=5)).to_list(None)
+                samples.append((time.perf_counter() - start) * 1000)
+        results[f"aggregate.group_{by}"] = summarize(samples, sum(samples) / 1000)
+
+    samples = []
+    for _ in range(args.repeat):
+        for doctor in range(args.doctors):
+            start = time.perf_counter()
+            await collection.aggregate(stats_pipeline(dataset.doctor_id(doctor))).to_list(None)
+            samples.append((time.perf_counter() - start) * 1000)
+    results["aggregate.stats"] = summarize(samples, sum(samples) / 1000)
+    return results
+
+
+def endpoint_mix(rng: random.Random, patients: int) -> tuple:
+    """(name, path, params) of one request drawn from a dashboard-like mix."""
+    choice = rng.random()
+    if choice < 0.35:
+        return "view", "/patients/view", {"limit": 50}
+    if choice < 0.55:
+        return "patient", f"/patients/patient/P{rng.randrange(patients):07d}", {}
+    if choice < 0.70:
+        return "sort", "/patients/sort", {"sort_by": rng.choice(["bmi", "latest_diagnosis_date", "age"]), "order": "desc", "limit": 50}
+    if choice < 0.80:
+        return "filter", "/patients/filter", {"disease_name": rng.choice(dataset.DISEASES)[:4], "limit": 50}
+    if choice < 0.92:
+        return "group", "/patients/group", {"by": rng.choice(list(GROUP_KEYS))}
+    return "stats", "/patients/stats", {}
+
+
+async def run_load(args) -> dict:
+    from app import app
+    from services.auth import create_access_token
+    from services.cache import invalidate_doctor
+
+    tokens = [create_access_token(data={"sub": dataset.doctor_id(i)}) for i in range(args.doctors)]
+    if args.base_url:
+        http = httpx.AsyncClient(base_url=args.base_url, timeout=60)
+    else:
+        await setup_database(args)
+        http = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60)
+
+    latencies = {}
+    errors = 0
+    deadline = time.perf_counter() + args.duration
+
+    async def worker(index: int):
+        nonlocal errors
+        rng = random.Random(f"{args.seed}:worker:{index}")
+        while time.perf_counter() < deadline:
+            doctor = rng.randrange(args.doctors)
+            name, path, params = endpoint_mix(rng, args.patients)
+            if name == "patient":
+                # the dataset spreads patients round-robin, so pick one of this doctor's
+                number = rng.randrange(doctor, args.patients, args.doctors)
+                path = f"/patients/patient/P{number:07d}"
+            if args.cold and not args.base_url:
+                await invalidate_doctor(dataset.doctor_id(doctor))
+            start = time.perf_counter()
+            response = await http.get(path, params=params, headers={"Authorization": f"Bearer {tokens[doctor]}"})
+            latencies.setdefault(name, []).append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    async with http:
+        await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    results = {f"load.{name}": summarize(samples, elapsed) for name, samples in sorted(latencies.items())}
+    results["load.all"] = summarize([ms for samples in latencies.values() for ms in samples], elapsed)
+    results["load.all"]["errors"] = errors
+    return results
+
+
+def print_results(results: dict):
+    print(f"{'benchmark':<28} {'ops':>8} {'ops/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, r in results.items():
+        print(f"{name:<28} {r['operations']:>8} {r['throughput']:>10.1f} {r['p50_ms']:>9.3f} {r['p95_ms']:>9.3f} {r['p99_ms']:>9.3f}")
+
+
+def run_compare(args) -> int:
+    rows = compare(read_results(args.baseline), read_results(args.current), args.threshold)
+    print(f"{'benchmark':<28} {'metric':<11} {'baseline':>10} {'current':>10} {'change':>8}")
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"{row['benchmark']:<28} {row['metric']:<11} {row['baseline']:>10.3f} {row['current']:>10.3f} {row['change']:>+8.1%}{flag}")
+    return 1 if any(row["regression"] for row in rows) else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    for name in ("micro", "load"):
+        command = commands.add_parser(name)
+        command.add_argument("--uri", help="real mongod to seed a scratch database on; mongomock when omitted")
+        command.add_argument("--patients", type=int, default=2000)
+        command.add_argument("--doctors", type=int, default=4)
+        command.add_argument("--mean-diagnoses", type=float, default=4.0)
+        command.add_argument("--seed", type=int, default=7)
+        command.add_argument("--output", help="write results to this JSON file")
+    commands.choices["micro"].add_argument("--repeat", type=int, default=3)
+    load = commands.choices["load"]
+    load.add_argument("--concurrency", type=int, default=16)
+    load.add_argument("--duration", type=float, default=10, help="seconds")
+    load.add_argument("--cold", action="store_true", help="invalidate the doctor's cached responses before each request")
+    load.add_argument("--base-url", help="drive a running server (seeded with the same dataset and SECRET_KEY) instead of the app in-process")
+
+    compare_command = commands.add_parser("compare")
+    compare_command.add_argument("baseline")
+    compare_command.add_argument("current")
+    compare_command.add_argument("--threshold", type=float, default=0.10, help="allowed relative slowdown, 0.10 = 10%%")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        sys.exit(run_compare(args))
+
+    runner = run_micro if args.command == "micro" else run_load
+    results = asyncio.run(runner(args))
+    print_results(results)
+    if args.output:
+        params = {key: value for key, value in vars(args).items() if key not in ("command", "output")}
+        write_results(args.output, args.command, params, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,125 @@
+from functools import lru_cache
+from typing import Dict, Literal, Optional
+from pydantic import BaseModel, Field, model_validator
 from pydantic_settings import BaseSettings
 
+ReadPreferenceName = Literal["primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest"]
+
+
+class ReadRoute(BaseModel):
+    """How one class of routes reads; unset options fall back to the client's."""
+
+    read_preference: Optional[ReadPreferenceName] = None
+    # MongoDB requires at least 90 seconds
+    max_staleness_seconds: Optional[int] = Field(default=None, ge=90)
+    read_concern: Optional[Literal["local", "available", "majority", "linearizable"]] = None
+
+    @model_validator(mode="after")
+    def _staleness_needs_secondaries(self):
+        if self.max_staleness_seconds is not None and self.read_preference in (None, "primary"):
+            raise ValueError("max_staleness_seconds needs a read_preference other than primary")
+        return self
+
+
 class Settings(BaseSettings):
     DATABASE_URL: str
     SECRET_KEY: str
 
+    MONGO_DB_NAME: str = "db_name"
+    # per uvicorn worker; MONGO_TOTAL_MAX_CONNECTIONS, when set, is split across WEB_CONCURRENCY workers instead
+    MONGO_MAX_POOL_SIZE: int = 20
+    MONGO_TOTAL_MAX_CONNECTIONS: Optional[int] = None
+    WEB_CONCURRENCY: int = 1
+    MONGO_MIN_POOL_SIZE: int = 0
+    MONGO_MAX_IDLE_TIME_MS: Optional[int] = 300_000
+    MONGO_CONNECT_TIMEOUT_MS: int = 5_000
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = 5_000
+    MONGO_SOCKET_TIMEOUT_MS: Optional[int] = None
+    MONGO_WAIT_QUEUE_TIMEOUT_MS: Optional[int] = 2_000
+    MONGO_READ_PREFERENCE: ReadPreferenceName = "primary"
+    # per-route reads, as JSON: "detail" is GET /patients/patient/{id} (read-after-write), "list" is view, sort,
+    # filter, group members and export, "analytics" is group and stats, e.g.
+    # {"analytics": {"read_preference": "secondaryPreferred", "max_staleness_seconds": 120, "read_concern": "local"}}
+    MONGO_READ_ROUTES: Dict[Literal["detail", "list", "analytics"], ReadRoute] = {"detail": ReadRoute(read_preference="primary")}
+    # "zstd" needs the zstandard package, "snappy" needs python-snappy
+    MONGO_COMPRESSORS: str = ""
+
+    # server-side limit on every patient find and aggregate; a query that runs out answers 503
+    MONGO_MAX_TIME_MS: Optional[int] = 10_000
+    # lets the group pipelines spill $group and $sort to disk instead of failing at the 100MB stage limit
+    MONGO_ALLOW_DISK_USE: bool = True
+    # list reads without ?limit= return at most this many patients, then X-Result-Truncated and a cursor
+    MAX_RESULT_DOCUMENTS: int = 10_000
+    MAX_GROUPS: int = 1000
+    # patients embedded per group by the legacy group_by_disease and group_by_condition routes
+    LEGACY_GROUP_MAX_PATIENTS: int = 500
+    # before MongoDB 5.2 ($topN) the legacy routes fill each group with its own query: this many groups, this many at once
+    LEGACY_GROUP_FALLBACK_MAX_GROUPS: int = 50
+    LEGACY_GROUP_FALLBACK_CONCURRENCY: int = 4
+    # group, stats, export and import; requests beyond running + queued get a 429
+    EXPENSIVE_CONCURRENCY_PER_DOCTOR: int = 2
+    EXPENSIVE_QUEUE_PER_DOCTOR: int = 4
+
+    # br is offered only when the brotli package is installed; smaller bodies are sent uncompressed
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_MINIMUM_SIZE: int = 1000
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 4
+
+    # load bcrypt, sign a JWT and open MONGO_MIN_POOL_SIZE connections during startup instead of on the first requests
+    WARMUP_ENABLED: bool = True
+
+    METRICS_ENABLED: bool = True
+    # fraction of requests that get the db/validation/serialization breakdown
+    METRICS_SAMPLE_RATE: float = 1.0
+
+    TOKEN_CACHE_SIZE: int = 10000
+    REVOCATION_SYNC_INTERVAL_SECONDS: float = 30
+
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_EXECUTOR: Literal["thread", "process"] = "thread"
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_QUEUE: int = 64
+
+    IMPORT_BATCH_SIZE: int = 500
+    IMPORT_MAX_ROW_CHARS: int = 1_000_000
+    IMPORT_REPORT_SPOOL_BYTES: int = 1_000_000
+    # patients per cursor batch and output chunk of /patients/export; parquet needs the pyarrow package
+    EXPORT_BATCH_SIZE: int = 1000
+    # maxTimeMS for the export cursor, which legitimately runs longer than other reads
+    EXPORT_MAX_TIME_MS: Optional[int] = 600_000
+
+    # "redis" shares cached responses and their invalidation across workers and needs the redis package
+    CACHE_BACKEND: Literal["memory", "redis"] = "memory"
+    CACHE_REDIS_URL: str = "redis://localhost:6379/0"
+    CACHE_TTL_SECONDS: Optional[float] = 300
+    GROUP_CACHE_SIZE: int = 1000
+    RESPONSE_CACHE_SIZE: int = 5000
+
+    # tail the patients change stream to drop cached responses after writes by other workers or processes; needs a replica set
+    CHANGE_STREAM_ENABLED: bool = False
+    # deletes name their doctor only with pre-images (MongoDB 6.0+, changeStreamPreAndPostImages enabled on patients);
+    # without them a delete drops every doctor's cached responses
+    CHANGE_STREAM_PRE_IMAGES: bool = False
+    CHANGE_STREAM_CHECKPOINT_SECONDS: float = 5
+    CHANGE_STREAM_RETRY_SECONDS: float = 5
+
+    # serve /patients/stats from a per-doctor rollup kept current on every write instead of aggregating
+    STATS_ROLLUP_ENABLED: bool = False
+
+    # text index on diagnoses_history.disease backing disease_match=fuzzy
+    DISEASE_TEXT_INDEX: bool = False
+
+    def mongo_pool_size(self) -> int:
+        if self.MONGO_TOTAL_MAX_CONNECTIONS:
+            return max(1, self.MONGO_TOTAL_MAX_CONNECTIONS // max(1, self.WEB_CONCURRENCY))
+        return self.MONGO_MAX_POOL_SIZE
+
     class Config:
         env_file = ".env"
 
+
+@lru_cache
+def get_settings() -> Settings:
+    """The process-wide Settings; the environment and .env are read once, on first use."""
+    return Settings()
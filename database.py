@@ -1,13 +1,128 @@
 
+from typing import Optional
+
 from beanie import init_beanie
 import motor.motor_asyncio
+from pymongo import TEXT, monitoring
 from models.patient import Patient
 from models.doctor import Doctor
-from config import Settings
+from models.revoked_token import RevokedToken
+from models.patient_stats import PatientStats
+from models.change_stream_token import ChangeStreamToken
+from config import get_settings
+from services.metrics import command_timer
+from services import read_routing
+
+settings = get_settings()
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Tracks open, checked-out and waiting connections across the client's pools."""
+
+    def __init__(self):
+        self.open = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.checkout_failures = 0
+
+    def stats(self, max_pool_size: int) -> dict:
+        return {
+            "open": self.open,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "checkout_failures": self.checkout_failures,
+            "max_pool_size": max_pool_size,
+            "saturation": round(self.in_use / max_pool_size, 3) if max_pool_size else None,
+        }
+
+    def connection_created(self, event):
+        self.open += 1
+
+    def connection_closed(self, event):
+        self.open = max(0, self.open - 1)
+
+    def connection_check_out_started(self, event):
+        self.waiting += 1
+
+    def connection_check_out_failed(self, event):
+        self.waiting = max(0, self.waiting - 1)
+        self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        self.waiting = max(0, self.waiting - 1)
+        self.in_use += 1
+
+    def connection_checked_in(self, event):
+        self.in_use = max(0, self.in_use - 1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+
+pool_monitor = PoolMonitor()
+_client: Optional[motor.motor_asyncio.AsyncIOMotorClient] = None
+# (major, minor) of the server, read by init_db; empty until then
+server_version: tuple = ()
+
+
+def client_options() -> dict:
+    options = {
+        "maxPoolSize": settings.mongo_pool_size(),
+        "minPoolSize": settings.MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": settings.MONGO_MAX_IDLE_TIME_MS,
+        "connectTimeoutMS": settings.MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": settings.MONGO_SOCKET_TIMEOUT_MS,
+        "waitQueueTimeoutMS": settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "readPreference": settings.MONGO_READ_PREFERENCE,
+        "event_listeners": [pool_monitor, command_timer] if settings.METRICS_ENABLED else [pool_monitor],
+    }
+    if settings.MONGO_COMPRESSORS:
+        options["compressors"] = settings.MONGO_COMPRESSORS
+    return {key: value for key, value in options.items() if value is not None}
+
+
+def get_client() -> motor.motor_asyncio.AsyncIOMotorClient:
+    """The worker-wide Motor client; created on first use and shared by every request."""
+    global _client
+    if _client is None:
+        _client = motor.motor_asyncio.AsyncIOMotorClient(settings.DATABASE_URL, **client_options())
+    return _client
+
+
+def get_database() -> motor.motor_asyncio.AsyncIOMotorDatabase:
+    return get_client()[settings.MONGO_DB_NAME]
+
+
+def supports_n_accumulators() -> bool:
+    """Whether the server has the $firstN/$topN group accumulators, added in MongoDB 5.2."""
+    return server_version >= (5, 2)
 
-settings = Settings()
 
 async def init_db():
-    db_url = settings.DATABASE_URL
-    client = motor.motor_asyncio.AsyncIOMotorClient(db_url)
-    await init_beanie(database=client.db_name, document_models=[Patient, Doctor])
+    global server_version
+    server_version = tuple((await get_client().server_info())["versionArray"][:2])
+    await init_beanie(database=get_database(), document_models=[Patient, Doctor, RevokedToken, PatientStats, ChangeStreamToken])
+    for document_model in (Patient, PatientStats):
+        read_routing.install(document_model, settings.MONGO_READ_ROUTES, settings.MONGO_READ_PREFERENCE)
+    if settings.DISEASE_TEXT_INDEX:
+        await Patient.get_motor_collection().create_index([("diagnoses_history.disease", TEXT)], name="disease_text")
+
+
+def close_db():
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
@@ -0,0 +1,30 @@
+from beanie import free_fall_migration
+from beanie.odm.utils.encoder import Encoder
+from pymongo import UpdateOne
+
+from models.patient import Patient, DERIVED_FIELDS
+
+BATCH_SIZE = 1000
+
+
+class Forward:
+    @free_fall_migration(document_models=[Patient])
+    async def store_derived_fields(self, session):
+        collection = Patient.get_motor_collection()
+        requests = []
+        async for patient in Patient.find_all(session=session):
+            # loading the document recomputes bmi, verdict and latest_* from the source fields
+            requests.append(UpdateOne({"_id": patient.id}, {"$set": Encoder().encode(patient.derived_fields())}))
+            if len(requests) == BATCH_SIZE:
+                await collection.bulk_write(requests, ordered=False, session=session)
+                requests = []
+        if requests:
+            await collection.bulk_write(requests, ordered=False, session=session)
+
+
+class Backward:
+    @free_fall_migration(document_models=[Patient])
+    async def drop_derived_fields(self, session):
+        await Patient.get_motor_collection().update_many(
+            {}, {"$unset": {field: "" for field in DERIVED_FIELDS}}, session=session
+        )
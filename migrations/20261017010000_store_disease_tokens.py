@@ -0,0 +1,30 @@
+from beanie import free_fall_migration
+from beanie.odm.utils.encoder import Encoder
+from pymongo import UpdateOne
+
+from models.patient import Patient
+
+BATCH_SIZE = 1000
+
+
+class Forward:
+    @free_fall_migration(document_models=[Patient])
+    async def store_disease_tokens(self, session):
+        collection = Patient.get_motor_collection()
+        requests = []
+        async for patient in Patient.find({"diagnoses_history.disease_token": {"$exists": False}, "diagnoses_history.0": {"$exists": True}}, session=session):
+            # loading the document fills disease_token on every diagnosis
+            requests.append(UpdateOne({"_id": patient.id}, {"$set": {"diagnoses_history": Encoder().encode(patient.diagnoses_history)}}))
+            if len(requests) == BATCH_SIZE:
+                await collection.bulk_write(requests, ordered=False, session=session)
+                requests = []
+        if requests:
+            await collection.bulk_write(requests, ordered=False, session=session)
+
+
+class Backward:
+    @free_fall_migration(document_models=[Patient])
+    async def drop_disease_tokens(self, session):
+        await Patient.get_motor_collection().update_many(
+            {}, {"$unset": {"diagnoses_history.$[].disease_token": ""}}, session=session
+        )
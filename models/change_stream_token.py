@@ -0,0 +1,12 @@
+from beanie import Document
+from pydantic import Field
+from datetime import datetime
+
+class ChangeStreamToken(Document):
+    """Where a change stream should resume after a restart."""
+    id: str = Field(..., description='Name of the change stream')
+    resume_token: dict = Field(..., description='Opaque resume token of the last processed change')
+    updated_at: datetime = Field(..., description='When the token was stored')
+
+    class Settings:
+        name = "change_stream_tokens"
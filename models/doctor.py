@@ -1,5 +1,6 @@
 from beanie import Document
 from pydantic import BaseModel, Field
+from pymongo import IndexModel, ASCENDING
 
 class Doctor(Document):
     username: str = Field(..., json_schema_extra={"unique": True})
@@ -7,6 +8,7 @@ class Doctor(Document):
 
     class Settings:
         name = "doctors"
+        indexes = [IndexModel([("username", ASCENDING)], unique=True)]
 
 class DoctorCreate(BaseModel):
     username: str
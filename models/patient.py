@@ -1,13 +1,81 @@
-from beanie import Document
-from pydantic import BaseModel, Field, computed_field
+from beanie import Document, before_event, Insert, Replace, Save, SaveChanges
+from pydantic import BaseModel, Field, create_model, field_validator, model_validator
+from pymongo import IndexModel, ASCENDING
 from typing import Literal, Optional, List
 from datetime import date
+from functools import lru_cache
+
+DERIVED_FIELDS = ('bmi', 'verdict', 'latest_condition', 'latest_diagnosis_date')
+SORTABLE_FIELDS = ('_id', 'height', 'weight', 'age', 'latest_diagnosis_date', 'latest_condition', 'bmi', 'verdict')
+
+def normalize_disease(disease: str) -> str:
+    """Lowercased, whitespace-collapsed disease name used for indexed search and grouping."""
+    return " ".join(disease.casefold().split())
+
+
+def normalize_condition(condition: str) -> str:
+    """Condition normalized like diseases, so grouping and group lookups compare stored tokens."""
+    return normalize_disease(condition)
+
 
 class DiagnosisEntry(BaseModel):
     disease: str = Field(..., description='Name of the diagnosed disease', examples=['Diabetes', 'Hypertension'])
     condition: str = Field(..., description='Current condition or status of the disease', examples=['Chronic', 'Stable', 'Severe'])
     diagnosis_on: date = Field(default_factory=date.today, description='Date of diagnosis')
     notes: Optional[str] = Field(default=None, description="Optional additional information or observations")
+    disease_token: Optional[str] = Field(default=None, description='Normalized disease name, derived from disease')
+    condition_token: Optional[str] = Field(default=None, description='Normalized condition, derived from condition')
+
+    @model_validator(mode='after')
+    def _fill_tokens(self):
+        self.disease_token = normalize_disease(self.disease)
+        self.condition_token = normalize_condition(self.condition)
+        return self
+
+
+def compute_bmi(height: Optional[float], weight: Optional[float]) -> Optional[float]:
+    if weight is None or height is None or height == 0:
+        return None
+    return round(weight / (height ** 2), 2)
+
+
+def compute_verdict(bmi: Optional[float]) -> Optional[str]:
+    if bmi is None:
+        return None
+    if bmi < 18.5:
+        return 'Underweight'
+    elif bmi < 25:
+        return 'Normal'
+    elif bmi < 30:
+        return 'Overweight'
+    else:
+        return 'Obese'
+
+
+def latest_diagnosis(diagnoses_history: List[DiagnosisEntry]) -> Optional[DiagnosisEntry]:
+    if not diagnoses_history:
+        return None
+    return max(diagnoses_history, key=lambda d: d.diagnosis_on)
+
+
+def derived_updates(changes: dict) -> dict:
+    """Derived fields affected by a partial update.
+
+    When height or weight changes, changes must hold both of them so the BMI
+    can be recomputed without reading the document.
+    """
+    derived = {}
+    if 'height' in changes or 'weight' in changes:
+        bmi = compute_bmi(changes.get('height'), changes.get('weight'))
+        derived.update(bmi=bmi, verdict=compute_verdict(bmi))
+    if 'diagnoses_history' in changes:
+        latest = latest_diagnosis([DiagnosisEntry.model_validate(d) for d in changes['diagnoses_history'] or []])
+        derived.update(
+            latest_condition=latest.condition if latest else None,
+            latest_diagnosis_date=latest.diagnosis_on if latest else None,
+        )
+    return derived
+
 
 class Patient(Document):
     id: str = Field(..., description='ID of the patient', examples=['P001'])
@@ -20,42 +88,73 @@ class Patient(Document):
     doctor_id: str = Field(..., description='ID of the doctor')
     diagnoses_history: List[DiagnosisEntry] = Field(default_factory=list, description='List of diagnoses for the patient')
 
-    @computed_field
-    def bmi(self) -> Optional[float]:
-        if self.weight is None or self.height is None or self.height == 0:
-            return None
-        bmi = round(self.weight / (self.height ** 2), 2)
-        return bmi
-
-    @computed_field
-    def verdict(self) -> Optional[str]:
-        if self.bmi is None:
-            return None
-        if self.bmi < 18.5:
-            return 'Underweight'
-        elif self.bmi < 25:
-            return 'Normal'
-        elif self.bmi < 30:
-            return 'Overweight'
-        else:
-            return 'Obese'
-
-    @computed_field
-    def latest_condition(self) -> Optional[str]:
-        if not self.diagnoses_history:
-            return None
-        # Sort by diagnosis_on date to get the latest
-        latest_diagnosis = max(self.diagnoses_history, key=lambda d: d.diagnosis_on)
-        return latest_diagnosis.condition
-
-    @computed_field
-    def latest_diagnosis_date(self) -> Optional[date]:
-        if not self.diagnoses_history:
-            return None
-        return max(self.diagnoses_history, key=lambda d: d.diagnosis_on).diagnosis_on
+    # derived from the fields above and stored so they can be sorted, filtered and indexed
+    bmi: Optional[float] = Field(default=None, description='Body mass index, derived from height and weight')
+    verdict: Optional[str] = Field(default=None, description='Health category derived from the BMI')
+    latest_condition: Optional[str] = Field(default=None, description='Condition of the most recent diagnosis')
+    latest_diagnosis_date: Optional[date] = Field(default=None, description='Date of the most recent diagnosis')
+
+    # bumped by every partial update; clients may send it back to reject concurrent edits
+    revision: int = Field(default=0, description='Number of partial updates applied to the patient')
+
+    @model_validator(mode='after')
+    def _fill_derived_fields(self):
+        self.refresh_derived_fields()
+        return self
+
+    @before_event(Insert, Replace, Save, SaveChanges)
+    def refresh_derived_fields(self):
+        for key, value in self.derived_fields().items():
+            object.__setattr__(self, key, value)
+
+    def derived_fields(self) -> dict:
+        bmi = compute_bmi(self.height, self.weight)
+        latest = latest_diagnosis(self.diagnoses_history)
+        return {
+            'bmi': bmi,
+            'verdict': compute_verdict(bmi),
+            'latest_condition': latest.condition if latest else None,
+            'latest_diagnosis_date': latest.diagnosis_on if latest else None,
+        }
 
     class Settings:
         name = "patients"
+        # every doctor-scoped sort walks (doctor_id, field, _id) so keyset pages never need an in-memory SORT
+        indexes = [
+            IndexModel([("doctor_id", ASCENDING), ("_id", ASCENDING)]),
+            *[IndexModel([("doctor_id", ASCENDING), (field, ASCENDING), ("_id", ASCENDING)]) for field in SORTABLE_FIELDS if field != "_id"],
+            # multikey index behind the $elemMatch diagnosis filter; its prefix also serves disease-only search
+            IndexModel([
+                ("doctor_id", ASCENDING),
+                ("diagnoses_history.disease_token", ASCENDING),
+                ("diagnoses_history.condition", ASCENDING),
+                ("diagnoses_history.diagnosis_on", ASCENDING),
+            ]),
+            IndexModel([("doctor_id", ASCENDING), ("diagnoses_history.condition_token", ASCENDING)]),
+        ]
+
+
+PROJECTABLE_FIELDS = tuple(name for name in Patient.model_fields if name != 'revision_id')
+
+
+@lru_cache(maxsize=256)
+def patient_fields_model(fields: frozenset):
+    """Projection model with the patient's id plus the given fields, so only those are read from MongoDB."""
+    names = ['id', *sorted(fields - {'id'}, key=PROJECTABLE_FIELDS.index)]
+    # the field names go into the class name so its repr, used in cache keys, differs per projection
+    return create_model('PatientFields_' + '_'.join(names), **{name: (Patient.model_fields[name].annotation, Patient.model_fields[name]) for name in names})
+
+
+class PatientSummary(BaseModel):
+    """Projection used where only a patient's headline fields are needed."""
+    id: str = Field(..., alias='_id')
+    name: str
+    city: str
+    age: int
+    gender: str
+    verdict: Optional[str] = None
+    latest_condition: Optional[str] = None
+    latest_diagnosis_date: Optional[date] = None
 
 
 class PatientCreate(BaseModel):
@@ -77,3 +176,11 @@ class PatientUpdate(BaseModel):
     height: Optional[float] = Field(default=None, gt=0)
     weight: Optional[float] = Field(default=None, gt=0)
     diagnoses_history: Optional[List[DiagnosisEntry]] = Field(default=None, description='List of diagnoses for the patient')
+
+    @field_validator('name', 'city', 'age', 'gender', 'diagnoses_history')
+    @classmethod
+    def _not_null(cls, value):
+        # these may be left out of an update, but a patient always has them (an empty history is [])
+        if value is None:
+            raise ValueError('may be omitted but not null')
+        return value
@@ -0,0 +1,22 @@
+from beanie import Document
+from pydantic import Field
+from typing import Dict, Optional
+
+class PatientStats(Document):
+    """Per-doctor rollup of the /patients/stats counters, kept approximately current with $inc on every write.
+
+    Counter keys are escaped so values containing '.' or a leading '$' can be
+    used as field names. While the rollup is rebuilt, `building` holds the
+    build's id (or "dirty" once a write raced it) and the counters are not read.
+    """
+    id: str = Field(..., description='ID of the doctor the counters belong to')
+    total: int = Field(default=0, description='Number of patients')
+    bmi: Dict[str, int] = Field(default_factory=dict, description='Patients per BMI bucket')
+    verdict: Dict[str, int] = Field(default_factory=dict, description='Patients per verdict')
+    age: Dict[str, int] = Field(default_factory=dict, description='Patients per age bucket, keyed by its lower bound')
+    city: Dict[str, int] = Field(default_factory=dict, description='Patients per city')
+    diagnoses_per_month: Dict[str, int] = Field(default_factory=dict, description='Diagnoses per YYYY-MM')
+    building: Optional[str] = Field(default=None, description='Id of the build rebuilding the rollup, if one is running')
+
+    class Settings:
+        name = "patient_stats"
@@ -0,0 +1,16 @@
+from beanie import Document
+from pydantic import Field
+from pymongo import IndexModel, ASCENDING
+from datetime import datetime
+
+class RevokedToken(Document):
+    jti: str = Field(..., description='ID of the revoked access token')
+    username: str = Field(..., description='Username the token was issued to')
+    expires_at: datetime = Field(..., description='Expiry of the revoked token; MongoDB drops the entry after it')
+
+    class Settings:
+        name = "revoked_tokens"
+        indexes = [
+            IndexModel([("jti", ASCENDING)], unique=True),
+            IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+        ]
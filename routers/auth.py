@@ -1,27 +1,41 @@
-from fastapi import APIRouter, HTTPException
-from services.auth import create_access_token, verify_password, get_password_hash
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.security import HTTPAuthorizationCredentials
+from pymongo.errors import DuplicateKeyError
+from services.auth import create_access_token, verify_and_update_password, get_password_hash, revoke_token, security, password_pool
 from models.doctor import Doctor, DoctorCreate
 
 router = APIRouter()
 
 @router.post("/register")
 async def register_doctor(doctor: DoctorCreate):
-    existing_doctor = await Doctor.find_one(Doctor.username == doctor.username)
-    if existing_doctor:
-        raise HTTPException(status_code=400, detail="Username already registered")
-    hashed_password = get_password_hash(doctor.password)
+    hashed_password = await password_pool.run(get_password_hash, doctor.password)
     new_doctor = Doctor(username=doctor.username, password=hashed_password)
-    await new_doctor.create()
+    # the unique username index makes this a single, race-free insert
+    try:
+        await new_doctor.create()
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Username already registered")
     return {"message": "Doctor registered successfully"}
 
 @router.post("/login")
 async def login_for_access_token(form_data: DoctorCreate):
     doctor = await Doctor.find_one(Doctor.username == form_data.username)
-    if not doctor or not verify_password(form_data.password, doctor.password):
+    verified, new_hash = (False, None)
+    if doctor:
+        verified, new_hash = await password_pool.run(verify_and_update_password, form_data.password, doctor.password)
+    if not verified:
         raise HTTPException(
             status_code=401,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash:
+        # the stored hash was made with old cost parameters
+        await doctor.set({Doctor.password: new_hash})
     access_token = create_access_token(data={"sub": doctor.username})
     return {"access_token": access_token, "token_type": "bearer"}
+
+@router.post("/logout")
+async def logout(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    await revoke_token(credentials.credentials)
+    return {"message": "Logged out successfully"}
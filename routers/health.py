@@ -0,0 +1,35 @@
+import logging
+import time
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+
+from config import get_settings
+from database import get_database, pool_monitor
+from services.warmup import readiness
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+router = APIRouter()
+
+@router.get("/db")
+async def database_health(database=Depends(get_database)):
+    start = time.perf_counter()
+    try:
+        await database.command("ping")
+    except Exception:
+        # driver errors name hosts and the topology; this endpoint is unauthenticated
+        logger.exception("Database health check failed")
+        return JSONResponse(status_code=503, content={"status": "unavailable", "error": "database unavailable", "pool": pool_monitor.stats(settings.mongo_pool_size())})
+    return {
+        "status": "ok",
+        "ping_ms": round((time.perf_counter() - start) * 1000, 2),
+        "pool": pool_monitor.stats(settings.mongo_pool_size()),
+    }
+
+@router.get("/ready")
+async def readiness_check():
+    """200 once this worker has warmed up, 503 while it is starting or shutting down."""
+    return JSONResponse(status_code=200 if readiness.ready else 503, content=readiness.stats())
@@ -1,30 +1,110 @@
-from fastapi import APIRouter, Path, HTTPException, Query, Depends
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Path, HTTPException, Query, Depends, Header, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from starlette.background import BackgroundTask
 import pymongo
-from datetime import date, timedelta
-from typing import Optional
+from pymongo.errors import DuplicateKeyError
+from typing import Literal, Optional
+import asyncio
 
 from services.auth import get_current_doctor
-from models.patient import Patient, PatientUpdate, PatientCreate
+from services.pagination import paginate, wants_ndjson, MAX_PAGE_SIZE, NDJSON_MEDIA_TYPE, TRUNCATED_HEADER
+from services.importer import import_format, iter_lines, iter_csv_rows, iter_ndjson_rows, import_to_spool, iter_spool
+from services.grouping import group_pipeline, format_groups, group_member_filter, legacy_group_pipeline, legacy_group_members_pipeline
+from services.filters import diagnosis_filter, MAX_DIAGNOSIS_MONTHS
+from services.cache import DoctorCache, register_cache, invalidate_doctor, make_backend, cached_response
+from services.patient_updates import update_patient_fields, append_diagnosis
+from services import stats
+from services.read_routing import read_route
+from services.guardrails import find_options, aggregate_options, expensive_slot, expensive_limiter
+from services.exporter import export_patients, parquet_available, EXPORT_MEDIA_TYPES
+from models.patient import Patient, DiagnosisEntry, PatientUpdate, PatientCreate, PatientSummary, SORTABLE_FIELDS, PROJECTABLE_FIELDS, patient_fields_model
+from config import get_settings
+from database import supports_n_accumulators
+
+settings = get_settings()
+
+MAX_GROUP_MEMBERS = 50
+MAX_EXPORT_BATCH_SIZE = 10000
+
+group_cache = register_cache(DoctorCache(make_backend(settings, "group", settings.GROUP_CACHE_SIZE)))
+response_cache = register_cache(DoctorCache(make_backend(settings, "patients", settings.RESPONSE_CACHE_SIZE)))
 
 router = APIRouter()
 
-@router.get("/view")
-async def view(current_doctor: str = Depends(get_current_doctor)):
-    data = await Patient.find(Patient.doctor_id == current_doctor).to_list()
-    return data
 
-@router.get("/patient/{patient_id}")
-async def view_patient(patient_id: str = Path(..., description='ID of the patient in the DB', examples=['P001']), current_doctor: str = Depends(get_current_doctor)):
-    patient = await Patient.get(patient_id)
-    if not patient or patient.doctor_id != current_doctor:
-        raise HTTPException(status_code=404, detail='Patient not found')
-    return patient
+FIELDS_DESCRIPTION = "Comma-separated patient fields to return; the id (and sort field) is always included"
+
+
+def _fields_model(fields: Optional[str], *required: str):
+    """Projection model for a fields= parameter, or None to return whole patients."""
+    if not fields:
+        return None
+    names = {"id" if name == "_id" else name for name in (part.strip() for part in fields.split(",")) if name}
+    unknown = names - set(PROJECTABLE_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f'Unknown fields {sorted(unknown)}, select from {list(PROJECTABLE_FIELDS)}')
+    return patient_fields_model(frozenset(names | {"id" if name == "_id" else name for name in required}))
+
 
-@router.get("/sort")
-async def sort_patients(sort_by: str = Query(..., description='Sort on the basis of_id,latest_diagnosis_date, latest_condition, height, weight, age  '), order: str = Query('asc', description='sort in asc or desc order'), current_doctor: str = Depends(get_current_doctor)):
+async def _cached(current_doctor: str, key: tuple, accept: Optional[str], if_none_match: Optional[str], render):
+    # NDJSON streams are rendered straight from the cursor and never cached
+    if wants_ndjson(accept):
+        return await render()
+    return await cached_response(response_cache, current_doctor, key, if_none_match, render)
+
+@router.get("/view", dependencies=[Depends(read_route("list"))])
+async def view(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of patients to return"),
+    after: Optional[str] = Query(None, description="Cursor from the previous page's X-Next-Cursor"),
+    accept: Optional[str] = Header(None),
+    fast: bool = Query(False, description="Serialize straight from raw documents with orjson, skipping model validation"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    if_none_match: Optional[str] = Header(None),
+    current_doctor: str = Depends(get_current_doctor)
+):
+    projection = _fields_model(fields)
 
-    valid_fields = ['height', 'weight', 'age', '_id', 'latest_diagnosis_date', 'latest_condition']
+    async def render():
+        query = Patient.find(Patient.doctor_id == current_doctor, **find_options())
+        if projection:
+            query = query.project(projection)
+        return await paginate(query, limit=limit, after=after, accept=accept, fast=fast, cap=settings.MAX_RESULT_DOCUMENTS)
+
+    return await _cached(current_doctor, ("view", limit, after, fast, projection), accept, if_none_match, render)
+
+@router.get("/patient/{patient_id}", dependencies=[Depends(read_route("detail"))])
+async def view_patient(
+    patient_id: str = Path(..., description='ID of the patient in the DB', examples=['P001']),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    if_none_match: Optional[str] = Header(None),
+    current_doctor: str = Depends(get_current_doctor)
+):
+    projection = _fields_model(fields)
+
+    async def render():
+        query = Patient.find_one(Patient.id == patient_id, Patient.doctor_id == current_doctor, **find_options())
+        patient = await (query.project(projection) if projection else query)
+        if not patient:
+            raise HTTPException(status_code=404, detail='Patient not found')
+        return JSONResponse(content=jsonable_encoder(patient))
+
+    return await cached_response(response_cache, current_doctor, ("patient", patient_id, projection), if_none_match, render)
+
+@router.get("/sort", dependencies=[Depends(read_route("list"))])
+async def sort_patients(
+    sort_by: str = Query(..., description='Sort on the basis of_id,latest_diagnosis_date, latest_condition, height, weight, age, bmi, verdict'),
+    order: str = Query('asc', description='sort in asc or desc order'),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of patients to return"),
+    after: Optional[str] = Query(None, description="Cursor from the previous page's X-Next-Cursor"),
+    accept: Optional[str] = Header(None),
+    fast: bool = Query(False, description="Serialize straight from raw documents with orjson, skipping model validation"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    if_none_match: Optional[str] = Header(None),
+    current_doctor: str = Depends(get_current_doctor)
+):
+
+    valid_fields = list(SORTABLE_FIELDS)
 
     if sort_by not in valid_fields:
         raise HTTPException(status_code=400, detail=f'Invalid field select from {valid_fields}')
@@ -33,129 +113,215 @@ async def sort_patients(sort_by: str = Query(..., description='Sort on the basis
         raise HTTPException(status_code=400, detail='Invalid order select between asc and desc')
     
     sort_order = pymongo.DESCENDING if order=='desc' else pymongo.ASCENDING
-
-    sorted_data = await Patient.find(Patient.doctor_id == current_doctor).sort((sort_by,sort_order)).to_list()
-
-    return sorted_data
-
-@router.get("/group_by_disease")
+    # keyset cursors are built from the sort field, so it is always projected
+    projection = _fields_model(fields, sort_by)
+
+    async def render():
+        query = Patient.find(Patient.doctor_id == current_doctor, **find_options())
+        if projection:
+            query = query.project(projection)
+        return await paginate(query, limit=limit, after=after, sort_by=sort_by, sort_order=sort_order, accept=accept, fast=fast,
+                              cap=settings.MAX_RESULT_DOCUMENTS)
+
+    return await _cached(current_doctor, ("sort", sort_by, order, limit, after, fast, projection), accept, if_none_match, render)
+
+@router.get("/group", dependencies=[Depends(read_route("analytics")), Depends(expensive_slot)])
+async def group_patients(
+    by: Literal['disease', 'condition', 'city', 'gender', 'verdict'] = Query(..., description='Field to group patients by'),
+    members: int = Query(0, ge=0, le=MAX_GROUP_MEMBERS, description='Number of projected members to include per group; 0 returns counts only'),
+    if_none_match: Optional[str] = Header(None),
+    current_doctor: str = Depends(get_current_doctor)
+):
+    async def render():
+        pipeline = group_pipeline(current_doctor, by, members, settings.MAX_GROUPS, top_n=supports_n_accumulators())
+        result = await Patient.aggregate(pipeline, **aggregate_options(spill=True)).to_list()
+        groups = format_groups(by, result, settings.MAX_GROUPS)
+        headers = {TRUNCATED_HEADER: "true"} if groups["truncated"] else {}
+        return JSONResponse(content=jsonable_encoder(groups), headers=headers)
+
+    return await cached_response(group_cache, current_doctor, ("group", by, members), if_none_match, render)
+
+@router.get("/group/members", dependencies=[Depends(read_route("list"))])
+async def group_members(
+    by: Literal['disease', 'condition', 'city', 'gender', 'verdict'] = Query(..., description='Field the group was built on'),
+    value: str = Query(..., description='Group value whose members to list; "unknown" for patients without the field'),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of patients to return"),
+    after: Optional[str] = Query(None, description="Cursor from the previous page's X-Next-Cursor"),
+    accept: Optional[str] = Header(None),
+    fast: bool = Query(False, description="Serialize straight from raw documents with orjson, skipping model validation"),
+    current_doctor: str = Depends(get_current_doctor)
+):
+    query = Patient.find(Patient.doctor_id == current_doctor, group_member_filter(by, value), **find_options()).project(PatientSummary)
+    return await paginate(query, limit=limit, after=after, accept=accept, fast=fast, cap=settings.MAX_RESULT_DOCUMENTS)
+
+async def _legacy_groups(current_doctor: str, by: str) -> JSONResponse:
+    top_n = supports_n_accumulators()
+    max_groups = settings.MAX_GROUPS if top_n else settings.LEGACY_GROUP_FALLBACK_MAX_GROUPS
+    pipeline = legacy_group_pipeline(current_doctor, by, max_groups, settings.LEGACY_GROUP_MAX_PATIENTS, top_n)
+    grouped_data = await Patient.aggregate(pipeline, **aggregate_options(spill=True)).to_list()
+    if not top_n:
+        # one bounded query per group keeps every result document small on servers without $topN;
+        # a few run at once so the request neither serializes them nor floods the pool
+        limit = asyncio.Semaphore(settings.LEGACY_GROUP_FALLBACK_CONCURRENCY)
+
+        async def fill(group):
+            members = legacy_group_members_pipeline(current_doctor, by, group["_id"], settings.LEGACY_GROUP_MAX_PATIENTS)
+            async with limit:
+                group["patients"] = await Patient.aggregate(members, **aggregate_options()).to_list()
+
+        await asyncio.gather(*(fill(group) for group in grouped_data[:max_groups]))
+    truncated = len(grouped_data) > max_groups or any(group["truncated"] for group in grouped_data)
+    headers = {TRUNCATED_HEADER: "true"} if truncated else {}
+    return JSONResponse(content=jsonable_encoder(grouped_data[:max_groups]), headers=headers)
+
+@router.get("/group_by_disease", deprecated=True, dependencies=[Depends(read_route("analytics")), Depends(expensive_slot)])
 async def group_patients_by_disease(current_doctor: str = Depends(get_current_doctor)):
-    pipeline = [
-        {"$match": {"doctor_id": current_doctor}},  # Filter by current doctor
-        {"$unwind": "$diagnoses_history"},  # Deconstruct the diagnoses_history array
-        {"$group": {
-            "_id": {"$toLower": "$diagnoses_history.disease"},  # Normalize to lowercase  # Group by disease name
-            "patients": {"$push": {
-                "id": "$_id",
-                "name": "$name",
-                "city": "$city",
-                "age": "$age",
-                "gender": "$gender",
-                "height": "$height",
-                "weight": "$weight",
-                "latest_condition": "$latest_condition",
-                "latest_diagnosis_date": "$latest_diagnosis_date",
-                "diagnosis_details": "$diagnoses_history" # Include specific diagnosis details
-            }}
-        }}
-    ]
-    
-    grouped_data = await Patient.aggregate(pipeline).to_list()
-    return grouped_data
+    return await _legacy_groups(current_doctor, "disease")
 
-@router.get("/group_by_condition")
+@router.get("/group_by_condition", deprecated=True, dependencies=[Depends(read_route("analytics")), Depends(expensive_slot)])
 async def group_patients_by_condition(current_doctor: str = Depends(get_current_doctor)):
-    pipeline = [
-        {"$match": {"doctor_id": current_doctor}},  # Filter by current doctor
-        {"$unwind": "$diagnoses_history"},  # Deconstruct the diagnoses_history array
-        {"$group": {
-             "_id": {"$toLower": "$diagnoses_history.condition"},  # Normalize to lowercase  # Group by condition
-            "patients": {"$push": {
-                "id": "$_id",
-                "name": "$name",
-                "city": "$city",
-                "age": "$age",
-                "gender": "$gender",
-                "height": "$height",
-                "weight": "$weight",
-                "latest_condition": "$latest_condition",
-                "latest_diagnosis_date": "$latest_diagnosis_date",
-                "diagnosis_details": "$diagnoses_history" # Include specific diagnosis details
-            }}
-        }}
-    ]
-    
-    grouped_data = await Patient.aggregate(pipeline).to_list()
-    return grouped_data
+    return await _legacy_groups(current_doctor, "condition")
+
+@router.get("/export", dependencies=[Depends(read_route("list"))])
+async def export_patients_stream(
+    format: Literal['csv', 'ndjson', 'parquet'] = Query('csv', description='Output format'),
+    flatten: Literal['patient', 'diagnosis'] = Query('patient', description='One row per patient, or one row per diagnosis'),
+    batch_size: int = Query(settings.EXPORT_BATCH_SIZE, ge=1, le=MAX_EXPORT_BATCH_SIZE, description='Patients read and written per chunk'),
+    current_doctor: str = Depends(get_current_doctor)
+):
+    """Stream all of the doctor's patients as CSV, NDJSON or Parquet without holding them in memory."""
+    if format == 'parquet' and not parquet_available():
+        raise HTTPException(status_code=501, detail='Parquet export needs the pyarrow package')
+    headers = {'Content-Disposition': f'attachment; filename="patients.{format}"'}
+    lease = await expensive_limiter.lease(current_doctor)
+    chunks = export_patients(current_doctor, format, flatten, batch_size, max_time_ms=settings.EXPORT_MAX_TIME_MS)
+    return StreamingResponse(lease.hold(chunks), media_type=EXPORT_MEDIA_TYPES[format], headers=headers,
+                             background=BackgroundTask(lease))
+
+@router.get("/stats", dependencies=[Depends(read_route("analytics")), Depends(expensive_slot)])
+async def patient_stats(
+    fresh: bool = Query(False, description="Aggregate live, bypassing the cache and the rollup (which is then rebuilt)"),
+    if_none_match: Optional[str] = Header(None),
+    current_doctor: str = Depends(get_current_doctor)
+):
+    """BMI buckets, verdicts, age histogram, cities and diagnoses per month for the doctor's patients."""
+    async def render():
+        return JSONResponse(content=await stats.doctor_stats(current_doctor, fresh))
+
+    if fresh:
+        return await render()
+    return await cached_response(response_cache, current_doctor, ("stats",), if_none_match, render)
 
-@router.get("/filter")
+@router.get("/filter", dependencies=[Depends(read_route("list"))])
 async def filter_patients(
     disease_name: Optional[str] = Query(None, description="Filter by disease name"),
+    disease_match: Literal['exact', 'prefix', 'contains', 'fuzzy'] = Query('contains', description="How disease_name is matched against the normalized disease"),
     condition: Optional[str] = Query(None, description="Filter by disease condition"),
-    diagnosed_after_months: Optional[str] = Query(None, description="Filter by diagnoses in the last X months"),
+    diagnosed_after_months: Optional[int] = Query(None, ge=0, le=MAX_DIAGNOSIS_MONTHS, description="Filter by diagnoses in the last X months"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of patients to return"),
+    after: Optional[str] = Query(None, description="Cursor from the previous page's X-Next-Cursor"),
+    accept: Optional[str] = Header(None),
+    fast: bool = Query(False, description="Serialize straight from raw documents with orjson, skipping model validation"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    if_none_match: Optional[str] = Header(None),
     current_doctor: str = Depends(get_current_doctor)
 ):
-    query = Patient.find(Patient.doctor_id == current_doctor)
+    criteria = diagnosis_filter(disease_name, disease_match, condition, diagnosed_after_months, settings.DISEASE_TEXT_INDEX)
+    projection = _fields_model(fields)
 
-    if disease_name:
-        query = query.find({"diagnoses_history.disease": {"$regex": disease_name, "$options": "i"}})
-    
-    if condition:
-        query = query.find({"diagnoses_history.condition": condition})
-
-    if diagnosed_after_months:
-        try:
-            diagnosed_after_months_int = int(diagnosed_after_months)
-            from_date = date.today() - timedelta(days=diagnosed_after_months_int * 30) # Approximate months
-            query = query.find({"diagnoses_history.diagnosis_on": {"$gte": from_date}})
-        except ValueError:
-            raise HTTPException(status_code=400, detail="diagnosed_after_months must be an integer")
+    async def render():
+        query = Patient.find(Patient.doctor_id == current_doctor, criteria, **find_options())
+        if projection:
+            query = query.project(projection)
+        return await paginate(query, limit=limit, after=after, accept=accept, fast=fast, cap=settings.MAX_RESULT_DOCUMENTS)
 
-    filtered_data = await query.to_list()
-    return filtered_data
+    key = ("filter", disease_name, disease_match, condition, diagnosed_after_months, limit, after, fast, projection)
+    return await _cached(current_doctor, key, accept, if_none_match, render)
 
 @router.post("/create")
 async def create_patient(patient_data: PatientCreate, current_doctor: str = Depends(get_current_doctor)):
 
-    # check if the patient already exists
-    existing_patient = await Patient.get(patient_data.id)
-    if existing_patient:
-        raise HTTPException(status_code=400, detail='Patient already exists')
-
     patient = Patient(**patient_data.model_dump(), doctor_id=current_doctor)
-    # new patient add to the database
-    await patient.create()
+    # new patient add to the database; the _id index rejects an existing one
+    try:
+        await patient.create()
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail='Patient already exists')
+    await stats.apply(current_doctor, stats.change(None, patient.model_dump()))
+    await invalidate_doctor(current_doctor)
 
     return JSONResponse(status_code=201, content={'message':'patient created successfully'})
 
 
-@router.put("/edit/{patient_id}")
-async def update_patient(patient_id: str, patient_update: PatientUpdate, current_doctor: str = Depends(get_current_doctor)):
+@router.post("/import", openapi_extra={"requestBody": {"required": True, "content": {
+    "text/csv": {"schema": {"type": "string"}},
+    "application/x-ndjson": {"schema": {"type": "string"}},
+}}}, dependencies=[Depends(expensive_slot)])
+async def import_patients_bulk(request: Request, current_doctor: str = Depends(get_current_doctor)):
+    """Bulk-create patients from a CSV or NDJSON upload, returning one NDJSON result line per row."""
+    upload_format = import_format(request.headers.get("content-type"))
+    if upload_format is None:
+        raise HTTPException(status_code=415, detail='Upload must be text/csv or application/x-ndjson')
 
-    patient = await Patient.get(patient_id)
+    max_row = settings.IMPORT_MAX_ROW_CHARS
+    lines = iter_lines(request.stream(), max_row)
+    rows = iter_csv_rows(lines, max_row) if upload_format == "csv" else iter_ndjson_rows(lines, max_row)
+    # the upload must be fully consumed before streaming starts: StreamingResponse
+    # listens for client disconnects on the same receive channel as the request body
+    report = await import_to_spool(rows, current_doctor, settings.IMPORT_BATCH_SIZE, settings.IMPORT_REPORT_SPOOL_BYTES)
+    await invalidate_doctor(current_doctor)
+    return StreamingResponse(iter_spool(report), media_type=NDJSON_MEDIA_TYPE)
 
-    if not patient or patient.doctor_id != current_doctor:
-        raise HTTPException(status_code=404, detail='Patient not found')
-    
-    patient_update_dict = patient_update.model_dump(exclude_unset=True)
 
-    for key, value in patient_update_dict.items():
-        setattr(patient, key, value)
+@router.put("/edit/{patient_id}")
+async def update_patient(
+    patient_id: str,
+    patient_update: PatientUpdate,
+    revision: Optional[int] = Query(None, ge=0, description='Only apply the update if the patient is still at this revision'),
+    current_doctor: str = Depends(get_current_doctor)
+):
+    await update_patient_fields(patient_id, current_doctor, patient_update.model_dump(exclude_unset=True), revision)
+    await invalidate_doctor(current_doctor)
 
-    await patient.save()
+    return JSONResponse(status_code=200, content={'message':'patient updated'})
 
+@router.patch("/patient/{patient_id}")
+async def patch_patient(
+    patient_id: str,
+    patient_update: PatientUpdate,
+    revision: Optional[int] = Query(None, ge=0, description='Only apply the update if the patient is still at this revision'),
+    current_doctor: str = Depends(get_current_doctor)
+):
+    new_revision = await update_patient_fields(patient_id, current_doctor, patient_update.model_dump(exclude_unset=True), revision)
+    await invalidate_doctor(current_doctor)
 
-    return JSONResponse(status_code=200, content={'message':'patient updated'})
+    return JSONResponse(status_code=200, content={'message':'patient updated', 'revision': new_revision})
+
+@router.post("/patient/{patient_id}/diagnoses")
+async def add_diagnosis(
+    patient_id: str,
+    diagnosis: DiagnosisEntry,
+    revision: Optional[int] = Query(None, ge=0, description='Only apply the update if the patient is still at this revision'),
+    current_doctor: str = Depends(get_current_doctor)
+):
+    new_revision = await append_diagnosis(patient_id, current_doctor, diagnosis, revision)
+    await invalidate_doctor(current_doctor)
+
+    return JSONResponse(status_code=201, content={'message':'diagnosis added', 'revision': new_revision})
 
 @router.delete("/delete/{patient_id}")
 async def delete_patient(patient_id: str, current_doctor: str = Depends(get_current_doctor)):
 
-    patient = await Patient.get(patient_id)
+    # the deleted patient's stats fields come back from the same round trip
+    projection = {field: 1 for field in stats.STATS_FIELDS} if settings.STATS_ROLLUP_ENABLED else {"_id": 1}
+    deleted = await Patient.get_motor_collection().find_one_and_delete({"_id": patient_id, "doctor_id": current_doctor}, projection=projection)
 
-    if not patient or patient.doctor_id != current_doctor:
+    if deleted is None:
         raise HTTPException(status_code=404, detail='Patient not found')
-    
-    await patient.delete()
+
+    if settings.STATS_ROLLUP_ENABLED:
+        await stats.apply(current_doctor, stats.change(deleted, None))
+    await invalidate_doctor(current_doctor)
 
 
     return JSONResponse(status_code=200, content={'message':'patient deleted'})
@@ -2,22 +2,35 @@ from fastapi import Depends, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from passlib.context import CryptContext
 import jwt
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime, timedelta, timezone
-from config import Settings
+from pymongo.errors import DuplicateKeyError
+from config import get_settings
+from models.revoked_token import RevokedToken
 
-settings = Settings()
+settings = get_settings()
 SECRET_KEY = settings.SECRET_KEY
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = logging.getLogger(__name__)
+
+# changing BCRYPT_ROUNDS makes existing hashes "need update"; they are rehashed on the next login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
 
 security = HTTPBearer()
 
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -27,6 +40,66 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+def verify_and_update_password(plain_password, hashed_password):
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+class PasswordHashPool:
+    """Runs bcrypt off the event loop on a bounded thread or process pool.
+
+    At most `workers` hashes run at once; callers beyond that wait in the
+    executor queue, and once `max_queue` are waiting new requests get a 503
+    instead of piling up behind a login storm.
+    """
+
+    def __init__(self, kind: str, workers: int, max_queue: int):
+        self.kind = kind
+        self.workers = workers
+        self.max_queue = max_queue
+        self.pending = 0
+        self.rejected = 0
+        self._executor = None
+
+    @property
+    def queue_depth(self) -> int:
+        return max(self.pending - self.workers, 0)
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    async def run(self, func, *args):
+        if self.pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            logger.warning("Password hash pool saturated: %s", self.stats())
+            raise HTTPException(status_code=503, detail="Too many concurrent password operations, retry shortly")
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "pending": self.pending,
+            "queue_depth": self.queue_depth,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_pool = PasswordHashPool(settings.PASSWORD_HASH_EXECUTOR, settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_MAX_QUEUE)
+
 async def authenticate_user(username: str, password: str):
     # This is a placeholder. In a real application, you would verify the username and password against your database.
     # For now, it always returns True.
@@ -37,13 +110,109 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     # For now, it returns a dummy user.
     return {"username": "test_user"}
 
-def get_current_doctor(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+class TokenCache:
+    """Bounded LRU of verified token claims, keyed by token digest and expiring at the token's exp."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            claims = self._entries.get(key)
+            if claims is None or claims["exp"] <= time.time():
+                if claims is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return claims
+
+    def put(self, key: str, claims: dict):
+        with self._lock:
+            self._entries[key] = claims
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE)
+
+# jti -> exp of revoked tokens, filled on logout and by sync_revoked_tokens()
+revoked_jtis: dict = {}
+
+
+def _token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def verify_token(token: str) -> dict:
+    key = _token_digest(token)
+    claims = token_cache.get(key)
+    if claims is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except jwt.PyJWTError:
+            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+        if payload.get("sub") is None:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-    except jwt.PyJWTError:
-        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-    return username
\ No newline at end of file
+        claims = {"sub": payload["sub"], "jti": payload.get("jti"), "exp": payload["exp"]}
+        token_cache.put(key, claims)
+    if claims["jti"] is not None and claims["jti"] in revoked_jtis:
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    return claims
+
+
+async def get_current_doctor(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    # async so cache hits are served on the event loop instead of a threadpool hop
+    return verify_token(credentials.credentials)["sub"]
+
+
+async def revoke_token(token: str):
+    claims = verify_token(token)
+    if claims["jti"] is None:
+        raise HTTPException(status_code=400, detail="Token cannot be revoked")
+    # persist first so other workers learn about it before this one acts on it
+    try:
+        await RevokedToken(
+            jti=claims["jti"],
+            username=claims["sub"],
+            expires_at=datetime.fromtimestamp(claims["exp"], tz=timezone.utc),
+        ).create()
+    except DuplicateKeyError:
+        pass  # already revoked, e.g. by a concurrent logout on another worker
+    revoked_jtis[claims["jti"]] = claims["exp"]
+    token_cache.discard(_token_digest(token))
+
+
+async def sync_revoked_tokens():
+    now = datetime.now(timezone.utc)
+    async for token in RevokedToken.find(RevokedToken.expires_at > now):
+        revoked_jtis[token.jti] = token.expires_at.replace(tzinfo=timezone.utc).timestamp()
+    # expired tokens are rejected by jwt.decode anyway, so their jtis can be forgotten
+    for jti, exp in list(revoked_jtis.items()):
+        if exp <= now.timestamp():
+            del revoked_jtis[jti]
+
+
+async def revocation_sync_loop(interval: float):
+    while True:
+        try:
+            await sync_revoked_tokens()
+        except Exception:
+            logger.exception("Failed to sync revoked tokens")
+        await asyncio.sleep(interval)
@@ -0,0 +1,205 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+import orjson
+from starlette.responses import Response
+
+
+class MemoryBackend:
+    """In-process LRU of byte values with per-entry expiry and per-doctor generation counters.
+
+    A generation is (epoch, counter): clearing the backend advances the epoch
+    instead of resetting the counters, so a generation read before a clear
+    never matches one read after it.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    async def generation(self, doctor_id: str) -> Hashable:
+        with self._lock:
+            return (self._epoch, self._generations.get(doctor_id, 0))
+
+    async def bump(self, doctor_id: str):
+        with self._lock:
+            self._generations[doctor_id] = self._generations.get(doctor_id, 0) + 1
+
+    async def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    async def set(self, key: Hashable, value: bytes):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    async def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._epoch += 1
+
+
+class RedisBackend:
+    """Backend on a Redis-compatible asyncio client, shared by every worker.
+
+    Generations are INCR counters, so a write in one worker invalidates the
+    doctor's entries for all of them; entries expire through the server's TTL
+    and its maxmemory policy rather than a local LRU. Clearing advances an
+    epoch key that survives the clear, like MemoryBackend's epoch.
+    """
+
+    def __init__(self, client, namespace: str, ttl: Optional[float] = None):
+        self.client = client
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def _key(self, key: Hashable) -> str:
+        return f"{self.namespace}:{hashlib.sha1(repr(key).encode()).hexdigest()}"
+
+    async def generation(self, doctor_id: str) -> Hashable:
+        epoch = int(await self.client.get(f"{self.namespace}:epoch") or 0)
+        return (epoch, int(await self.client.get(f"{self.namespace}:gen:{doctor_id}") or 0))
+
+    async def bump(self, doctor_id: str):
+        await self.client.incr(f"{self.namespace}:gen:{doctor_id}")
+
+    async def get(self, key: Hashable) -> Optional[bytes]:
+        return await self.client.get(self._key(key))
+
+    async def set(self, key: Hashable, value: bytes):
+        await self.client.set(self._key(key), value, ex=int(self.ttl) if self.ttl else None)
+
+    async def clear(self):
+        epoch_key = f"{self.namespace}:epoch"
+        await self.client.incr(epoch_key)
+        async for key in self.client.scan_iter(match=f"{self.namespace}:*"):
+            if key not in (epoch_key, epoch_key.encode()):
+                await self.client.delete(key)
+
+
+def make_backend(settings, namespace: str, maxsize: int):
+    if settings.CACHE_BACKEND == "redis":
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError('CACHE_BACKEND="redis" needs the redis package')
+        return RedisBackend(redis.from_url(settings.CACHE_REDIS_URL), namespace, settings.CACHE_TTL_SECONDS)
+    return MemoryBackend(maxsize, settings.CACHE_TTL_SECONDS)
+
+
+class DoctorCache:
+    """Per-doctor cache of encoded results, invalidated by bumping the doctor's generation.
+
+    Entries are keyed by (doctor, generation, key), so invalidating a doctor
+    makes all of their cached entries unreachable without scanning the cache;
+    the stale ones simply fall off the LRU end or expire. `get` returns the
+    generation it looked under and `set` stores under that same generation, so
+    a result rendered across an invalidation lands where nobody reads it.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, doctor_id: str, key: Hashable) -> Tuple[Optional[bytes], Hashable]:
+        generation = await self.backend.generation(doctor_id)
+        value = await self.backend.get((doctor_id, generation, key))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value, generation
+
+    async def set(self, doctor_id: str, key: Hashable, value: bytes, generation: Hashable):
+        await self.backend.set((doctor_id, generation, key), value)
+
+    async def invalidate(self, doctor_id: str):
+        await self.backend.bump(doctor_id)
+
+    async def invalidate_all(self):
+        await self.backend.clear()
+
+    async def clear(self):
+        await self.backend.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+_caches = []
+
+
+def register_cache(cache):
+    _caches.append(cache)
+    return cache
+
+
+async def invalidate_doctor(doctor_id: str):
+    """Drop every registered cache's entries for a doctor after their patients were written."""
+    for cache in _caches:
+        await cache.invalidate(doctor_id)
+
+
+async def invalidate_all():
+    """Drop every registered cache's entries, for changes whose doctor is unknown."""
+    for cache in _caches:
+        await cache.invalidate_all()
+
+
+CACHED_HEADERS = ("content-type", "x-next-cursor", "x-result-truncated")
+
+
+def _encode_response(response: Response) -> bytes:
+    headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+    etag = '"' + hashlib.sha1(response.body).hexdigest() + '"'
+    return orjson.dumps({"headers": headers, "etag": etag}) + b"\n" + response.body
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+async def cached_response(cache: DoctorCache, doctor_id: str, key: Hashable, if_none_match: Optional[str], render) -> Response:
+    """Serve a JSON response from the cache, rendering and storing it on a miss.
+
+    The ETag is a hash of the body kept with the entry, so a matching
+    If-None-Match is answered with 304 from the cache alone. Streaming
+    responses are passed through uncached.
+    """
+    entry, generation = await cache.get(doctor_id, key)
+    if entry is None:
+        response = await render()
+        if not hasattr(response, "body") or response.status_code != 200:
+            return response
+        entry = _encode_response(response)
+        await cache.set(doctor_id, key, entry, generation)
+
+    meta, body = entry.split(b"\n", 1)
+    meta = orjson.loads(meta)
+    if _etag_matches(if_none_match, meta["etag"]):
+        return Response(status_code=304, headers={"ETag": meta["etag"]})
+    headers = {**meta["headers"], "ETag": meta["etag"]}
+    return Response(content=body, headers=headers)
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+from pymongo.errors import OperationFailure
+
+from models.change_stream_token import ChangeStreamToken
+from models.patient import Patient
+from services.cache import invalidate_all, invalidate_doctor
+
+logger = logging.getLogger(__name__)
+
+STREAM_NAME = "patients"
+WRITE_OPERATIONS = ("insert", "update", "replace", "delete")
+# the collection or database went away; the stream ends and its token cannot be resumed
+ENDING_OPERATIONS = ("drop", "rename", "dropDatabase", "invalidate")
+# ChangeStreamHistoryLost, and ChangeStreamFatalError on older servers: the token has fallen off the oplog
+HISTORY_LOST_CODES = (280, 286)
+MAX_AWAIT_TIME_MS = 1000
+
+
+def change_pipeline() -> list:
+    """Write and end-of-stream events, trimmed to the doctor_id they concern."""
+    return [
+        {"$match": {"operationType": {"$in": list(WRITE_OPERATIONS + ENDING_OPERATIONS)}}},
+        {"$project": {"operationType": 1, "fullDocument.doctor_id": 1, "fullDocumentBeforeChange.doctor_id": 1}},
+    ]
+
+
+def changed_doctors(change: dict) -> Optional[set]:
+    """Doctors whose cached responses a change affects, or None when that is unknown.
+
+    Updates carry the current document (and the previous one with
+    pre-images, which catches a patient moving between doctors); deletes
+    name the doctor only with pre-images.
+    """
+    doctors = {(change.get(image) or {}).get("doctor_id") for image in ("fullDocument", "fullDocumentBeforeChange")}
+    doctors.discard(None)
+    return doctors or None
+
+
+class PatientChangeWatcher:
+    """Tails the patients change stream and drops this worker's cached responses for the doctors it touches.
+
+    Writes made by this worker already invalidated its caches; the stream
+    covers writes by other workers, pods and processes. After an error the
+    watch resumes from the last token this watcher handled. With
+    `persist_token` (a cache shared by every worker, such as redis) that
+    token is also checkpointed every `checkpoint_seconds`, so a restarted
+    process replays what the shared cache missed; an in-process cache starts
+    empty in a new process and has nothing to replay.
+    """
+
+    def __init__(self, pre_images: bool = False, checkpoint_seconds: float = 5, retry_seconds: float = 5,
+                 persist_token: bool = False):
+        self.pre_images = pre_images
+        self.checkpoint_seconds = checkpoint_seconds
+        self.retry_seconds = retry_seconds
+        self.persist_token = persist_token
+        self.events = 0
+        self.restarts = 0
+        # the last token whose events this watcher handled
+        self._token = None
+        self._saved_token = None
+        self._saved_at = 0.0
+
+    async def load_token(self) -> Optional[dict]:
+        doc = await ChangeStreamToken.get_motor_collection().find_one({"_id": STREAM_NAME})
+        return doc["resume_token"] if doc else None
+
+    async def resume_token(self) -> Optional[dict]:
+        if self._token is None and self.persist_token:
+            self._token = await self.load_token()
+        return self._token
+
+    async def save_token(self, token: Optional[dict], force: bool = False):
+        if token is None:
+            return
+        self._token = token
+        now = asyncio.get_running_loop().time()
+        if not self.persist_token or token == self._saved_token or (not force and now - self._saved_at < self.checkpoint_seconds):
+            return
+        await ChangeStreamToken.get_motor_collection().replace_one(
+            {"_id": STREAM_NAME},
+            {"_id": STREAM_NAME, "resume_token": token, "updated_at": datetime.now(timezone.utc)},
+            upsert=True,
+        )
+        self._saved_token = token
+        self._saved_at = now
+
+    async def forget_token(self):
+        self._token = None
+        if self.persist_token:
+            await ChangeStreamToken.get_motor_collection().delete_one({"_id": STREAM_NAME})
+            self._saved_token = None
+
+    async def handle(self, change: dict):
+        self.events += 1
+        doctors = changed_doctors(change) if change["operationType"] in WRITE_OPERATIONS else None
+        if doctors is None:
+            await invalidate_all()
+        else:
+            for doctor_id in doctors:
+                await invalidate_doctor(doctor_id)
+
+    async def watch(self):
+        """Follow the stream until it ends, starting from the last handled or stored token if there is one."""
+        options = {"full_document": "updateLookup", "max_await_time_ms": MAX_AWAIT_TIME_MS}
+        if self.pre_images:
+            options["full_document_before_change"] = "whenAvailable"
+        token = await self.resume_token()
+        async with Patient.get_motor_collection().watch(change_pipeline(), resume_after=token, **options) as stream:
+            try:
+                while stream.alive:
+                    change = await stream.try_next()
+                    if change is not None:
+                        await self.handle(change)
+                        if change["operationType"] in ENDING_OPERATIONS:
+                            await self.forget_token()
+                            return
+                    # idle batches move the resume token along too, keeping it inside the oplog window
+                    await self.save_token(stream.resume_token)
+            except asyncio.CancelledError:
+                # shutting down: store how far this got, so the next start replays as little as possible;
+                # the stream's own token may already be past an event that was not handled
+                await self.save_token(self._token, force=True)
+                raise
+            await self.save_token(stream.resume_token, force=True)
+
+    async def run(self):
+        """Watch forever, restarting after errors; a token the server no longer has is dropped and caches cleared.
+
+        Any error restarts the watch, not just driver errors: a failing cache
+        backend or an unexpected event must not silently end invalidation.
+        Events after the last handled token are replayed on the restart.
+        """
+        while True:
+            try:
+                try:
+                    await self.watch()
+                    continue
+                except OperationFailure as e:
+                    if e.code not in HISTORY_LOST_CODES:
+                        raise
+                    logger.warning("Patient change stream cannot resume, starting from now: %s", e)
+                    # changes since the token were missed
+                    await invalidate_all()
+                    await self.forget_token()
+            except Exception:
+                logger.exception("Patient change stream failed")
+            self.restarts += 1
+            await asyncio.sleep(self.retry_seconds)
+
+    def stats(self) -> dict:
+        return {"events": self.events, "restarts": self.restarts}
@@ -0,0 +1,186 @@
+import csv
+import io
+from datetime import datetime
+from operator import itemgetter
+from typing import AsyncIterator, Optional
+
+import orjson
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # parquet export is optional
+    pa = None
+
+from models.patient import Patient
+
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson", "parquet": "application/vnd.apache.parquet"}
+
+PATIENT_COLUMNS = ("id", "name", "city", "age", "gender", "height", "weight", "bmi", "verdict",
+                   "latest_condition", "latest_diagnosis_date")
+DIAGNOSIS_COLUMNS = ("disease", "condition", "diagnosis_on", "notes")
+
+EXPORT_PROJECTION = {column: 1 for column in PATIENT_COLUMNS if column != "id"} | {"diagnoses_history": 1}
+
+
+def parquet_available() -> bool:
+    return pa is not None
+
+
+def _date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _diagnosis(entry: dict) -> dict:
+    return {
+        "disease": entry.get("disease"),
+        "condition": entry.get("condition"),
+        "diagnosis_on": _date(entry.get("diagnosis_on")),
+        "notes": entry.get("notes"),
+    }
+
+
+def _patient(doc: dict) -> dict:
+    row = {column: doc.get(column) for column in PATIENT_COLUMNS}
+    row["id"] = doc["_id"]
+    row["latest_diagnosis_date"] = _date(row["latest_diagnosis_date"])
+    return row
+
+
+def rows(doc: dict, flatten: str):
+    """One row per patient (history kept as a list) or one per diagnosis (patient columns repeated)."""
+    patient = _patient(doc)
+    history = doc.get("diagnoses_history") or []
+    if flatten == "patient":
+        patient["diagnoses_history"] = [_diagnosis(entry) for entry in history]
+        yield patient
+        return
+    if not history:
+        # patients without diagnoses still get a row, with empty diagnosis columns
+        yield {**patient, **dict.fromkeys(DIAGNOSIS_COLUMNS)}
+    for entry in history:
+        yield {**patient, **_diagnosis(entry)}
+
+
+def columns(flatten: str) -> tuple:
+    return PATIENT_COLUMNS + (("diagnoses_history",) if flatten == "patient" else DIAGNOSIS_COLUMNS)
+
+
+class _CsvWriter:
+    def __init__(self, flatten: str):
+        self.columns = columns(flatten)
+        self.values = itemgetter(*self.columns)
+        self.nested = flatten == "patient"
+        self.header_sent = False
+
+    def write(self, batch: list) -> bytes:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if not self.header_sent:
+            writer.writerow(self.columns)
+            self.header_sent = True
+        if self.nested:
+            for row in batch:
+                # the same JSON list /patients/import accepts in this column
+                row["diagnoses_history"] = orjson.dumps(row["diagnoses_history"]).decode()
+        # csv writes None as an empty field and dates in ISO format
+        writer.writerows(map(self.values, batch))
+        return buffer.getvalue().encode()
+
+    def close(self) -> bytes:
+        return b"" if self.header_sent else self.write([])
+
+
+class _NdjsonWriter:
+    def __init__(self, flatten: str):
+        pass
+
+    def write(self, batch: list) -> bytes:
+        return b"".join(orjson.dumps(row) + b"\n" for row in batch)
+
+    def close(self) -> bytes:
+        return b""
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands everything written since the last drain back as one chunk."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _parquet_schema(flatten: str):
+    patient_fields = [
+        ("id", pa.string()), ("name", pa.string()), ("city", pa.string()), ("age", pa.int32()),
+        ("gender", pa.string()), ("height", pa.float64()), ("weight", pa.float64()), ("bmi", pa.float64()),
+        ("verdict", pa.string()), ("latest_condition", pa.string()), ("latest_diagnosis_date", pa.date32()),
+    ]
+    diagnosis_fields = [("disease", pa.string()), ("condition", pa.string()), ("diagnosis_on", pa.date32()), ("notes", pa.string())]
+    if flatten == "patient":
+        return pa.schema(patient_fields + [("diagnoses_history", pa.list_(pa.struct(diagnosis_fields)))])
+    return pa.schema(patient_fields + diagnosis_fields)
+
+
+class _ParquetWriter:
+    """Writes each batch as its own row group, so only one batch is ever held in memory."""
+
+    def __init__(self, flatten: str):
+        self.schema = _parquet_schema(flatten)
+        self.sink = _ChunkSink()
+        self.writer = pq.ParquetWriter(self.sink, self.schema)
+
+    def write(self, batch: list) -> bytes:
+        self.writer.write_table(pa.Table.from_pylist(batch, schema=self.schema))
+        return self.sink.drain()
+
+    def close(self) -> bytes:
+        self.writer.close()
+        return self.sink.drain()
+
+
+WRITERS = {"csv": _CsvWriter, "ndjson": _NdjsonWriter, "parquet": _ParquetWriter}
+
+
+async def encode_chunks(documents: AsyncIterator[dict], export_format: str, flatten: str,
+                        batch_size: int) -> AsyncIterator[bytes]:
+    """Encode raw patient documents into one output chunk per batch_size patients."""
+    writer = WRITERS[export_format](flatten)
+    batch = []
+    patients = 0
+    async for doc in documents:
+        batch.extend(rows(doc, flatten))
+        patients += 1
+        if patients == batch_size:
+            yield writer.write(batch)
+            batch, patients = [], 0
+    if batch:
+        yield writer.write(batch)
+    tail = writer.close()
+    if tail:
+        yield tail
+
+
+def export_patients(doctor_id: str, export_format: str, flatten: str, batch_size: int,
+                    query: Optional[dict] = None, max_time_ms: Optional[int] = None) -> AsyncIterator[bytes]:
+    """Stream a doctor's patients in _id order, encoded batch by batch.
+
+    Documents are read raw from a Motor cursor fetching batch_size at a time,
+    so memory stays proportional to the batch rather than to the practice.
+    """
+    cursor = Patient.get_motor_collection().find(
+        {"doctor_id": doctor_id, **(query or {})}, EXPORT_PROJECTION, sort=[("_id", 1)], batch_size=batch_size,
+        **({"max_time_ms": max_time_ms} if max_time_ms else {})
+    )
+    return encode_chunks(cursor, export_format, flatten, batch_size)
@@ -0,0 +1,74 @@
+import calendar
+import re
+from datetime import date, datetime
+from typing import Optional
+
+from fastapi import HTTPException
+
+from models.patient import normalize_disease
+
+DISEASE_MATCH_MODES = ('exact', 'prefix', 'contains', 'fuzzy')
+# no diagnosis predates its patient, and patients are younger than 120
+MAX_DIAGNOSIS_MONTHS = 120 * 12
+
+
+def months_ago(today: date, months: int) -> date:
+    """The same day `months` calendar months earlier, clamped to the end of shorter months and to date.min."""
+    month_index = today.year * 12 + today.month - 1 - months
+    if month_index < 12:
+        return date.min
+    year, month = divmod(month_index, 12)
+    month += 1
+    return date(year, month, min(today.day, calendar.monthrange(year, month)[1]))
+
+
+def disease_predicate(disease_name: str, mode: str = 'contains', text_index: bool = False) -> Optional[dict]:
+    """Query on the normalized disease token for a disease search.
+
+    exact and prefix are bounded scans of the (doctor_id, disease_token) index;
+    contains has to walk every index key of the doctor; fuzzy uses the optional
+    text index on diagnoses_history.disease.
+    """
+    token = normalize_disease(disease_name)
+    if not token:
+        return None
+    if mode == 'exact':
+        return {"diagnoses_history.disease_token": token}
+    if mode == 'prefix':
+        # a case-sensitive regex anchored with ^ is turned into index bounds
+        return {"diagnoses_history.disease_token": {"$regex": f"^{re.escape(token)}"}}
+    if mode == 'contains':
+        return {"diagnoses_history.disease_token": {"$regex": re.escape(token)}}
+    if not text_index:
+        raise HTTPException(status_code=400, detail="Fuzzy disease search is not enabled")
+    return {"$text": {"$search": disease_name}}
+
+
+def diagnosis_filter(disease_name: Optional[str] = None, disease_match: str = 'contains', condition: Optional[str] = None,
+                     diagnosed_after_months: Optional[int] = None, text_index: bool = False,
+                     today: Optional[date] = None) -> dict:
+    """Build one query where every diagnosis predicate must hold for the same diagnosis.
+
+    Separate dotted-path conditions on diagnoses_history each match any element,
+    so disease, condition and date could come from three different diagnoses.
+    Wrapping them in $elemMatch ties them to one entry and lets the
+    (doctor_id, disease_token, condition, diagnosis_on) multikey index bound
+    all three. A fuzzy text search cannot live inside $elemMatch and stays a
+    top-level condition.
+    """
+    query = {}
+    element = {}
+    if disease_name:
+        predicate = disease_predicate(disease_name, disease_match, text_index)
+        if predicate and "$text" in predicate:
+            query.update(predicate)
+        elif predicate:
+            element["disease_token"] = predicate["diagnoses_history.disease_token"]
+    if condition:
+        element["condition"] = condition
+    if diagnosed_after_months is not None:
+        from_date = months_ago(today or date.today(), diagnosed_after_months)
+        element["diagnosis_on"] = {"$gte": datetime.combine(from_date, datetime.min.time())}
+    if element:
+        query["diagnoses_history"] = {"$elemMatch": element}
+    return query
@@ -0,0 +1,137 @@
+from typing import Optional
+
+from models.patient import normalize_condition, normalize_disease
+from services.stats import UNKNOWN
+
+GROUP_KEYS = {
+    "disease": "$diagnoses_history.disease_token",
+    "condition": "$diagnoses_history.condition_token",
+    "city": "$city",
+    "gender": "$gender",
+    "verdict": "$verdict",
+}
+
+# keys that live on diagnoses rather than on the patient
+DIAGNOSIS_KEYS = {"disease", "condition"}
+
+MEMBER_PROJECTION = {
+    "id": "$_id",
+    "name": "$name",
+    "city": "$city",
+    "age": "$age",
+    "gender": "$gender",
+    "verdict": "$verdict",
+    "latest_condition": "$latest_condition",
+    "latest_diagnosis_date": "$latest_diagnosis_date",
+}
+
+LEGACY_MEMBER = {**MEMBER_PROJECTION, "diagnosis_details": "$diagnoses_history"}
+
+
+def group_pipeline(doctor_id: str, by: str, members: int = 0, max_groups: Optional[int] = None,
+                   top_n: bool = False) -> list:
+    """Count a doctor's patients per group value in a single $facet aggregation.
+
+    Diagnosis keys are the stored normalized tokens and each patient counts
+    once per value, however many times they were diagnosed with it. With
+    members > 0 each group also carries that many projected members, ordered
+    by patient id; with top_n (MongoDB 5.2+) $topN keeps only those while
+    grouping, otherwise every member is pushed and then sliced. With
+    max_groups, one group beyond it is kept to tell format_groups the list
+    was cut. Patients without the field (e.g. no BMI, so no verdict) form
+    the "unknown" group, which group_member_filter() accepts as a value.
+    """
+    key = GROUP_KEYS[by]
+    pipeline = [{"$match": {"doctor_id": doctor_id}}]
+    if by in DIAGNOSIS_KEYS:
+        pipeline += [
+            {"$unwind": "$diagnoses_history"},
+            {"$project": {"_id": 0, "key": key, "member": MEMBER_PROJECTION}},
+            {"$group": {"_id": {"key": "$key", "patient": "$member.id"}, "member": {"$first": "$member"}}},
+            {"$project": {"_id": 0, "key": "$_id.key", "member": 1}},
+        ]
+    else:
+        pipeline.append({"$project": {"_id": 0, "key": {"$ifNull": [key, UNKNOWN]}, "member": MEMBER_PROJECTION}})
+
+    group = {"_id": "$key", "count": {"$sum": 1}}
+    groups = [{"$group": group}, {"$sort": {"count": -1, "_id": 1}}]
+    if max_groups is not None:
+        groups.append({"$limit": max_groups + 1})
+    if members and top_n:
+        group["members"] = {"$topN": {"n": members, "sortBy": {"member.id": 1}, "output": "$member"}}
+    elif members:
+        pipeline.append({"$sort": {"member.id": 1}})
+        group["members"] = {"$push": "$member"}
+        groups.append({"$project": {"count": 1, "members": {"$slice": ["$members", members]}}})
+
+    pipeline.append({"$facet": {
+        "groups": groups,
+        "total": [{"$group": {"_id": "$member.id"}}, {"$count": "patients"}],
+    }})
+    return pipeline
+
+
+def format_groups(by: str, result: list, max_groups: Optional[int] = None) -> dict:
+    facet = result[0] if result else {"groups": [], "total": []}
+    groups = facet["groups"]
+    truncated = max_groups is not None and len(groups) > max_groups
+    return {
+        "by": by,
+        "total_patients": facet["total"][0]["patients"] if facet["total"] else 0,
+        "groups": [
+            {"value": group["_id"], "count": group["count"], **({"members": group["members"]} if "members" in group else {})}
+            for group in groups[:max_groups]
+        ],
+        "truncated": truncated,
+    }
+
+
+def group_member_filter(by: str, value: str) -> dict:
+    """Query matching the patients that belong to one group of group_pipeline()."""
+    if by == "disease":
+        return {"diagnoses_history.disease_token": normalize_disease(value)}
+    if by == "condition":
+        return {"diagnoses_history.condition_token": normalize_condition(value)}
+    field = GROUP_KEYS[by].lstrip("$")
+    if value == UNKNOWN:
+        return {field: {"$in": [UNKNOWN, None]}}
+    return {field: value}
+
+
+def legacy_group_pipeline(doctor_id: str, by: str, max_groups: Optional[int], max_patients: int,
+                          top_n: bool = False) -> list:
+    """Pipeline behind /group_by_disease and /group_by_condition: projected members, no full copies.
+
+    Groups come in value order, at most max_groups + 1 of them so a cut list
+    can be detected, each with its patient_count and a truncated flag. With
+    top_n (MongoDB 5.2+) $topN keeps the first max_patients members by id
+    while grouping, so no group document grows with the practice. Without it
+    the groups carry no members and the caller fills each one with
+    legacy_group_members_pipeline().
+    """
+    group = {"_id": GROUP_KEYS[by], "patient_count": {"$sum": 1}}
+    if top_n:
+        group["patients"] = {"$topN": {"n": max_patients, "sortBy": {"_id": 1}, "output": LEGACY_MEMBER}}
+    pipeline = [
+        {"$match": {"doctor_id": doctor_id}},
+        {"$unwind": "$diagnoses_history"},
+        {"$group": group},
+        {"$sort": {"_id": 1}},
+    ]
+    if max_groups is not None:
+        pipeline.append({"$limit": max_groups + 1})
+    pipeline.append({"$addFields": {"truncated": {"$gt": ["$patient_count", max_patients]}}})
+    return pipeline
+
+
+def legacy_group_members_pipeline(doctor_id: str, by: str, value: Optional[str], max_patients: int) -> list:
+    """The first max_patients members of one legacy group by id, for servers without $topN."""
+    field = GROUP_KEYS[by].lstrip("$")
+    return [
+        {"$match": {"doctor_id": doctor_id, field: value}},
+        {"$sort": {"_id": 1}},
+        {"$unwind": "$diagnoses_history"},
+        {"$match": {field: value}},
+        {"$limit": max_patients},
+        {"$project": {"_id": 0, **LEGACY_MEMBER}},
+    ]
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, HTTPException
+
+from config import get_settings
+from services.auth import get_current_doctor
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+
+def find_options() -> dict:
+    """Keyword arguments bounding the server time of a Beanie or Motor find."""
+    return {"max_time_ms": settings.MONGO_MAX_TIME_MS} if settings.MONGO_MAX_TIME_MS else {}
+
+
+def aggregate_options(spill: bool = False) -> dict:
+    """Aggregate options: maxTimeMS, plus allowDiskUse for pipelines whose $group or $sort may outgrow memory."""
+    options = {"maxTimeMS": settings.MONGO_MAX_TIME_MS} if settings.MONGO_MAX_TIME_MS else {}
+    if spill and settings.MONGO_ALLOW_DISK_USE:
+        options["allowDiskUse"] = True
+    return options
+
+
+class DoctorConcurrencyLimiter:
+    """Caps how many expensive requests each doctor runs at once.
+
+    Up to `max_concurrent` run and `max_queue` more wait for a slot; beyond
+    that the doctor gets a 429, so one heavy user cannot tie up the event
+    loop or the connection pool while other doctors are unaffected.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.rejected = 0
+        # doctor_id -> [semaphore, requests holding or waiting for it]; dropped when idle
+        self._doctors = {}
+
+    async def acquire(self, doctor_id: str):
+        entry = self._doctors.get(doctor_id)
+        if entry is None:
+            entry = self._doctors[doctor_id] = [asyncio.Semaphore(self.max_concurrent), 0]
+        if entry[1] >= self.max_concurrent + self.max_queue:
+            self.rejected += 1
+            logger.warning("Doctor %s has %d expensive requests in flight, rejecting", doctor_id, entry[1])
+            raise HTTPException(status_code=429, detail="Too many concurrent expensive requests, retry shortly",
+                                headers={"Retry-After": "1"})
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._leave(doctor_id, entry)
+            raise
+
+    def release(self, doctor_id: str):
+        entry = self._doctors[doctor_id]
+        entry[0].release()
+        self._leave(doctor_id, entry)
+
+    def _leave(self, doctor_id: str, entry: list):
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._doctors[doctor_id]
+
+    @asynccontextmanager
+    async def slot(self, doctor_id: str):
+        await self.acquire(doctor_id)
+        try:
+            yield
+        finally:
+            self.release(doctor_id)
+
+    async def lease(self, doctor_id: str) -> "SlotLease":
+        """Take a slot now, raising 429 before any response starts, and hand back a lease to release it later."""
+        await self.acquire(doctor_id)
+        return SlotLease(self, doctor_id)
+
+    def stats(self) -> dict:
+        return {
+            "doctors": len(self._doctors),
+            "in_flight": sum(users for _, users in self._doctors.values()),
+            "rejected": self.rejected,
+        }
+
+
+class SlotLease:
+    """A held slot for a streamed body, released once when the stream ends.
+
+    `hold` releases it when the body is exhausted, fails or is closed; calling
+    the lease (as the response's background task) covers a client that
+    disconnects before the body was ever iterated.
+    """
+
+    def __init__(self, limiter: DoctorConcurrencyLimiter, doctor_id: str):
+        self.limiter = limiter
+        self.doctor_id = doctor_id
+        self.released = False
+
+    def __call__(self):
+        if not self.released:
+            self.released = True
+            self.limiter.release(self.doctor_id)
+
+    async def hold(self, chunks):
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            self()
+
+
+expensive_limiter = DoctorConcurrencyLimiter(settings.EXPENSIVE_CONCURRENCY_PER_DOCTOR, settings.EXPENSIVE_QUEUE_PER_DOCTOR)
+
+
+async def expensive_slot(current_doctor: str = Depends(get_current_doctor)):
+    """Dependency holding one of the doctor's expensive-request slots while the endpoint runs.
+
+    FastAPI before 0.118 exits yield dependencies before a StreamingResponse
+    body is iterated, so streamed endpoints take an `expensive_limiter.lease`
+    and hold it in the body instead.
+    """
+    async with expensive_limiter.slot(current_doctor):
+        yield
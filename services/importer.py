@@ -0,0 +1,198 @@
+import codecs
+import csv
+import json
+import tempfile
+from collections import Counter
+from typing import AsyncIterator, Optional
+
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+from models.patient import Patient, PatientCreate
+from services import stats
+
+DUPLICATE_KEY_ERROR = 11000
+CSV_MEDIA_TYPE = "text/csv"
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/jsonl", "application/x-jsonlines")
+
+
+def import_format(content_type: Optional[str]) -> Optional[str]:
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type == CSV_MEDIA_TYPE:
+        return "csv"
+    if media_type in NDJSON_MEDIA_TYPES:
+        return "ndjson"
+    return None
+
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_length: int) -> AsyncIterator[Optional[str]]:
+    """Split a byte stream into text lines, holding at most max_length characters at a time.
+
+    A line longer than max_length is dropped and yielded as None so callers can
+    report it as a failed row.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    skipping = False
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        if skipping and lines:
+            # the first completed line is the tail of the oversized one
+            lines = lines[1:]
+            skipping = False
+        for line in lines:
+            yield line.rstrip("\r") if len(line) <= max_length else None
+        if len(buffer) > max_length:
+            if not skipping:
+                yield None
+            skipping = True
+            buffer = ""
+    buffer += decoder.decode(b"", final=True)
+    if buffer and not skipping:
+        yield buffer.rstrip("\r") if len(buffer) <= max_length else None
+
+
+async def iter_ndjson_rows(lines: AsyncIterator[Optional[str]], max_length: int) -> AsyncIterator[tuple]:
+    """Yield (row number, parsed object or error message) for every non-blank line."""
+    row = 0
+    async for line in lines:
+        if line is not None and not line.strip():
+            continue
+        row += 1
+        if line is None:
+            yield row, f"Row exceeds {max_length} characters"
+            continue
+        try:
+            yield row, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row, f"Invalid JSON: {e.msg}"
+
+
+async def iter_csv_rows(lines: AsyncIterator[Optional[str]], max_length: int) -> AsyncIterator[tuple]:
+    """Yield (row number, dict or error message) for each CSV record after the header.
+
+    Empty cells are treated as missing values and a diagnoses_history column,
+    if present, must hold a JSON list of diagnoses. A record (including quoted
+    fields spanning lines) longer than max_length is reported and skipped.
+    """
+    header = None
+    row = 0
+    parts = []
+    length = 0
+    in_quotes = False
+    async for line in lines:
+        if line is None or length + len(line) > max_length:
+            row += 1
+            yield row, f"Row exceeds {max_length} characters"
+            parts, length, in_quotes = [], 0, False
+            continue
+        parts.append(line)
+        length += len(line) + 1
+        # quote parity is tracked per line, so an open quoted field costs O(1) per extra line
+        if line.count('"') % 2:
+            in_quotes = not in_quotes
+        if in_quotes:
+            continue
+        values = next(csv.reader(part + "\n" for part in parts), [])
+        parts, length = [], 0
+        if not any(value.strip() for value in values):
+            continue
+        if header is None:
+            header = [value.strip() for value in values]
+            continue
+        row += 1
+        if len(values) != len(header):
+            yield row, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        data = {key: value for key, value in zip(header, values) if value != ""}
+        if "diagnoses_history" in data:
+            try:
+                data["diagnoses_history"] = json.loads(data["diagnoses_history"])
+            except json.JSONDecodeError:
+                yield row, "diagnoses_history must be a JSON list"
+                continue
+        yield row, data
+    if parts:
+        yield row + 1, "Unterminated quoted field"
+
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}" for e in error.errors())
+
+
+async def _insert_batch(batch: list) -> list:
+    """Insert a batch unordered and return one report entry per row."""
+    results = {row: {"row": row, "id": patient.id, "status": "created"} for row, patient in batch}
+    try:
+        await Patient.insert_many([patient for _, patient in batch], ordered=False)
+    except BulkWriteError as e:
+        for write_error in e.details.get("writeErrors", []):
+            row, patient = batch[write_error["index"]]
+            message = "Patient already exists" if write_error.get("code") == DUPLICATE_KEY_ERROR else write_error.get("errmsg")
+            results[row] = {"row": row, "id": patient.id, "status": "error", "error": message}
+    return list(results.values())
+
+
+async def import_patients(rows: AsyncIterator[tuple], doctor_id: str, batch_size: int) -> AsyncIterator[dict]:
+    """Validate rows incrementally and insert them in batches, yielding a report entry per row.
+
+    Invalid rows are reported straight away; valid ones are reported once their
+    batch has been written. The last entry is a summary of the whole import.
+    """
+    batch = []
+    created = failed = 0
+
+    async def flush():
+        nonlocal created, failed
+        delta = Counter()
+        # _insert_batch reports rows in batch order
+        for (_, patient), result in zip(batch, await _insert_batch(batch)):
+            if result["status"] == "created":
+                created += 1
+                delta.update(stats.contribution(patient.model_dump()))
+            else:
+                failed += 1
+            yield result
+        batch.clear()
+        await stats.apply(doctor_id, delta)
+
+    async for row, data in rows:
+        if isinstance(data, str):
+            failed += 1
+            yield {"row": row, "status": "error", "error": data}
+            continue
+        try:
+            patient_data = PatientCreate.model_validate(data)
+        except ValidationError as e:
+            failed += 1
+            yield {"row": row, "id": data.get("id") if isinstance(data, dict) else None, "status": "error", "error": _validation_message(e)}
+            continue
+        batch.append((row, Patient(**patient_data.model_dump(), doctor_id=doctor_id)))
+        if len(batch) >= batch_size:
+            async for result in flush():
+                yield result
+    if batch:
+        async for result in flush():
+            yield result
+
+    yield {"summary": {"created": created, "failed": failed}}
+
+
+async def import_to_spool(rows: AsyncIterator[tuple], doctor_id: str, batch_size: int, spool_size: int):
+    """Run the whole import and return its NDJSON report in a rewound spool file.
+
+    The report stays in memory up to spool_size bytes and spills to disk after
+    that, so the upload can be read to the end before any response is sent.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_size, mode="w+b")
+    async for result in import_patients(rows, doctor_id, batch_size):
+        spool.write(json.dumps(result).encode() + b"\n")
+    spool.seek(0)
+    return spool
+
+
+def iter_spool(spool, chunk_size: int = 64 * 1024):
+    with spool:
+        while chunk := spool.read(chunk_size):
+            yield chunk
@@ -0,0 +1,244 @@
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount: float = 1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labelvalues, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labelvalues, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, labelvalues, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labelvalues, le)} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labelvalues)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labelvalues)} {count}")
+        return lines
+
+
+class GaugeCallback:
+    """Gauge (or externally counted counter) whose samples are read from a callback at scrape time."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple, collect: Callable[[], dict], metric_type: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.collect = collect
+        self.metric_type = metric_type
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for labelvalues, value in sorted(self.collect().items()):
+            if value is not None:
+                lines.append(f"{self.name}{_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_DURATION = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route", "status")))
+REQUEST_PHASE_DURATION = registry.register(Histogram(
+    "http_request_phase_seconds", "Sampled time per request spent in db, validation and serialization", ("route", "phase")))
+MONGO_COMMAND_DURATION = registry.register(Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency", ("collection", "command")))
+MONGO_COMMAND_FAILURES = registry.register(Counter(
+    "mongodb_command_failures_total", "Failed MongoDB commands", ("collection", "command")))
+
+
+class RequestTimings:
+    """Time a sampled request spent per phase; db time is fed by the Motor command listener."""
+
+    def __init__(self):
+        self.phases = {"db": 0.0, "validation": 0.0, "serialization": 0.0}
+        self._lock = threading.Lock()
+
+    def add(self, phase: str, seconds: float):
+        with self._lock:
+            self.phases[phase] += seconds
+
+
+_request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def record_phase(phase: str):
+    """Attribute the wrapped block to a phase, excluding any db time spent inside it."""
+    timings = _request_timings.get()
+    if timings is None:
+        yield
+        return
+    db_before = timings.phases["db"]
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start - (timings.phases["db"] - db_before)
+        timings.add(phase, max(elapsed, 0.0))
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Records every MongoDB command by collection and name, and adds it to the current request's db time.
+
+    Motor runs commands on executor threads with a copy of the caller's context,
+    so the request's RequestTimings is visible here.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+
+    def started(self, event):
+        # getMore's own field holds the cursor id; the collection is named separately
+        collection = event.command.get("collection" if event.command_name == "getMore" else event.command_name)
+        if not isinstance(collection, str):
+            collection = "-"
+        self._inflight[(event.connection_id, event.request_id)] = (collection, _request_timings.get())
+
+    def _finish(self, event, failed: bool):
+        collection, timings = self._inflight.pop((event.connection_id, event.request_id), ("-", None))
+        seconds = event.duration_micros / 1_000_000
+        MONGO_COMMAND_DURATION.observe(seconds, collection, event.command_name)
+        if failed:
+            MONGO_COMMAND_FAILURES.inc(collection, event.command_name)
+        if timings is not None:
+            timings.add("db", seconds)
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+
+command_timer = CommandTimer()
+
+
+def _route_template(scope) -> str:
+    """Path template of the matched route, e.g. /patients/patient/{patient_id}, keeping label cardinality low."""
+    route = scope.get("route")
+    if route is None or not hasattr(route, "path_format"):
+        return "unmatched"
+    # routes of included routers may carry only their own part of the path; recover the prefix
+    try:
+        rendered = route.path_format.format(**scope.get("path_params", {}))
+    except (KeyError, IndexError):
+        return route.path
+    path = scope["path"]
+    prefix = path[: len(path) - len(rendered)] if path.endswith(rendered) else ""
+    return prefix + route.path
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each request by route template until its last body chunk is sent.
+
+    The per-phase breakdown needs a context variable per request, so it is only
+    kept for a sample_rate fraction of requests; latency is always recorded.
+    """
+
+    def __init__(self, app, sample_rate: float = 1.0, exclude_paths: tuple = ("/metrics",)):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.exclude_paths = exclude_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings() if random.random() < self.sample_rate else None
+        token = _request_timings.set(timings)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_timings.reset(token)
+            route_path = _route_template(scope)
+            REQUEST_DURATION.observe(time.perf_counter() - start, scope["method"], route_path, str(status))
+            if timings is not None:
+                for phase, seconds in timings.phases.items():
+                    REQUEST_PHASE_DURATION.observe(seconds, route_path, phase)
@@ -0,0 +1,169 @@
+import base64
+import json
+from typing import Any, Optional
+
+import orjson
+import pymongo
+from beanie.odm.utils.encoder import Encoder
+from bson import json_util
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
+
+from services.metrics import record_phase
+from services.serialization import raw_projection, serialize_raw_patient
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+TRUNCATED_HEADER = "X-Result-Truncated"
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(last_id: Any, sort_by: str = "_id", sort_value: Any = None) -> str:
+    # bson's extended JSON keeps datetimes and other BSON types intact across the round trip
+    payload = json_util.dumps({"f": sort_by, "v": Encoder().encode(sort_value), "id": last_id})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_by: str = "_id") -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json_util.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        if payload["f"] != sort_by or "id" not in payload:
+            raise ValueError("cursor does not match sort field")
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return payload
+
+
+def keyset_filter(cursor: dict, sort_by: str = "_id", sort_order: int = pymongo.ASCENDING) -> dict:
+    """Match documents strictly after the cursor position in (sort_by, _id) order."""
+    after = "$gt" if sort_order == pymongo.ASCENDING else "$lt"
+    last_id = cursor["id"]
+    if sort_by == "_id":
+        return {"_id": {after: last_id}}
+
+    value = cursor["v"]
+    # MongoDB orders nulls/missing before every other value, so they are the first
+    # page of an ascending walk and the last page of a descending one
+    if value is None:
+        if sort_order == pymongo.ASCENDING:
+            return {"$or": [{sort_by: None, "_id": {after: last_id}}, {sort_by: {"$ne": None}}]}
+        return {sort_by: None, "_id": {after: last_id}}
+
+    clauses = [{sort_by: {after: value}}, {sort_by: value, "_id": {after: last_id}}]
+    if sort_order == pymongo.DESCENDING:
+        clauses.append({sort_by: None})
+    return {"$or": clauses}
+
+
+def wants_ndjson(accept: Optional[str]) -> bool:
+    return bool(accept) and NDJSON_MEDIA_TYPE in accept
+
+
+def _cursor_for(doc, sort_by: str) -> str:
+    if isinstance(doc, dict):
+        return encode_cursor(doc["_id"]) if sort_by == "_id" else encode_cursor(doc["_id"], sort_by, doc.get(sort_by))
+    if sort_by == "_id":
+        return encode_cursor(doc.id)
+    return encode_cursor(doc.id, sort_by, getattr(doc, sort_by))
+
+
+async def paginate(query, *, limit: Optional[int], after: Optional[str], sort_by: str = "_id",
+                   sort_order: int = pymongo.ASCENDING, accept: Optional[str] = None, fast: bool = False,
+                   cap: Optional[int] = None):
+    """Apply keyset paging to a Beanie query and render it as JSON or streamed NDJSON.
+
+    The next page's cursor is returned in the X-Next-Cursor header for JSON
+    responses and as a trailing {"next_cursor": ...} line for NDJSON streams.
+    With fast, documents are read as projected raw dicts and encoded with
+    orjson instead of being validated into models and run through
+    jsonable_encoder. Without a limit, cap bounds the response instead; a
+    response cut short by it carries X-Result-Truncated (or "truncated" on
+    the trailing NDJSON line) along with the cursor to continue from.
+    """
+    capped = limit is None and cap is not None
+    if capped:
+        limit = cap
+    if after:
+        query = query.find(keyset_filter(decode_cursor(after, sort_by), sort_by, sort_order))
+    sort = [(sort_by, sort_order)] if sort_by == "_id" else [(sort_by, sort_order), ("_id", sort_order)]
+    query = query.sort(*sort)
+    if limit is not None:
+        # one extra document tells us whether another page exists
+        query = query.limit(limit + 1)
+
+    if fast:
+        return await _paginate_raw(query, sort, limit, sort_by, accept, capped)
+
+    if wants_ndjson(accept):
+        return StreamingResponse(_stream_ndjson(query, limit, sort_by, capped), media_type=NDJSON_MEDIA_TYPE)
+
+    # Beanie validates each document while fetching; db time inside is subtracted
+    with record_phase("validation"):
+        docs = await query.to_list()
+    headers = _page_headers(docs, limit, sort_by, capped)
+    if limit is not None:
+        docs = docs[:limit]
+    with record_phase("serialization"):
+        return JSONResponse(content=jsonable_encoder(docs), headers=headers)
+
+
+def _page_headers(docs: list, limit: Optional[int], sort_by: str, capped: bool) -> dict:
+    if limit is None or len(docs) <= limit:
+        return {}
+    headers = {NEXT_CURSOR_HEADER: _cursor_for(docs[limit - 1], sort_by)}
+    if capped:
+        headers[TRUNCATED_HEADER] = "true"
+    return headers
+
+
+def _trailer(next_cursor: str, capped: bool) -> dict:
+    return {"next_cursor": next_cursor, "truncated": True} if capped else {"next_cursor": next_cursor}
+
+
+async def _stream_ndjson(query, limit: Optional[int], sort_by: str, capped: bool = False):
+    sent = 0
+    last = None
+    async for doc in query:
+        if limit is not None and sent == limit:
+            yield json.dumps(_trailer(_cursor_for(last, sort_by), capped)) + "\n"
+            return
+        yield json.dumps(jsonable_encoder(doc)) + "\n"
+        last = doc
+        sent += 1
+
+
+async def _paginate_raw(query, sort: list, limit: Optional[int], sort_by: str, accept: Optional[str], capped: bool = False):
+    document_model = query.document_model
+    projection = raw_projection(query.projection_model)
+    fill_derived = query.projection_model is document_model
+    cursor = document_model.get_motor_collection().find(
+        query.get_filter_query(), projection, sort=sort, limit=limit + 1 if limit is not None else 0, **query.pymongo_kwargs
+    )
+
+    def encode(doc: dict) -> dict:
+        return serialize_raw_patient(doc, projection, fill_derived)
+
+    if wants_ndjson(accept):
+        return StreamingResponse(_stream_raw_ndjson(cursor, limit, sort_by, encode, capped), media_type=NDJSON_MEDIA_TYPE)
+
+    docs = await cursor.to_list(None)
+    headers = _page_headers(docs, limit, sort_by, capped)
+    if limit is not None:
+        docs = docs[:limit]
+    with record_phase("serialization"):
+        return ORJSONResponse(content=[encode(doc) for doc in docs], headers=headers)
+
+
+async def _stream_raw_ndjson(cursor, limit: Optional[int], sort_by: str, encode, capped: bool = False):
+    sent = 0
+    last_cursor = None
+    async for doc in cursor:
+        if limit is not None and sent == limit:
+            yield orjson.dumps(_trailer(last_cursor, capped)) + b"\n"
+            return
+        # the cursor is taken before encode() turns stored datetimes into dates
+        last_cursor = _cursor_for(doc, sort_by)
+        yield orjson.dumps(encode(doc)) + b"\n"
+        sent += 1
@@ -0,0 +1,100 @@
+from typing import Optional
+
+from beanie.odm.utils.encoder import Encoder
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+from models.patient import DiagnosisEntry, Patient, derived_updates
+from services import stats
+from services.guardrails import find_options
+
+MAX_ATTEMPTS = 5
+
+NOT_FOUND = 'Patient not found'
+REVISION_CONFLICT = 'Patient was modified by another request'
+
+
+def _revision_filter(revision: int) -> dict:
+    # documents written before revisions existed have no field, which counts as 0
+    return {"revision": revision} if revision else {"revision": {"$in": [0, None]}}
+
+
+async def _raise_missing_or_conflict(scope: dict):
+    if await Patient.get_motor_collection().count_documents(scope, limit=1):
+        raise HTTPException(status_code=409, detail=REVISION_CONFLICT)
+    raise HTTPException(status_code=404, detail=NOT_FOUND)
+
+
+async def update_patient_fields(patient_id: str, doctor_id: str, changes: dict, revision: Optional[int] = None) -> int:
+    """Apply a partial update with a single $set scoped to the doctor and return the new revision.
+
+    Derived fields are recomputed in the same update. Only when height or
+    weight changes alone is the other one read first, and the write is then
+    guarded on the revision it was read at and retried if that moved on.
+    """
+    collection = Patient.get_motor_collection()
+    scope = {"_id": patient_id, "doctor_id": doctor_id}
+    missing = {"height", "weight"} - changes.keys() if {"height", "weight"} & changes.keys() else set()
+
+    for _ in range(MAX_ATTEMPTS):
+        guard = _revision_filter(revision) if revision is not None else {}
+        inputs = changes
+        if missing:
+            current = await collection.find_one({**scope, **guard}, {**{field: 1 for field in missing}, "revision": 1}, **find_options())
+            if current is None:
+                await _raise_missing_or_conflict(scope)
+            inputs = {**changes, **{field: current.get(field) for field in missing}}
+            guard = _revision_filter(current.get("revision") or 0)
+
+        update = {"$inc": {"revision": 1}}
+        fields = {**changes, **derived_updates(inputs)}
+        if fields:
+            update["$set"] = Encoder().encode(fields)
+        # the previous values feed the stats rollup; the history is only fetched when it is being replaced
+        projection = {"revision": 1}
+        if stats.settings.STATS_ROLLUP_ENABLED:
+            projection.update({field: 1 for field in stats.STATS_FIELDS if field.split(".")[0] in fields or "." not in field})
+        before = await collection.find_one_and_update(
+            {**scope, **guard}, update, projection=projection, return_document=ReturnDocument.BEFORE
+        )
+        if before is not None:
+            if stats.settings.STATS_ROLLUP_ENABLED:
+                await stats.apply(doctor_id, stats.change(before, {**before, **fields}))
+            return (before.get("revision") or 0) + 1
+        if revision is not None or not missing:
+            await _raise_missing_or_conflict(scope)
+    raise HTTPException(status_code=409, detail=REVISION_CONFLICT)
+
+
+async def append_diagnosis(patient_id: str, doctor_id: str, entry: DiagnosisEntry, revision: Optional[int] = None) -> int:
+    """$push one diagnosis, moving the latest_* fields along only if it is the newest, and return the new revision.
+
+    The two cases are separate conditional updates on the stored
+    latest_diagnosis_date, so the history is never read or rewritten.
+    """
+    collection = Patient.get_motor_collection()
+    scope = {"_id": patient_id, "doctor_id": doctor_id}
+    if revision is not None:
+        scope.update(_revision_filter(revision))
+    encoded = Encoder().encode(entry)
+    diagnosed_on = encoded["diagnosis_on"]
+    push = {"$push": {"diagnoses_history": encoded}, "$inc": {"revision": 1}}
+    # an entry dated the same as the current latest does not replace it, as in latest_diagnosis()
+    newest = (
+        {"$or": [{"latest_diagnosis_date": None}, {"latest_diagnosis_date": {"$lt": diagnosed_on}}]},
+        {**push, "$set": {"latest_condition": entry.condition, "latest_diagnosis_date": diagnosed_on}},
+    )
+    older = ({"latest_diagnosis_date": {"$gte": diagnosed_on}}, push)
+
+    for _ in range(MAX_ATTEMPTS):
+        # a concurrent history replacement can move latest_diagnosis_date between the two, so loop
+        for condition, update in (newest, older):
+            result = await collection.find_one_and_update(
+                {**scope, **condition}, update, projection={"revision": 1}, return_document=ReturnDocument.AFTER
+            )
+            if result is not None:
+                await stats.apply(doctor_id, stats.diagnosis_added(entry.diagnosis_on))
+                return result["revision"]
+        if revision is not None or not await collection.count_documents(scope, limit=1):
+            await _raise_missing_or_conflict({"_id": patient_id, "doctor_id": doctor_id})
+    raise HTTPException(status_code=409, detail=REVISION_CONFLICT)
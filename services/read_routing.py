@@ -0,0 +1,66 @@
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+
+from config import ReadRoute
+
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+_read_route: ContextVar[Optional[str]] = ContextVar("read_route", default=None)
+
+
+def read_options(route: ReadRoute, client_read_preference: str = "primary") -> dict:
+    """with_options() arguments for a route; empty when it reads exactly like the client."""
+    options = {}
+    preference = route.read_preference or client_read_preference
+    if preference != client_read_preference or route.max_staleness_seconds is not None:
+        if preference == "primary":
+            options["read_preference"] = Primary()
+        else:
+            staleness = route.max_staleness_seconds if route.max_staleness_seconds is not None else -1
+            options["read_preference"] = READ_PREFERENCES[preference](max_staleness=staleness)
+    if route.read_concern:
+        options["read_concern"] = ReadConcern(route.read_concern)
+    return options
+
+
+class RoutedCollection:
+    """Motor collection proxy sending each operation to the current read route's with_options() view.
+
+    Writes ignore read preference and read concern, so every operation can
+    go through it; operations outside a routed request use the collection
+    as the client configured it.
+    """
+
+    def __init__(self, collection, routes: Dict[str, dict]):
+        self.collection = collection
+        self.views = {name: collection.with_options(**options) for name, options in routes.items() if options}
+
+    def __getattr__(self, name):
+        return getattr(self.views.get(_read_route.get(), self.collection), name)
+
+
+def install(document_model, routes: Dict[str, ReadRoute], client_read_preference: str = "primary"):
+    """Route the reads of an initialized Beanie document through RoutedCollection."""
+    document_settings = document_model.get_settings()
+    collection = document_settings.motor_collection
+    if isinstance(collection, RoutedCollection):
+        collection = collection.collection
+    options = {name: read_options(route, client_read_preference) for name, route in routes.items()}
+    document_settings.motor_collection = RoutedCollection(collection, options)
+
+
+def read_route(name: str):
+    """Dependency that makes the rest of the request read as the named route."""
+    async def use_read_route():
+        # async, so the variable is set in the request's own context rather than a worker thread's
+        _read_route.set(name)
+    return use_read_route
@@ -0,0 +1,50 @@
+from datetime import datetime
+
+from beanie.odm.utils.projection import get_projection
+
+from models.patient import Patient, compute_bmi, compute_verdict, normalize_condition, normalize_disease
+
+
+def raw_projection(model=None) -> dict:
+    """Mongo projection holding exactly the fields the model serializes."""
+    projection = get_projection(model or Patient) or {}
+    projection.pop("revision_id", None)
+    return projection
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def serialize_raw_patient(doc: dict, projection: dict, fill_derived: bool = True) -> dict:
+    """Shape a raw patient document like its model's JSON output, without Pydantic.
+
+    Stored derived fields are used as-is; with fill_derived, documents written
+    before they were stored get them computed here in one pass over
+    diagnoses_history.
+    """
+    for key in projection:
+        doc.setdefault(key, None)
+    if "revision" in projection and doc["revision"] is None:
+        doc["revision"] = 0
+
+    latest = None
+    for entry in doc.get("diagnoses_history") or ():
+        entry["diagnosis_on"] = _as_date(entry.get("diagnosis_on"))
+        entry.setdefault("notes", None)
+        if entry.get("disease_token") is None:
+            entry["disease_token"] = normalize_disease(entry["disease"])
+        if entry.get("condition_token") is None:
+            entry["condition_token"] = normalize_condition(entry["condition"])
+        if latest is None or entry["diagnosis_on"] > latest["diagnosis_on"]:
+            latest = entry
+
+    if fill_derived and doc["bmi"] is None and doc["height"] and doc["weight"]:
+        doc["bmi"] = compute_bmi(doc["height"], doc["weight"])
+        doc["verdict"] = compute_verdict(doc["bmi"])
+    if fill_derived and doc["latest_diagnosis_date"] is None and latest is not None:
+        doc["latest_condition"] = latest["condition"]
+        doc["latest_diagnosis_date"] = latest["diagnosis_on"]
+    if doc.get("latest_diagnosis_date") is not None:
+        doc["latest_diagnosis_date"] = _as_date(doc["latest_diagnosis_date"])
+    return doc
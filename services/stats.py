@@ -0,0 +1,198 @@
+import uuid
+from collections import Counter
+from datetime import date
+from typing import Optional
+from urllib.parse import unquote
+
+from config import get_settings
+from models.patient import Patient
+from models.patient_stats import PatientStats
+from services.guardrails import aggregate_options, find_options
+
+settings = get_settings()
+
+# upper bounds (exclusive) of the BMI buckets; the verdict thresholds plus the obesity classes
+BMI_BUCKETS = ((18.5, "<18.5"), (25, "18.5-25"), (30, "25-30"), (35, "30-35"), (40, "35-40"))
+BMI_TOP_BUCKET = ">=40"
+AGE_BUCKET_YEARS = 10
+UNKNOWN = "unknown"
+COUNTERS = ("bmi", "verdict", "age", "city", "diagnoses_per_month")
+
+# patient fields the counters are computed from
+STATS_FIELDS = ("bmi", "verdict", "age", "city", "diagnoses_history.diagnosis_on")
+
+# a rollup being rebuilt holds the build's id in `building`; a write during the build replaces it with DIRTY
+DIRTY = "dirty"
+MAX_ATTEMPTS = 5
+
+
+def stats_pipeline(doctor_id: str) -> list:
+    """All of a doctor's dashboard counters in one $facet aggregation."""
+    bmi_bucket = {"$switch": {
+        "branches": [{"case": {"$eq": [{"$ifNull": ["$bmi", None]}, None]}, "then": UNKNOWN}]
+        + [{"case": {"$lt": ["$bmi", bound]}, "then": label} for bound, label in BMI_BUCKETS],
+        "default": BMI_TOP_BUCKET,
+    }}
+
+    def count_by(key) -> list:
+        return [{"$group": {"_id": key, "count": {"$sum": 1}}}]
+
+    return [
+        {"$match": {"doctor_id": doctor_id}},
+        {"$facet": {
+            "total": [{"$count": "patients"}],
+            "bmi": count_by(bmi_bucket),
+            "verdict": count_by({"$ifNull": ["$verdict", UNKNOWN]}),
+            "age": count_by({"$subtract": ["$age", {"$mod": ["$age", AGE_BUCKET_YEARS]}]}),
+            "city": count_by("$city"),
+            "diagnoses_per_month": [
+                {"$unwind": "$diagnoses_history"},
+                *count_by({"$dateToString": {"format": "%Y-%m", "date": "$diagnoses_history.diagnosis_on"}}),
+            ],
+        }},
+    ]
+
+
+def counts_from_aggregation(result: list) -> dict:
+    facet = result[0] if result else {}
+    counts = {"total": facet["total"][0]["patients"] if facet.get("total") else 0}
+    for name in COUNTERS:
+        counts[name] = {str(int(row["_id"]) if name == "age" else row["_id"]): row["count"] for row in facet.get(name, [])}
+    return counts
+
+
+def format_stats(counts: dict) -> dict:
+    """API shape of the counters: buckets in their natural order, cities by size, empty buckets dropped."""
+    bmi_order = [label for _, label in BMI_BUCKETS] + [BMI_TOP_BUCKET, UNKNOWN]
+    ages = sorted((int(start), n) for start, n in counts["age"].items() if n > 0)
+
+    def nonzero(items):
+        return {key: n for key, n in items if n > 0}
+
+    return {
+        "total_patients": counts["total"],
+        "bmi": nonzero((label, counts["bmi"].get(label, 0)) for label in bmi_order),
+        "verdict": nonzero(sorted(counts["verdict"].items(), key=lambda item: (-item[1], item[0]))),
+        "age": {f"{start}-{start + AGE_BUCKET_YEARS - 1}": n for start, n in ages},
+        "city": nonzero(sorted(counts["city"].items(), key=lambda item: (-item[1], item[0]))),
+        "diagnoses_per_month": nonzero(sorted(counts["diagnoses_per_month"].items())),
+    }
+
+
+def bmi_bucket(bmi: Optional[float]) -> str:
+    if bmi is None:
+        return UNKNOWN
+    for bound, label in BMI_BUCKETS:
+        if bmi < bound:
+            return label
+    return BMI_TOP_BUCKET
+
+
+def _escape(key: str) -> str:
+    # percent-encode the characters MongoDB field names cannot hold, and % itself so it reverses exactly
+    return key.replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+
+
+def _unescape(key: str) -> str:
+    return unquote(key)
+
+
+def _month(value) -> str:
+    return f"{value.year:04d}-{value.month:02d}"
+
+
+def contribution(patient: dict) -> Counter:
+    """Rollup counters a stored patient adds; diagnoses only count if its diagnoses_history is given."""
+    delta = Counter({"total": 1})
+    delta["bmi." + _escape(bmi_bucket(patient.get("bmi")))] += 1
+    delta["verdict." + _escape(patient.get("verdict") or UNKNOWN)] += 1
+    age = patient["age"]
+    delta[f"age.{age - age % AGE_BUCKET_YEARS}"] += 1
+    delta["city." + _escape(patient["city"])] += 1
+    for entry in patient.get("diagnoses_history") or ():
+        delta["diagnoses_per_month." + _month(entry["diagnosis_on"])] += 1
+    return delta
+
+
+def change(before: Optional[dict], after: Optional[dict]) -> Counter:
+    """Counter deltas for a patient going from before to after; either may be None."""
+    delta = Counter()
+    if after is not None:
+        delta.update(contribution(after))
+    if before is not None:
+        delta.subtract(contribution(before))
+    return delta
+
+
+def diagnosis_added(diagnosis_on: date) -> Counter:
+    return Counter({"diagnoses_per_month." + _month(diagnosis_on): 1})
+
+
+async def apply(doctor_id: str, delta: Counter):
+    """$inc the doctor's rollup, if rollups are enabled and it has been built.
+
+    There is deliberately no upsert: a rollup that does not exist yet is
+    built from a full aggregation on its first read instead of from partial
+    increments. While a build is running the write marks it dirty instead,
+    since the build's aggregation may or may not have seen it; the build is
+    then not stored and the next read builds again.
+    """
+    if not settings.STATS_ROLLUP_ENABLED:
+        return
+    increments = {key: n for key, n in delta.items() if n}
+    if not increments:
+        return
+    collection = PatientStats.get_motor_collection()
+    for _ in range(MAX_ATTEMPTS):
+        # a build can start or finish between these, so loop until one of them applies
+        built = await collection.update_one({"_id": doctor_id, "building": {"$exists": False}}, {"$inc": increments})
+        if built.matched_count:
+            return
+        building = await collection.update_one({"_id": doctor_id, "building": {"$exists": True}}, {"$set": {"building": DIRTY}})
+        if building.matched_count or not await collection.count_documents({"_id": doctor_id}, limit=1):
+            return
+    # dropping the rollup is always safe: the next read rebuilds it
+    await collection.delete_one({"_id": doctor_id})
+
+
+def counts_from_rollup(doc: dict) -> dict:
+    counts = {"total": doc.get("total", 0)}
+    for name in COUNTERS:
+        counts[name] = {_unescape(key): n for key, n in (doc.get(name) or {}).items()}
+    return counts
+
+
+async def start_rollup_build(doctor_id: str) -> str:
+    """Mark the doctor's rollup as being rebuilt, before aggregating, and return the build's id."""
+    build = uuid.uuid4().hex
+    await PatientStats.get_motor_collection().update_one({"_id": doctor_id}, {"$set": {"building": build}}, upsert=True)
+    return build
+
+
+async def store_rollup(doctor_id: str, build: str, counts: dict) -> bool:
+    """Replace the rollup with the build's counters, unless a write or a newer build touched it since it started."""
+    doc = {"_id": doctor_id, "total": counts["total"]}
+    for name in COUNTERS:
+        doc[name] = {_escape(key): n for key, n in counts[name].items()}
+    result = await PatientStats.get_motor_collection().replace_one({"_id": doctor_id, "building": build}, doc)
+    return bool(result.matched_count)
+
+
+async def doctor_stats(doctor_id: str, fresh: bool = False) -> dict:
+    """The doctor's counters from their rollup when enabled, otherwise from a live aggregation.
+
+    A missing rollup, or one whose last build was interrupted by a write, is
+    built from the aggregation; fresh always aggregates and, with rollups
+    enabled, rebuilds the rollup to repair drift. The rollup is approximate:
+    a write whose $inc lands only after a build that already counted it has
+    finished is counted twice until the next fresh read.
+    """
+    if settings.STATS_ROLLUP_ENABLED and not fresh:
+        doc = await PatientStats.get_motor_collection().find_one({"_id": doctor_id}, **find_options())
+        if doc is not None and "building" not in doc:
+            return format_stats(counts_from_rollup(doc))
+    build = await start_rollup_build(doctor_id) if settings.STATS_ROLLUP_ENABLED else None
+    counts = counts_from_aggregation(await Patient.aggregate(stats_pipeline(doctor_id), **aggregate_options(spill=True)).to_list())
+    if build is not None:
+        await store_rollup(doctor_id, build, counts)
+    return format_stats(counts)
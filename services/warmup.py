@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import time
+
+import jwt
+from passlib.hash import bcrypt
+
+import database
+from config import get_settings
+from services.auth import ALGORITHM, SECRET_KEY, password_pool, verify_password
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+WARMUP_BCRYPT_ROUNDS = 4
+
+
+class Readiness:
+    """Whether this worker has warmed up and is not shutting down, with each warmup step's duration."""
+
+    def __init__(self):
+        self.ready = False
+        self.steps = {}
+
+    def stats(self) -> dict:
+        return {"status": "ready" if self.ready else "not_ready", "warmup_ms": dict(self.steps)}
+
+
+readiness = Readiness()
+
+
+async def warm_password_hashing():
+    # bcrypt's minimum cost loads passlib's backend and starts every worker of the hash pool in milliseconds
+    digest = bcrypt.using(rounds=WARMUP_BCRYPT_ROUNDS).hash("warmup")
+    await asyncio.gather(*(password_pool.run(verify_password, "warmup", digest) for _ in range(password_pool.workers)))
+
+
+async def warm_jwt():
+    jwt.decode(jwt.encode({"sub": "warmup"}, SECRET_KEY, algorithm=ALGORITHM), SECRET_KEY, algorithms=[ALGORITHM])
+
+
+async def warm_mongo_pool():
+    # concurrent pings each check out a connection, so the pool opens that many
+    connections = min(max(1, settings.MONGO_MIN_POOL_SIZE), settings.mongo_pool_size())
+    db = database.get_database()
+    await asyncio.gather(*(db.command("ping") for _ in range(connections)))
+
+
+async def _timed(name: str, step):
+    start = time.perf_counter()
+    await step()
+    readiness.steps[name] = round((time.perf_counter() - start) * 1000, 1)
+
+
+async def warm_up(enabled: bool = True):
+    """Initialize Beanie, then warm bcrypt, JWT signing and the Mongo pool concurrently, and mark the worker ready.
+
+    Without it the first requests after a deploy pay for all of this.
+    """
+    await _timed("beanie", database.init_db)
+    if enabled:
+        await asyncio.gather(
+            _timed("password_hashing", warm_password_hashing),
+            _timed("jwt", warm_jwt),
+            _timed("mongo_pool", warm_mongo_pool),
+        )
+    readiness.ready = True
+    logger.info("Worker ready after warmup: %s", readiness.steps)
@@ -1,16 +1,36 @@
 
+import csv
+import io
+import json
+from datetime import date, datetime
 import pytest
 import asyncio
+import httpx
 from fastapi.testclient import TestClient
 from mongomock_motor import AsyncMongoMockClient
 from unittest.mock import patch
+from pymongo.errors import DuplicateKeyError, ExecutionTimeout, ServerSelectionTimeoutError
+from passlib.context import CryptContext
 
 from beanie import init_beanie
 
 from app import app
-from services.auth import get_current_doctor
+from fastapi import HTTPException
+from services import auth as auth_service
+from services.auth import get_current_doctor, create_access_token, verify_token, sync_revoked_tokens
 from models.doctor import Doctor
 from models.patient import Patient
+from models.revoked_token import RevokedToken
+from models.patient_stats import PatientStats
+from services.importer import iter_lines
+from routers import patients as patients_router
+from services import stats as stats_service
+from services import exporter as exporter_service
+from services import guardrails
+from services.exporter import export_patients
+from services.grouping import group_pipeline, group_member_filter, legacy_group_pipeline, legacy_group_members_pipeline
+import database
+from config import get_settings
 
 # Fixture to set up a mock database and test client for each test
 @pytest.fixture
@@ -22,14 +42,21 @@ def client():
     async def init_test_db():
         await init_beanie(
             database=mock_client.get_database(name="test_db"),
-            document_models=[Doctor, Patient],
+            document_models=[Doctor, Patient, RevokedToken, PatientStats],
         )
+        await patients_router.group_cache.clear()
+        await patients_router.response_cache.clear()
 
     # Run the async initialization
     asyncio.run(init_test_db())
 
+    # Start every test with an empty token cache and revocation list
+    auth_service.token_cache.clear()
+    auth_service.revoked_jtis.clear()
+
     # Mock the authentication dependency to always return a test doctor
     app.dependency_overrides[get_current_doctor] = lambda: "test_doctor"
+    app.dependency_overrides[database.get_database] = lambda: mock_client.get_database(name="test_db")
     
     # Provide the TestClient to the tests
     yield TestClient(app)
@@ -167,3 +194,952 @@ async def test_delete_patient_success(client):
     # Verify it's gone from the mock database
     deleted_patient = await Patient.get("P001")
     assert deleted_patient is None
+
+
+@pytest.mark.asyncio
+async def test_view_patients_paginated(client):
+    for i in range(1, 6):
+        await Patient(id=f"P00{i}", name=f"Patient {i}", city="A", age=30, gender="female", doctor_id="test_doctor").create()
+    await Patient(id="P000", name="Other", city="B", age=40, gender="male", doctor_id="another_doctor").create()
+
+    response = client.get("/patients/view", params={"limit": 2})
+    assert response.status_code == 200
+    assert [p["_id"] for p in response.json()] == ["P001", "P002"]
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get("/patients/view", params={"limit": 2, "after": cursor})
+    assert [p["_id"] for p in response.json()] == ["P003", "P004"]
+
+    response = client.get("/patients/view", params={"limit": 2, "after": response.headers["X-Next-Cursor"]})
+    assert [p["_id"] for p in response.json()] == ["P005"]
+    assert "X-Next-Cursor" not in response.headers
+
+
+@pytest.mark.asyncio
+async def test_view_patients_invalid_cursor(client):
+    response = client.get("/patients/view", params={"limit": 2, "after": "not-a-cursor"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}
+
+
+@pytest.mark.asyncio
+async def test_view_patients_ndjson_stream(client):
+    for i in range(1, 4):
+        await Patient(id=f"P00{i}", name=f"Patient {i}", city="A", age=30, gender="female", doctor_id="test_doctor").create()
+
+    response = client.get("/patients/view", params={"limit": 2}, headers={"Accept": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [p["_id"] for p in lines[:2]] == ["P001", "P002"]
+    assert "next_cursor" in lines[2]
+
+    response = client.get("/patients/view", params={"after": lines[2]["next_cursor"]}, headers={"Accept": "application/x-ndjson"})
+    assert [json.loads(line)["_id"] for line in response.text.splitlines()] == ["P003"]
+
+
+@pytest.mark.asyncio
+async def test_sort_patients_paginated_desc(client):
+    ages = {"P001": 30, "P002": 50, "P003": 50, "P004": 20}
+    for patient_id, age in ages.items():
+        await Patient(id=patient_id, name=patient_id, city="A", age=age, gender="male", doctor_id="test_doctor").create()
+
+    seen = []
+    params = {"sort_by": "age", "order": "desc", "limit": 3}
+    while True:
+        response = client.get("/patients/sort", params=params)
+        assert response.status_code == 200
+        seen += [p["_id"] for p in response.json()]
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["after"] = response.headers["X-Next-Cursor"]
+
+    assert seen == ["P003", "P002", "P001", "P004"]
+
+
+@pytest.mark.asyncio
+async def test_derived_fields_are_stored_on_write(client):
+    patient_data = {
+        "id": "P001", "name": "Alice", "city": "A", "age": 30, "gender": "female", "height": 1.6, "weight": 60,
+        "diagnoses_history": [
+            {"disease": "Flu", "condition": "Mild", "diagnosis_on": "2024-01-10"},
+            {"disease": "Asthma", "condition": "Chronic", "diagnosis_on": "2024-03-05"},
+        ],
+    }
+    assert client.post("/patients/create", json=patient_data).status_code == 201
+
+    raw = await Patient.get_motor_collection().find_one({"_id": "P001"})
+    assert raw["bmi"] == 23.44
+    assert raw["verdict"] == "Normal"
+    assert raw["latest_condition"] == "Chronic"
+    assert raw["latest_diagnosis_date"].date().isoformat() == "2024-03-05"
+
+    assert client.put("/patients/edit/P001", json={"weight": 90}).status_code == 200
+    raw = await Patient.get_motor_collection().find_one({"_id": "P001"})
+    assert raw["bmi"] == 35.16
+    assert raw["verdict"] == "Obese"
+
+
+@pytest.mark.asyncio
+async def test_sort_by_latest_diagnosis_date(client):
+    dates = {"P001": "2024-05-01", "P002": "2023-01-01", "P003": "2024-12-31"}
+    for patient_id, diagnosed_on in dates.items():
+        await Patient(
+            id=patient_id, name=patient_id, city="A", age=30, gender="male", doctor_id="test_doctor",
+            diagnoses_history=[{"disease": "Flu", "condition": "Mild", "diagnosis_on": diagnosed_on}],
+        ).create()
+
+    response = client.get("/patients/sort", params={"sort_by": "latest_diagnosis_date", "order": "desc"})
+    assert response.status_code == 200
+    assert [p["_id"] for p in response.json()] == ["P003", "P001", "P002"]
+
+
+def test_verify_token_uses_cache(client):
+    token = create_access_token(data={"sub": "test_doctor"})
+
+    assert verify_token(token)["sub"] == "test_doctor"
+    assert verify_token(token)["sub"] == "test_doctor"
+    assert auth_service.token_cache.misses == 1
+    assert auth_service.token_cache.hits == 1
+
+    with pytest.raises(HTTPException) as exc_info:
+        verify_token(token + "tampered")
+    assert exc_info.value.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_logout_revokes_token(client):
+    token = create_access_token(data={"sub": "test_doctor"})
+
+    response = client.post("/auth/logout", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert response.json() == {"message": "Logged out successfully"}
+
+    with pytest.raises(HTTPException) as exc_info:
+        verify_token(token)
+    assert exc_info.value.detail == "Token has been revoked"
+
+    # another worker learns about the revocation from the shared collection
+    auth_service.revoked_jtis.clear()
+    auth_service.token_cache.clear()
+    assert verify_token(token)["sub"] == "test_doctor"
+    await sync_revoked_tokens()
+    with pytest.raises(HTTPException):
+        verify_token(token)
+
+
+@pytest.mark.asyncio
+async def test_login_rehashes_outdated_password(client):
+    old_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("testpassword")
+    await Doctor(username="testuser", password=old_hash).create()
+
+    with patch("services.auth.pwd_context", CryptContext(schemes=["bcrypt"], bcrypt__rounds=5)):
+        response = client.post("/auth/login", json={"username": "testuser", "password": "testpassword"})
+        assert response.status_code == 200
+        assert response.json()["token_type"] == "bearer"
+
+        response = client.post("/auth/login", json={"username": "testuser", "password": "wrongpassword"})
+        assert response.status_code == 401
+
+    doctor = await Doctor.find_one(Doctor.username == "testuser")
+    assert doctor.password.startswith("$2b$05$")
+
+
+@pytest.mark.asyncio
+async def test_password_pool_rejects_when_queue_is_full():
+    pool = auth_service.PasswordHashPool("thread", workers=1, max_queue=0)
+    pool.pending = 1
+    with pytest.raises(HTTPException) as exc_info:
+        await pool.run(auth_service.get_password_hash, "testpassword")
+    assert exc_info.value.status_code == 503
+    assert pool.stats() == {"kind": "thread", "workers": 1, "pending": 1, "queue_depth": 0, "rejected": 1}
+
+    pool.pending = 0
+    assert (await pool.run(str.upper, "ok")) == "OK"
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_import_patients_ndjson(client):
+    await Patient(id="P002", name="Existing", city="A", age=30, gender="male", doctor_id="test_doctor").create()
+    rows = [
+        {"id": "P001", "name": "Alice", "city": "A", "age": 30, "gender": "female", "height": 1.6, "weight": 60},
+        {"id": "P002", "name": "Bob", "city": "B", "age": 40, "gender": "male"},
+        {"id": "P003", "name": "Charlie", "city": "C", "age": 500, "gender": "male"},
+        {"id": "P004", "name": "Dana", "city": "D", "age": 25, "gender": "female",
+         "diagnoses_history": [{"disease": "Flu", "condition": "Mild", "diagnosis_on": "2024-01-01"}]},
+    ]
+    body = "\n".join(json.dumps(row) for row in rows) + "\n{not json\n"
+
+    response = client.post("/patients/import", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    report = [json.loads(line) for line in response.text.splitlines()]
+    by_row = {entry["row"]: entry for entry in report if "row" in entry}
+
+    assert by_row[1]["status"] == "created"
+    assert by_row[2] == {"row": 2, "id": "P002", "status": "error", "error": "Patient already exists"}
+    assert by_row[3]["status"] == "error" and by_row[3]["error"].startswith("age:")
+    assert by_row[4]["status"] == "created"
+    assert by_row[5]["error"].startswith("Invalid JSON")
+    assert report[-1] == {"summary": {"created": 2, "failed": 3}}
+
+    dana = await Patient.get("P004")
+    assert dana.doctor_id == "test_doctor"
+    assert dana.latest_condition == "Mild"
+    assert (await Patient.get("P002")).name == "Existing"
+
+
+@pytest.mark.asyncio
+async def test_import_patients_csv(client):
+    body = (
+        "id,name,city,age,gender,height,weight,diagnoses_history\n"
+        'P001,Alice,"Kathmandu, Nepal",30,female,1.6,60,"[{""disease"": ""Flu"", ""condition"": ""Mild""}]"\n'
+        "P002,Bob,Pokhara,40,male,,,\n"
+        "P003,Charlie,Lalitpur,forty,male,,,\n"
+    )
+    with patch("routers.patients.settings.IMPORT_BATCH_SIZE", 1):
+        response = client.post("/patients/import", content=body, headers={"Content-Type": "text/csv"})
+    assert response.status_code == 200
+    report = [json.loads(line) for line in response.text.splitlines()]
+
+    assert [entry.get("status") for entry in report[:-1]] == ["created", "created", "error"]
+    assert report[-1] == {"summary": {"created": 2, "failed": 1}}
+    assert (await Patient.get("P001")).city == "Kathmandu, Nepal"
+    assert (await Patient.get("P002")).height is None
+
+
+def test_import_patients_rejects_unknown_format(client):
+    response = client.post("/patients/import", content="{}", headers={"Content-Type": "application/json"})
+    assert response.status_code == 415
+
+
+@pytest.mark.asyncio
+async def test_import_patients_reports_oversized_rows(client):
+    row = {"id": "P001", "name": "Alice", "city": "A", "age": 30, "gender": "female"}
+    body = "x" * 200 + "\n" + json.dumps(row) + "\n"
+    csv_body = 'id,name,city,age,gender\nP002,"Bob,B,40,male\n' + "P003,Charlie,C,50,male\n" * 20
+
+    with patch("routers.patients.settings.IMPORT_MAX_ROW_CHARS", 150):
+        response = client.post("/patients/import", content=body, headers={"Content-Type": "application/x-ndjson"})
+        report = [json.loads(line) for line in response.text.splitlines()]
+        assert report[0] == {"row": 1, "status": "error", "error": "Row exceeds 150 characters"}
+        assert report[1]["status"] == "created"
+
+        # a stray quote swallows following lines only until the row cap is hit
+        response = client.post("/patients/import", content=csv_body, headers={"Content-Type": "text/csv"})
+        report = [json.loads(line) for line in response.text.splitlines()]
+        assert report[0]["error"] == "Row exceeds 150 characters"
+        assert report[-1]["summary"]["created"] >= 1
+
+
+@pytest.mark.asyncio
+async def test_export_patients_csv_round_trips_through_import(client):
+    await Patient(id="P001", name="Alice", city="Kathmandu, Nepal", age=30, gender="female", height=1.6, weight=60,
+                  doctor_id="test_doctor",
+                  diagnoses_history=[{"disease": "Flu", "condition": "Mild", "diagnosis_on": "2024-01-01"}]).create()
+    await Patient(id="P002", name="Bob", city="B", age=40, gender="male", doctor_id="test_doctor").create()
+    await Patient(id="P003", name="Other", city="C", age=50, gender="male", doctor_id="other_doctor").create()
+
+    response = client.get("/patients/export?format=csv")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.headers["content-disposition"] == 'attachment; filename="patients.csv"'
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["id"] for row in rows] == ["P001", "P002"]
+    assert rows[0]["city"] == "Kathmandu, Nepal"
+    assert rows[0]["latest_diagnosis_date"] == "2024-01-01"
+    assert json.loads(rows[0]["diagnoses_history"])[0]["disease"] == "Flu"
+    assert rows[1]["bmi"] == ""
+
+    await Patient.get_motor_collection().delete_many({})
+    imported = client.post("/patients/import", content=response.text, headers={"Content-Type": "text/csv"})
+    assert json.loads(imported.text.splitlines()[-1]) == {"summary": {"created": 2, "failed": 0}}
+    assert (await Patient.get("P001")).latest_condition == "Mild"
+
+
+@pytest.mark.asyncio
+async def test_export_patients_one_row_per_diagnosis(client):
+    history = [{"disease": "Flu", "condition": "Mild", "diagnosis_on": "2024-01-01"},
+               {"disease": "Cold", "condition": "Severe", "diagnosis_on": "2024-02-01", "notes": "rest"}]
+    await Patient(id="P001", name="Alice", city="A", age=30, gender="female", doctor_id="test_doctor",
+                  diagnoses_history=history).create()
+    await Patient(id="P002", name="Bob", city="B", age=40, gender="male", doctor_id="test_doctor").create()
+
+    response = client.get("/patients/export?format=ndjson&flatten=diagnosis")
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [(row["id"], row["disease"], row["diagnosis_on"]) for row in rows] == [
+        ("P001", "Flu", "2024-01-01"), ("P001", "Cold", "2024-02-01"), ("P002", None, None)]
+    assert rows[1]["notes"] == "rest" and rows[1]["name"] == "Alice"
+    assert "diagnoses_history" not in rows[0]
+
+
+@pytest.mark.asyncio
+async def test_export_patients_writes_one_chunk_per_batch(client):
+    for i in range(5):
+        await Patient(id=f"P{i:03d}", name="N", city="A", age=30, gender="male", doctor_id="test_doctor").create()
+    chunks = [chunk async for chunk in export_patients("test_doctor", "csv", "patient", batch_size=2)]
+    assert len(chunks) == 3
+    assert chunks[0].startswith(b"id,name,") and chunks[0].count(b"\n") == 3
+    assert chunks[2].count(b"\n") == 1
+
+    empty = [chunk async for chunk in export_patients("nobody", "csv", "patient", batch_size=2)]
+    assert empty == [b",".join(column.encode() for column in exporter_service.columns("patient")) + b"\r\n"]
+
+
+def test_export_patients_parquet(client):
+    if not exporter_service.parquet_available():
+        response = client.get("/patients/export?format=parquet")
+        assert response.status_code == 501
+        return
+    import pyarrow.parquet as pq
+    client.post("/patients/create", json={"id": "P001", "name": "Alice", "city": "A", "age": 30, "gender": "female"})
+    response = client.get("/patients/export?format=parquet&flatten=diagnosis")
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+    table = pq.read_table(io.BytesIO(response.content))
+    assert table.column("id").to_pylist() == ["P001"]
+
+
+@pytest.mark.asyncio
+async def test_iter_lines_drops_oversized_lines_across_chunks():
+    async def chunks():
+        for part in ["ab", "cdefgh", "ij\nok\nxyz", "123456789", "0\nend"]:
+            yield part.encode()
+
+    assert [line async for line in iter_lines(chunks(), 5)] == [None, "ok", None, "end"]
+
+
+@pytest.mark.asyncio
+async def test_revoke_token_is_idempotent_and_persists_first(client):
+    token = create_access_token(data={"sub": "test_doctor"})
+    claims = verify_token(token)
+
+    # a concurrent logout elsewhere already stored the jti
+    await auth_service.revoke_token(token)
+    auth_service.revoked_jtis.clear()
+    await auth_service.revoke_token(token)
+    assert claims["jti"] in auth_service.revoked_jtis
+    assert await RevokedToken.find(RevokedToken.jti == claims["jti"]).count() == 1
+
+    other = create_access_token(data={"sub": "test_doctor"})
+    other_jti = verify_token(other)["jti"]
+    with patch.object(RevokedToken, "create", side_effect=RuntimeError("db down")):
+        with pytest.raises(RuntimeError):
+            await auth_service.revoke_token(other)
+    assert other_jti not in auth_service.revoked_jtis
+
+
+
+@pytest.mark.asyncio
+async def test_group_patients_counts_and_members(client):
+    await Patient(id="P001", name="Alice", city="A", age=30, gender="female", height=1.6, weight=60, doctor_id="test_doctor",
+                  diagnoses_history=[{"disease": "Flu", "condition": "Mild"}, {"disease": "flu", "condition": "Severe"}]).create()
+    await Patient(id="P002", name="Bob", city="B", age=40, gender="male", doctor_id="test_doctor",
+                  diagnoses_history=[{"disease": "Flu", "condition": "Mild"}, {"disease": "Asthma", "condition": "Chronic"}]).create()
+    await Patient(id="P003", name="Charlie", city="C", age=50, gender="male", doctor_id="another_doctor",
+                  diagnoses_history=[{"disease": "Flu", "condition": "Mild"}]).create()
+
+    response = client.get("/patients/group", params={"by": "disease"})
+    assert response.status_code == 200
+    assert response.json() == {
+        "by": "disease",
+        "total_patients": 2,
+        "groups": [{"value": "flu", "count": 2}, {"value": "asthma", "count": 1}],
+        "truncated": False,
+    }
+
+    response = client.get("/patients/group", params={"by": "gender", "members": 1})
+    groups = {group["value"]: group for group in response.json()["groups"]}
+    assert groups["female"]["members"] == [{
+        "id": "P001", "name": "Alice", "city": "A", "age": 30, "gender": "female", "verdict": "Normal",
+        "latest_condition": groups["female"]["members"][0]["latest_condition"],
+        "latest_diagnosis_date": groups["female"]["members"][0]["latest_diagnosis_date"],
+    }]
+
+    response = client.get("/patients/group/members", params={"by": "disease", "value": "FLU", "limit": 1})
+    assert [p["_id"] for p in response.json()] == ["P001"]
+    assert "diagnoses_history" not in response.json()[0]
+    response = client.get("/patients/group/members", params={"by": "disease", "value": "FLU", "after": response.headers["X-Next-Cursor"]})
+    assert [p["_id"] for p in response.json()] == ["P002"]
+
+    response = client.get("/patients/group", params={"by": "condition"})
+    assert response.json()["groups"] == [{"value": "mild", "count": 2}, {"value": "chronic", "count": 1}, {"value": "severe", "count": 1}]
+    response = client.get("/patients/group/members", params={"by": "condition", "value": " MILD "})
+    assert [p["_id"] for p in response.json()] == ["P001", "P002"]
+
+    # Bob has no BMI, so no verdict; his group is labelled and can be paged like any other
+    response = client.get("/patients/group", params={"by": "verdict"})
+    assert {group["value"]: group["count"] for group in response.json()["groups"]} == {"Normal": 1, "unknown": 1}
+    response = client.get("/patients/group/members", params={"by": "verdict", "value": "unknown"})
+    assert [p["_id"] for p in response.json()] == ["P002"]
+
+
+def test_group_pipeline_bounds_members_with_top_n():
+    pipeline = group_pipeline("doc", "city", members=3, top_n=True)
+    [group] = [stage["$group"] for stage in pipeline[-1]["$facet"]["groups"] if "$group" in stage]
+    assert group["members"] == {"$topN": {"n": 3, "sortBy": {"member.id": 1}, "output": "$member"}}
+    assert not any("$push" in str(stage) for stage in pipeline)
+
+    assert group_member_filter("condition", "Chronic ") == {"diagnoses_history.condition_token": "chronic"}
+
+
+def test_legacy_group_pipeline_never_pushes_whole_groups():
+    [group] = [stage["$group"] for stage in legacy_group_pipeline("doc", "disease", 10, 5, top_n=True) if "$group" in stage]
+    assert group["patients"]["$topN"]["n"] == 5
+    # without $topN the groups carry counts only and members come from one bounded query per group
+    [group] = [stage["$group"] for stage in legacy_group_pipeline("doc", "disease", 10, 5) if "$group" in stage]
+    assert "patients" not in group
+    assert {"$limit": 5} in legacy_group_members_pipeline("doc", "disease", "flu", 5)
+
+
+@pytest.mark.asyncio
+async def test_group_patients_cache_invalidated_on_write(client):
+    await Patient(id="P001", name="Alice", city="A", age=30, gender="female", doctor_id="test_doctor").create()
+
+    assert client.get("/patients/group", params={"by": "city"}).json()["total_patients"] == 1
+    # written behind the API's back, so the cached result is still served
+    await Patient(id="P002", name="Bob", city="B", age=40, gender="male", doctor_id="test_doctor").create()
+    assert client.get("/patients/group", params={"by": "city"}).json()["total_patients"] == 1
+
+    client.post("/patients/create", json={"id": "P003", "name": "Dana", "city": "A", "age": 20, "gender": "female"})
+    grouped = client.get("/patients/group", params={"by": "city"}).json()
+    assert grouped["total_patients"] == 3
+    assert grouped["groups"] == [{"value": "A", "count": 2}, {"value": "B", "count": 1}]
+
+
+@pytest.mark.asyncio
+async def test_group_by_disease_pushes_projected_members(client):
+    await Patient(id="P001", name="Alice", city="A", age=30, gender="female", height=1.6, weight=60, doctor_id="test_doctor",
+                  diagnoses_history=[{"disease": "Flu", "condition": "Mild", "notes": "rest"}]).create()
+
+    response = client.get("/patients/group_by_disease")
+    assert response.status_code == 200
+    [group] = response.json()
+    assert group["_id"] == "flu"
+    [member] = group["patients"]
+    assert member["id"] == "P001"
+    assert member["diagnosis_details"]["notes"] == "rest"
+    assert "diagnoses_history" not in member
+
+
+@pytest.mark.asyncio
+async def test_group_results_are_capped_with_truncation_metadata(client):
+    for i, disease in enumerate(["Flu", "Flu", "Asthma"]):
+        await Patient(id=f"P00{i}", name="N", city=f"C{i}", age=30, gender="male", doctor_id="test_doctor",
+                      diagnoses_history=[{"disease": disease, "condition": "Mild"}]).create()
+
+    with patch.multiple(patients_router.settings, MAX_GROUPS=1, LEGACY_GROUP_MAX_PATIENTS=1):
+        response = client.get("/patients/group", params={"by": "city"})
+        assert response.json()["truncated"] is True
+        assert len(response.json()["groups"]) == 1
+        assert response.headers["X-Result-Truncated"] == "true"
+
+        response = client.get("/patients/group_by_disease")
+        [group] = response.json()
+        assert (group["_id"], group["patient_count"], len(group["patients"]), group["truncated"]) == ("asthma", 1, 1, False)
+        assert response.headers["X-Result-Truncated"] == "true"
+
+    with patch.object(patients_router.settings, "LEGACY_GROUP_MAX_PATIENTS", 1):
+        groups = {group["_id"]: group for group in client.get("/patients/group_by_disease").json()}
+    assert (groups["flu"]["patient_count"], len(groups["flu"]["patients"]), groups["flu"]["truncated"]) == (2, 1, True)
+
+    # without $topN the per-group queries stop at the lower fallback cap
+    with patch("routers.patients.supports_n_accumulators", return_value=False), \
+            patch.object(patients_router.settings, "LEGACY_GROUP_FALLBACK_MAX_GROUPS", 1):
+        response = client.get("/patients/group_by_disease")
+    assert [group["_id"] for group in response.json()] == ["asthma"]
+    assert response.headers["X-Result-Truncated"] == "true"
+
+
+@pytest.mark.asyncio
+async def test_unlimited_list_reads_are_capped(client):
+    for i in range(3):
+        await Patient(id=f"P00{i}", name="N", city="A", age=30, gender="male", doctor_id="test_doctor").create()
+
+    with patch.object(patients_router.settings, "MAX_RESULT_DOCUMENTS", 2):
+        response = client.get("/patients/view")
+        assert [p["_id"] for p in response.json()] == ["P000", "P001"]
+        assert response.headers["X-Result-Truncated"] == "true"
+        rest = client.get("/patients/view", params={"after": response.headers["X-Next-Cursor"]})
+        assert [p["_id"] for p in rest.json()] == ["P002"]
+        assert "X-Result-Truncated" not in rest.headers
+
+        lines = client.get("/patients/view?fast=true", headers={"Accept": "application/x-ndjson"}).text.splitlines()
+        assert json.loads(lines[-1])["truncated"] is True
+
+        # an explicit limit is a page, not a truncation
+        response = client.get("/patients/view", params={"limit": 1})
+        assert "X-Result-Truncated" not in response.headers
+
+
+def test_query_time_limits(client):
+    with patch.multiple(guardrails.settings, MONGO_MAX_TIME_MS=500, MONGO_ALLOW_DISK_USE=True):
+        assert guardrails.find_options() == {"max_time_ms": 500}
+        assert guardrails.aggregate_options() == {"maxTimeMS": 500}
+        assert guardrails.aggregate_options(spill=True) == {"maxTimeMS": 500, "allowDiskUse": True}
+    with patch.multiple(guardrails.settings, MONGO_MAX_TIME_MS=None, MONGO_ALLOW_DISK_USE=False):
+        assert guardrails.aggregate_options(spill=True) == {}
+
+    with patch("services.stats.doctor_stats", side_effect=ExecutionTimeout("operation exceeded time limit")):
+        response = client.get("/patients/stats")
+    assert response.status_code == 503
+
+
+@pytest.mark.asyncio
+async def test_expensive_requests_are_limited_per_doctor():
+    limiter = guardrails.DoctorConcurrencyLimiter(max_concurrent=1, max_queue=1)
+    release = asyncio.Event()
+
+    async def hold(doctor_id):
+        async with limiter.slot(doctor_id):
+            await release.wait()
+
+    running = asyncio.create_task(hold("doc_a"))
+    queued = asyncio.create_task(hold("doc_a"))
+    other = asyncio.create_task(hold("doc_b"))
+    await asyncio.sleep(0)
+    assert limiter.stats() == {"doctors": 2, "in_flight": 3, "rejected": 0}
+
+    with pytest.raises(HTTPException) as rejected:
+        async with limiter.slot("doc_a"):
+            pass
+    assert rejected.value.status_code == 429
+
+    release.set()
+    await asyncio.gather(running, queued, other)
+    assert limiter.stats() == {"doctors": 0, "in_flight": 0, "rejected": 1}
+
+
+@pytest.mark.asyncio
+async def test_export_holds_its_expensive_slot_while_streaming(client):
+    limiter = guardrails.DoctorConcurrencyLimiter(max_concurrent=1, max_queue=0)
+    transport = httpx.ASGITransport(app=app)
+    concurrent = []
+
+    async def slow_export(*args, **kwargs):
+        yield b"first\n"
+        # a second export by the same doctor while this one is still streaming
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as other:
+            concurrent.append(await other.get("/patients/export"))
+        yield b"second\n"
+
+    with patch.object(patients_router, "expensive_limiter", limiter), \
+            patch.object(patients_router, "export_patients", slow_export):
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            response = await http.get("/patients/export")
+
+    assert response.status_code == 200
+    assert response.content == b"first\nsecond\n"
+    assert [other.status_code for other in concurrent] == [429]
+    assert limiter.stats() == {"doctors": 0, "in_flight": 0, "rejected": 1}
+
+
+@pytest.mark.asyncio
+async def test_filter_disease_match_modes(client):
+    await Patient(id="P001", name="Alice", city="A", age=30, gender="female", doctor_id="test_doctor",
+                  diagnoses_history=[{"disease": "Type 2  Diabetes", "condition": "Chronic"}]).create()
+    await Patient(id="P002", name="Bob", city="B", age=40, gender="male", doctor_id="test_doctor",
+                  diagnoses_history=[{"disease": "Diabetes", "condition": "Stable"}]).create()
+
+    raw = await Patient.get_motor_collection().find_one({"_id": "P001"})
+    assert raw["diagnoses_history"][0]["disease_token"] == "type 2 diabetes"
+
+    def ids(**params):
+        response = client.get("/patients/filter", params=params)
+        assert response.status_code == 200
+        return [p["_id"] for p in response.json()]
+
+    # the default is still a case-insensitive substring match, as before disease tokens
+    assert ids(disease_name="DIAB") == ["P001", "P002"]
+    assert ids(disease_name="diabetes") == ["P001", "P002"]
+    assert ids(disease_name="DIAB", disease_match="prefix") == ["P002"]
+    assert ids(disease_name="type 2", disease_match="prefix") == ["P001"]
+    assert ids(disease_name="diabetes", disease_match="exact") == ["P002"]
+    assert ids(disease_name="Diabetes", disease_match="contains") == ["P001", "P002"]
+
+    response = client.get("/patients/filter", params={"disease_name": "diabetis", "disease_match": "fuzzy"})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_filter_matches_all_predicates_on_one_diagnosis(client):
+    recent = date.today().isoformat()
+    # disease, condition and a recent date all exist, but on different diagnoses
+    await Patient(id="P001", name="Alice", city="A", age=30, gender="female", doctor_id="test_doctor", diagnoses_history=[
+        {"disease": "Diabetes", "condition": "Stable", "diagnosis_on": "2001-01-01"},
+        {"disease": "Asthma", "condition": "Chronic", "diagnosis_on": recent},
+    ]).create()
+    await Patient(id="P002", name="Bob", city="B", age=40, gender="male", doctor_id="test_doctor", diagnoses_history=[
+        {"disease": "Diabetes", "condition": "Chronic", "diagnosis_on": recent},
+    ]).create()
+
+    response = client.get("/patients/filter", params={"disease_name": "diabetes", "condition": "Chronic", "diagnosed_after_months": 2})
+    assert response.status_code == 200
+    assert [p["_id"] for p in response.json()] == ["P002"]
+
+    response = client.get("/patients/filter", params={"disease_name": "diabetes", "condition": "Stable", "diagnosed_after_months": 2})
+    assert response.json() == []
+
+    for months in ("two", -1, 24400):
+        response = client.get("/patients/filter", params={"diagnosed_after_months": months})
+        assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_fast_path_matches_model_serialization(client):
+    await Patient(id="P001", name="Alice", city="A", age=30, gender="female", height=1.6, weight=60, doctor_id="test_doctor",
+                  diagnoses_history=[{"disease": "Flu", "condition": "Mild", "diagnosis_on": "2024-01-10"},
+                                     {"disease": "Asthma", "condition": "Chronic", "diagnosis_on": "2024-03-05", "notes": "inhaler"}]).create()
+    # written before derived fields and disease tokens were stored
+    await Patient.get_motor_collection().insert_one({
+        "_id": "P002", "name": "Bob", "city": "B", "age": 40, "gender": "male", "height": 1.8, "weight": 100.0,
+        "doctor_id": "test_doctor",
+        "diagnoses_history": [{"disease": "Type 2 Diabetes", "condition": "Stable", "diagnosis_on": datetime(2023, 5, 1)}],
+    })
+
+    for path, params in [
+        ("/patients/view", {}),
+        ("/patients/sort", {"sort_by": "age", "order": "desc"}),
+        ("/patients/filter", {"condition": "Stable"}),
+        ("/patients/group/members", {"by": "city", "value": "A"}),
+    ]:
+        slow = client.get(path, params=params)
+        fast = client.get(path, params={**params, "fast": True})
+        assert fast.status_code == 200
+        assert fast.json() == slow.json()
+
+    fast = client.get("/patients/view", params={"fast": True, "limit": 1})
+    assert [p["_id"] for p in fast.json()] == ["P001"]
+    streamed = client.get("/patients/view", params={"fast": True, "after": fast.headers["X-Next-Cursor"]},
+                          headers={"Accept": "application/x-ndjson"})
+    [bob] = [json.loads(line) for line in streamed.text.splitlines()]
+    assert bob["verdict"] == "Obese"
+    assert bob["latest_diagnosis_date"] == "2023-05-01"
+    assert bob["diagnoses_history"][0]["disease_token"] == "type 2 diabetes"
+
+
+def test_health_db_reports_pool(client):
+    response = client.get("/health/db")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "ok"
+    assert set(body["pool"]) == {"open", "in_use", "waiting", "checkout_failures", "max_pool_size", "saturation"}
+
+
+def test_health_db_hides_driver_errors(client):
+    class UnreachableDatabase:
+        async def command(self, name):
+            raise ServerSelectionTimeoutError("mongo-0.internal:27017: [Errno 111] Connection refused, Topology Description: ...")
+
+    app.dependency_overrides[database.get_database] = UnreachableDatabase
+    response = client.get("/health/db")
+    assert response.status_code == 503
+    assert response.json()["error"] == "database unavailable"
+    assert "mongo-0" not in response.text
+
+
+def test_ready_only_between_warmup_and_shutdown(client):
+    assert client.get("/health/ready").status_code == 503
+
+    with patch.object(database, "_client", AsyncMongoMockClient()), patch("app.close_db"), \
+            patch("services.warmup.verify_password", lambda password, digest: True):
+        with TestClient(app) as started:
+            response = started.get("/health/ready")
+            assert response.status_code == 200
+            assert set(response.json()["warmup_ms"]) == {"beanie", "password_hashing", "jwt", "mongo_pool"}
+        assert started.get("/health/ready").status_code == 503
+
+
+def test_settings_are_shared():
+    assert get_settings() is get_settings()
+    assert database.settings is patients_router.settings is stats_service.settings is auth_service.settings
+
+
+def test_shared_client_uses_pool_settings():
+    with patch.multiple(database.settings, MONGO_TOTAL_MAX_CONNECTIONS=100, WEB_CONCURRENCY=8, MONGO_MIN_POOL_SIZE=2,
+                        MONGO_READ_PREFERENCE="secondaryPreferred"):
+        database.close_db()
+        client = database.get_client()
+        try:
+            assert database.get_client() is client
+            assert client.options.pool_options.max_pool_size == 12
+            assert client.options.pool_options.min_pool_size == 2
+            assert client.read_preference.mongos_mode == "secondaryPreferred"
+        finally:
+            database.close_db()
+
+
+def test_pool_monitor_tracks_saturation():
+    monitor = database.PoolMonitor()
+    for _ in range(3):
+        monitor.connection_created(None)
+        monitor.connection_check_out_started(None)
+        monitor.connection_checked_out(None)
+    monitor.connection_check_out_started(None)
+    monitor.connection_checked_in(None)
+    assert monitor.stats(4) == {"open": 3, "in_use": 2, "waiting": 1, "checkout_failures": 0, "max_pool_size": 4, "saturation": 0.5}
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_reports_route_latency(client):
+    await Patient(id="P001", name="Alice", city="A", age=30, gender="female", doctor_id="test_doctor").create()
+    client.get("/patients/view")
+    client.get("/patients/patient/P001")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/patients/view",status="200"}' in body
+    assert 'route="/patients/patient/{patient_id}"' in body
+    assert 'http_request_phase_seconds_count{route="/patients/view",phase="validation"}' in body
+    assert 'password_hash_pool{state="queue_depth"}' in body
+    assert 'mongodb_pool_connections{state="saturation"}' in body
+
+
+@pytest.mark.asyncio
+async def test_patch_patient_sets_only_changed_fields(client):
+    await Patient(
+        id="P001", name="Alice", city="A", age=30, gender="female", height=1.6, weight=60, doctor_id="test_doctor",
+        diagnoses_history=[{"disease": "Flu", "condition": "Mild", "diagnosis_on": "2024-01-10"}],
+    ).create()
+    await Patient(id="P002", name="Bob", city="B", age=40, gender="male", doctor_id="other_doctor").create()
+
+    commands = []
+    collection = Patient.get_motor_collection()
+    original = collection.find_one_and_update
+
+    async def spy(filter, update, **kwargs):
+        commands.append((filter, update))
+        return await original(filter, update, **kwargs)
+
+    with patch.object(collection, "find_one_and_update", spy):
+        response = client.patch("/patients/patient/P001", json={"height": 1.8, "weight": 81})
+    assert response.status_code == 200
+    assert response.json() == {"message": "patient updated", "revision": 1}
+    [(filter, update)] = commands
+    assert filter == {"_id": "P001", "doctor_id": "test_doctor"}
+    assert update == {"$inc": {"revision": 1}, "$set": {"height": 1.8, "weight": 81, "bmi": 25.0, "verdict": "Overweight"}}
+
+    raw = await collection.find_one({"_id": "P001"})
+    assert raw["diagnoses_history"][0]["disease"] == "Flu"
+    assert client.patch("/patients/patient/P002", json={"city": "X"}).status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_patch_patient_rejects_stale_revision(client):
+    await Patient(id="P001", name="Alice", city="A", age=30, gender="female", height=1.6, weight=60, doctor_id="test_doctor").create()
+
+    assert client.patch("/patients/patient/P001?revision=0", json={"weight": 70}).json()["revision"] == 1
+    response = client.patch("/patients/patient/P001?revision=0", json={"weight": 80})
+    assert response.status_code == 409
+    assert client.patch("/patients/patient/P001?revision=1", json={"city": "B"}).json()["revision"] == 2
+
+    patient = await Patient.get("P001")
+    assert (patient.weight, patient.bmi, patient.city) == (70, 27.34, "B")
+
+
+@pytest.mark.asyncio
+async def test_add_diagnosis_pushes_and_tracks_latest(client):
+    await Patient(
+        id="P001", name="Alice", city="A", age=30, gender="female", doctor_id="test_doctor",
+        diagnoses_history=[{"disease": "Flu", "condition": "Mild", "diagnosis_on": "2024-03-01"}],
+    ).create()
+
+    older = client.post("/patients/patient/P001/diagnoses", json={"disease": "Asthma", "condition": "Chronic", "diagnosis_on": "2024-01-01"})
+    assert older.status_code == 201
+    raw = await Patient.get_motor_collection().find_one({"_id": "P001"})
+    assert (raw["latest_condition"], raw["latest_diagnosis_date"]) == ("Mild", datetime(2024, 3, 1))
+
+    newer = client.post("/patients/patient/P001/diagnoses", json={"disease": "Covid 19", "condition": "Severe", "diagnosis_on": "2024-06-01"})
+    assert newer.json() == {"message": "diagnosis added", "revision": 2}
+    patient = await Patient.get("P001")
+    assert [d.disease_token for d in patient.diagnoses_history] == ["flu", "asthma", "covid 19"]
+    assert (patient.latest_condition, patient.latest_diagnosis_date) == ("Severe", date(2024, 6, 1))
+
+    stale = client.post("/patients/patient/P001/diagnoses?revision=1", json={"disease": "Flu", "condition": "Mild"})
+    assert stale.status_code == 409
+    missing = client.post("/patients/patient/P404/diagnoses", json={"disease": "Flu", "condition": "Mild"})
+    assert missing.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_delete_patient_scoped_to_doctor(client):
+    await Patient(id="P001", name="Alice", city="A", age=30, gender="female", doctor_id="other_doctor").create()
+
+    response = client.delete("/patients/delete/P001")
+    assert response.status_code == 404
+    assert await Patient.get("P001") is not None
+
+
+@pytest.mark.asyncio
+async def test_doctor_username_is_unique_index(client):
+    await Doctor(username="testuser", password="hashed_password").create()
+
+    with pytest.raises(DuplicateKeyError):
+        await Doctor(username="testuser", password="other").create()
+
+
+@pytest.mark.asyncio
+async def test_view_patients_etag_returns_304_from_cache(client):
+    await Patient(id="P001", name="Alice", city="A", age=30, gender="female", doctor_id="test_doctor").create()
+
+    first = client.get("/patients/view", params={"limit": 10})
+    etag = first.headers["ETag"]
+    with patch.object(Patient, "find", side_effect=AssertionError("cache hit must not query")):
+        cached = client.get("/patients/view", params={"limit": 10})
+        not_modified = client.get("/patients/view", params={"limit": 10}, headers={"If-None-Match": etag})
+    assert cached.json() == first.json()
+    assert not_modified.status_code == 304
+    assert not_modified.headers["ETag"] == etag
+
+    assert client.patch("/patients/patient/P001", json={"city": "B"}).status_code == 200
+    changed = client.get("/patients/view", params={"limit": 10}, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.json()[0]["city"] == "B"
+    assert changed.headers["ETag"] != etag
+
+
+@pytest.mark.asyncio
+async def test_view_patient_cache_invalidated_by_writes(client):
+    await Patient(id="P001", name="Alice", city="A", age=30, gender="female", doctor_id="test_doctor").create()
+
+    assert client.get("/patients/patient/P001").json()["city"] == "A"
+    assert client.put("/patients/edit/P001", json={"city": "B"}).status_code == 200
+    assert client.get("/patients/patient/P001").json()["city"] == "B"
+
+    assert client.delete("/patients/delete/P001").status_code == 200
+    assert client.get("/patients/patient/P001").status_code == 404
+    assert client.get("/patients/view").json() == []
+
+
+@pytest.mark.asyncio
+async def test_fields_projects_patient_responses(client):
+    await Patient(
+        id="P001", name="Alice", city="A", age=30, gender="female", height=1.6, weight=60, doctor_id="test_doctor",
+        diagnoses_history=[{"disease": "Flu", "condition": "Mild", "diagnosis_on": "2024-01-10", "notes": "long notes"}],
+    ).create()
+
+    for fast in (False, True):
+        response = client.get("/patients/view", params={"fields": "name,verdict", "fast": fast})
+        assert response.json() == [{"_id": "P001", "name": "Alice", "verdict": "Normal"}]
+
+    sorted_page = client.get("/patients/sort", params={"sort_by": "bmi", "fields": "name", "limit": 1})
+    assert sorted_page.json() == [{"_id": "P001", "name": "Alice", "bmi": 23.44}]
+
+    filtered = client.get("/patients/filter", params={"disease_name": "flu", "fields": "latest_condition"})
+    assert filtered.json() == [{"_id": "P001", "latest_condition": "Mild"}]
+
+    detail = client.get("/patients/patient/P001", params={"fields": "_id,city"})
+    assert detail.json() == {"_id": "P001", "city": "A"}
+    # a differently projected read of the same patient is cached separately
+    assert "diagnoses_history" in client.get("/patients/patient/P001").json()
+
+    unknown = client.get("/patients/view", params={"fields": "name,password"})
+    assert unknown.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_patient_stats_aggregates_dashboard_counters(client):
+    await Patient(
+        id="P001", name="Alice", city="Pokhara", age=34, gender="female", height=1.6, weight=60, doctor_id="test_doctor",
+        diagnoses_history=[{"disease": "Flu", "condition": "Mild", "diagnosis_on": "2024-01-10"},
+                           {"disease": "Asthma", "condition": "Chronic", "diagnosis_on": "2024-01-25"}],
+    ).create()
+    await Patient(id="P002", name="Bob", city="Pokhara", age=38, gender="male", height=1.8, weight=100, doctor_id="test_doctor",
+                  diagnoses_history=[{"disease": "Flu", "condition": "Mild", "diagnosis_on": "2024-03-01"}]).create()
+    await Patient(id="P003", name="Cara", city="St. Louis", age=7, gender="female", doctor_id="test_doctor").create()
+    await Patient(id="P004", name="Other", city="X", age=50, gender="male", doctor_id="other_doctor").create()
+
+    assert client.get("/patients/stats").json() == {
+        "total_patients": 3,
+        "bmi": {"18.5-25": 1, "30-35": 1, "unknown": 1},
+        "verdict": {"Normal": 1, "Obese": 1, "unknown": 1},
+        "age": {"0-9": 1, "30-39": 2},
+        "city": {"Pokhara": 2, "St. Louis": 1},
+        "diagnoses_per_month": {"2024-01": 2, "2024-03": 1},
+    }
+
+
+@pytest.mark.asyncio
+async def test_patient_stats_rollup_tracks_writes(client):
+    with patch.object(stats_service.settings, "STATS_ROLLUP_ENABLED", True):
+        await Patient(id="P001", name="Alice", city="A.B", age=34, gender="female", height=1.6, weight=60, doctor_id="test_doctor").create()
+        # the first read builds the rollup from an aggregation
+        assert client.get("/patients/stats").json()["total_patients"] == 1
+        assert await PatientStats.get_motor_collection().count_documents({"_id": "test_doctor"}) == 1
+
+        client.post("/patients/create", json={"id": "P002", "name": "Bob", "city": "B", "age": 41, "gender": "male",
+                                               "diagnoses_history": [{"disease": "Flu", "condition": "Mild", "diagnosis_on": "2023-12-01"}]})
+        client.patch("/patients/patient/P001", json={"weight": 90, "city": "C"})
+        client.post("/patients/patient/P002/diagnoses", json={"disease": "Asthma", "condition": "Chronic", "diagnosis_on": "2024-02-02"})
+        client.put("/patients/edit/P002", json={"diagnoses_history": [{"disease": "Flu", "condition": "Mild", "diagnosis_on": "2024-05-01"}]})
+        client.post("/patients/import", content=json.dumps({"id": "P003", "name": "Cara", "city": "C", "age": 5, "gender": "female"}),
+                    headers={"Content-Type": "application/x-ndjson"})
+        client.delete("/patients/delete/P002")
+
+        with patch.object(Patient, "aggregate", side_effect=AssertionError("rollup read must not aggregate")):
+            from_rollup = client.get("/patients/stats").json()
+        assert from_rollup == client.get("/patients/stats", params={"fresh": True}).json()
+        assert from_rollup == {
+            "total_patients": 2,
+            "bmi": {"35-40": 1, "unknown": 1},
+            "verdict": {"Obese": 1, "unknown": 1},
+            "age": {"0-9": 1, "30-39": 1},
+            "city": {"C": 2},
+            "diagnoses_per_month": {},
+        }
+
+
+@pytest.mark.asyncio
+async def test_patient_stats_rollup_build_raced_by_a_write_is_rebuilt(client):
+    store_rollup = stats_service.store_rollup
+
+    async def write_then_store(doctor_id, build, counts):
+        # a patient created after the build aggregated but before it was stored
+        patient = await Patient(id="P002", name="Bob", city="B", age=41, gender="male", doctor_id="test_doctor").create()
+        await stats_service.apply("test_doctor", stats_service.change(None, patient.model_dump()))
+        return await store_rollup(doctor_id, build, counts)
+
+    with patch.object(stats_service.settings, "STATS_ROLLUP_ENABLED", True):
+        await Patient(id="P001", name="Alice", city="A", age=34, gender="female", doctor_id="test_doctor").create()
+        with patch.object(stats_service, "store_rollup", write_then_store):
+            assert (await stats_service.doctor_stats("test_doctor"))["total_patients"] == 1
+        assert (await PatientStats.get_motor_collection().find_one({"_id": "test_doctor"}))["building"] == stats_service.DIRTY
+
+        # the raced build was not stored, so the next read builds again and counts both
+        assert (await stats_service.doctor_stats("test_doctor"))["total_patients"] == 2
+        with patch.object(Patient, "aggregate", side_effect=AssertionError("rollup read must not aggregate")):
+            assert (await stats_service.doctor_stats("test_doctor"))["city"] == {"A": 1, "B": 1}
+
+
+@pytest.mark.asyncio
+async def test_update_rejects_null_for_required_fields(client):
+    with patch.object(stats_service.settings, "STATS_ROLLUP_ENABLED", True):
+        await Patient(id="P001", name="Alice", city="A", age=34, gender="female", doctor_id="test_doctor").create()
+        assert client.get("/patients/stats").json()["city"] == {"A": 1}
+
+        for field in ("name", "city", "age", "gender"):
+            assert client.put("/patients/edit/P001", json={field: None}).status_code == 422
+            assert client.patch("/patients/patient/P001", json={field: None}).status_code == 422
+        # optional fields can still be cleared
+        assert client.patch("/patients/patient/P001", json={"height": None}).status_code == 200
+
+        patient = await Patient.get("P001")
+        assert (patient.city, patient.age) == ("A", 34)
+        assert client.get("/patients/stats").json()["city"] == {"A": 1}
+
+
+@pytest.mark.asyncio
+async def test_update_rejects_null_diagnoses_history(client):
+    await Patient(id="P001", name="Alice", city="A", age=34, gender="female", doctor_id="test_doctor",
+                  diagnoses_history=[{"disease": "Flu", "condition": "Mild"}]).create()
+
+    assert client.put("/patients/edit/P001", json={"diagnoses_history": None}).status_code == 422
+    assert client.patch("/patients/patient/P001", json={"diagnoses_history": None}).status_code == 422
+    assert client.put("/patients/edit/P001", json={"diagnoses_history": []}).status_code == 200
+
+    response = client.get("/patients/view")
+    assert response.status_code == 200
+    assert response.json()[0]["diagnoses_history"] == []
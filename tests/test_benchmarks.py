@@ -0,0 +1,26 @@
+from benchmarks.dataset import generate_patients
+from benchmarks.results import compare, summarize
+
+
+def test_dataset_is_deterministic_and_batch_independent():
+    whole = generate_patients(20, seed=3, doctors=2)
+    assert whole == generate_patients(20, seed=3, doctors=2)
+    assert whole[10:] == generate_patients(10, seed=3, doctors=2, start=10)
+    assert whole != generate_patients(20, seed=4, doctors=2)
+    assert {doc["doctor_id"] for doc in whole} == {"bench_doctor_0", "bench_doctor_1"}
+
+
+def test_dataset_stores_derived_fields():
+    for doc in generate_patients(50):
+        history = doc["diagnoses_history"]
+        assert all(entry["disease_token"] == entry["disease"].lower() for entry in history)
+        assert doc["latest_diagnosis_date"] == (max(entry["diagnosis_on"] for entry in history) if history else None)
+
+
+def test_compare_flags_throughput_and_p95_regressions():
+    baseline = {"results": {"load.view": summarize([10.0] * 100, 1.0), "load.group": summarize([50.0] * 10, 1.0)}}
+    current = {"results": {"load.view": summarize([12.0] * 80, 1.0), "load.group": summarize([51.0] * 10, 1.0)}}
+
+    flagged = {(row["benchmark"], row["metric"]) for row in compare(baseline, current, threshold=0.1) if row["regression"]}
+
+    assert flagged == {("load.view", "throughput"), ("load.view", "p95_ms")}
@@ -0,0 +1,125 @@
+import fnmatch
+
+import pytest
+from starlette.responses import Response
+
+from services.cache import DoctorCache, MemoryBackend, RedisBackend, cached_response
+
+
+class FakeRedis:
+    """In-memory stand-in for the subset of redis.asyncio the cache uses."""
+
+    def __init__(self):
+        self.data = {}
+        self.expiry = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+        self.expiry[key] = ex
+
+    async def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1).encode()
+        return int(self.data[key])
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+    async def scan_iter(self, match):
+        for key in list(self.data):
+            if fnmatch.fnmatch(key, match):
+                yield key
+
+
+async def _fresh():
+    return Response(content=b"fresh", media_type="application/json")
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backend(request):
+    if request.param == "memory":
+        return MemoryBackend(maxsize=10, ttl=60)
+    return RedisBackend(FakeRedis(), "test", ttl=60)
+
+
+@pytest.mark.asyncio
+async def test_invalidate_only_drops_that_doctors_entries(backend):
+    cache = DoctorCache(backend)
+    _, generation_a = await cache.get("doc_a", "view")
+    _, generation_b = await cache.get("doc_b", "view")
+    await cache.set("doc_a", "view", b"a", generation_a)
+    await cache.set("doc_b", "view", b"b", generation_b)
+
+    await cache.invalidate("doc_a")
+
+    assert (await cache.get("doc_a", "view"))[0] is None
+    assert (await cache.get("doc_b", "view"))[0] == b"b"
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+@pytest.mark.asyncio
+async def test_clear_resets_entries_and_counters(backend):
+    cache = DoctorCache(backend)
+    _, generation = await cache.get("doc_a", "view")
+    await cache.set("doc_a", "view", b"a", generation)
+
+    await cache.clear()
+
+    assert (cache.hits, cache.misses) == (0, 0)
+    assert (await cache.get("doc_a", "view"))[0] is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("change", ["invalidate", "clear"])
+async def test_render_racing_an_invalidation_is_not_served(backend, change):
+    cache = DoctorCache(backend)
+
+    async def render():
+        if change == "invalidate":
+            await cache.invalidate("doc_a")
+        else:
+            await cache.clear()
+        return Response(content=b"stale", media_type="application/json")
+
+    first = await cached_response(cache, "doc_a", "view", None, render)
+    second = await cached_response(cache, "doc_a", "view", None, lambda: _fresh())
+
+    assert first.body == b"stale"
+    assert second.body == b"fresh"
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(maxsize=2)
+    await backend.set("a", b"1")
+    await backend.set("b", b"2")
+    await backend.get("a")
+    await backend.set("c", b"3")
+
+    assert await backend.get("b") is None
+    assert await backend.get("a") == b"1"
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_expires_entries(monkeypatch):
+    backend = MemoryBackend(maxsize=2, ttl=10)
+    now = [1000.0]
+    monkeypatch.setattr("services.cache.time.monotonic", lambda: now[0])
+    await backend.set("a", b"1")
+
+    now[0] += 11
+
+    assert await backend.get("a") is None
+
+
+@pytest.mark.asyncio
+async def test_redis_backend_sets_ttl_on_entries():
+    redis = FakeRedis()
+    cache = DoctorCache(RedisBackend(redis, "patients", ttl=300))
+
+    await cache.set("doc_a", ("view", None), b"body", (0, 0))
+
+    [(key, ttl)] = redis.expiry.items()
+    assert key.startswith("patients:") and ttl == 300
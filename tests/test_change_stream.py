@@ -0,0 +1,194 @@
+import asyncio
+import os
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from beanie import init_beanie
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import OperationFailure
+
+from models.change_stream_token import ChangeStreamToken
+from models.patient import Patient
+from services import change_stream
+from services.change_stream import PatientChangeWatcher, changed_doctors
+
+
+def change(token: str, operation: str, doctor: str = None, before: str = None) -> dict:
+    event = {"_id": {"_data": token}, "operationType": operation}
+    if doctor:
+        event["fullDocument"] = {"doctor_id": doctor}
+    if before:
+        event["fullDocumentBeforeChange"] = {"doctor_id": before}
+    return event
+
+
+class FakeChangeStream:
+    """Replays scripted changes like a Motor change stream; None is an empty batch, an exception is raised."""
+
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.alive = True
+        self.resume_token = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def try_next(self):
+        if not self.changes:
+            self.alive = False
+            return None
+        item = self.changes.pop(0)
+        if isinstance(item, BaseException):
+            raise item
+        if item is not None:
+            self.resume_token = item["_id"]
+        return item
+
+
+class FakePatients:
+    """Stand-in for the patients collection; mongomock has no change streams."""
+
+    def __init__(self, *streams):
+        self.streams = list(streams)
+        self.resumed_from = []
+        self.options = []
+
+    def watch(self, pipeline, resume_after=None, **options):
+        self.resumed_from.append(resume_after)
+        self.options.append(options)
+        return self.streams.pop(0)
+
+
+@pytest.fixture
+def invalidations():
+    asyncio.run(init_beanie(database=AsyncMongoMockClient().get_database("change_stream_db"),
+                            document_models=[Patient, ChangeStreamToken]))
+    doctors, everything = AsyncMock(), AsyncMock()
+    with patch.object(change_stream, "invalidate_doctor", doctors), patch.object(change_stream, "invalidate_all", everything):
+        yield doctors, everything
+
+
+def watch_with(patients: FakePatients, watcher: PatientChangeWatcher, run: bool = False):
+    with patch.object(Patient, "get_motor_collection", return_value=patients):
+        asyncio.run(watcher.run() if run else watcher.watch())
+
+
+def test_changed_doctors():
+    assert changed_doctors(change("1", "insert", "doc_a")) == {"doc_a"}
+    assert changed_doctors(change("2", "update", "doc_b", before="doc_a")) == {"doc_a", "doc_b"}
+    assert changed_doctors(change("3", "delete")) is None
+
+
+def test_changes_invalidate_their_doctors_and_checkpoint(invalidations):
+    doctors, everything = invalidations
+    patients = FakePatients(FakeChangeStream([
+        change("1", "insert", "doc_a"), None, change("2", "update", "doc_b", before="doc_a"), change("3", "delete"),
+    ]))
+    watcher = PatientChangeWatcher(checkpoint_seconds=3600, persist_token=True)
+    watch_with(patients, watcher)
+
+    assert sorted(call.args[0] for call in doctors.await_args_list) == ["doc_a", "doc_a", "doc_b"]
+    everything.assert_awaited_once()
+    assert patients.resumed_from == [None]
+    assert "full_document_before_change" not in patients.options[0]
+    # the first token is saved right away, later ones once the checkpoint interval passed or the stream ended
+    assert asyncio.run(watcher.load_token()) == {"_data": "3"}
+    assert watcher.stats() == {"events": 3, "restarts": 0}
+
+
+def test_restart_resumes_from_the_stored_token(invalidations):
+    watch_with(FakePatients(FakeChangeStream([change("1", "insert", "doc_a")])), PatientChangeWatcher(persist_token=True))
+
+    patients = FakePatients(FakeChangeStream([]))
+    watch_with(patients, PatientChangeWatcher(pre_images=True, persist_token=True))
+    assert patients.resumed_from == [{"_data": "1"}]
+    assert patients.options[0]["full_document_before_change"] == "whenAvailable"
+
+
+def test_lost_history_clears_caches_and_starts_from_now(invalidations):
+    doctors, everything = invalidations
+    watch_with(FakePatients(FakeChangeStream([change("1", "insert", "doc_a")])), PatientChangeWatcher(persist_token=True))
+
+    lost = OperationFailure("resume point may no longer be in the oplog", code=286)
+    patients = FakePatients(FakeChangeStream([lost]), FakeChangeStream([asyncio.CancelledError()]))
+    watcher = PatientChangeWatcher(retry_seconds=0, persist_token=True)
+    with pytest.raises(asyncio.CancelledError):
+        watch_with(patients, watcher, run=True)
+
+    assert patients.resumed_from == [{"_data": "1"}, None]
+    everything.assert_awaited_once()
+    assert watcher.restarts == 1
+
+
+def test_any_error_restarts_the_watch_from_its_own_last_token(invalidations, caplog):
+    doctors, everything = invalidations
+    # another worker checkpointed past changes this one has not handled
+    asyncio.run(PatientChangeWatcher(persist_token=True).save_token({"_data": "9"}))
+
+    # e.g. the redis cache backend being unreachable while a change is handled
+    doctors.side_effect = [None, ConnectionError("redis is down"), None]
+    patients = FakePatients(
+        FakeChangeStream([change("1", "insert", "doc_a"), change("2", "insert", "doc_b")]),
+        FakeChangeStream([change("2", "insert", "doc_b"), asyncio.CancelledError()]),
+    )
+    watcher = PatientChangeWatcher(retry_seconds=0)
+    with pytest.raises(asyncio.CancelledError):
+        watch_with(patients, watcher, run=True)
+
+    assert patients.resumed_from == [None, {"_data": "1"}]
+    assert doctors.await_count == 3
+    assert watcher.restarts == 1
+    assert "Patient change stream failed" in caplog.text
+    # without persist_token the shared checkpoint is neither read nor written
+    assert asyncio.run(watcher.load_token()) == {"_data": "9"}
+
+
+def test_dropped_collection_ends_the_stream_and_forgets_the_token(invalidations):
+    doctors, everything = invalidations
+    watcher = PatientChangeWatcher(persist_token=True)
+    watch_with(FakePatients(FakeChangeStream([change("1", "insert", "doc_a"), None, change("2", "drop")])), watcher)
+
+    everything.assert_awaited_once()
+    assert asyncio.run(watcher.load_token()) is None
+
+
+@pytest.mark.skipif(not os.environ.get("MONGO_TEST_REPLICA_SET_URL"), reason="set MONGO_TEST_REPLICA_SET_URL to a replica set")
+def test_watcher_against_a_replica_set():
+    import motor.motor_asyncio
+
+    async def run():
+        client = motor.motor_asyncio.AsyncIOMotorClient(os.environ["MONGO_TEST_REPLICA_SET_URL"])
+        await client.drop_database("change_stream_test")
+        await init_beanie(database=client.get_database("change_stream_test"), document_models=[Patient, ChangeStreamToken])
+        invalidated = asyncio.Queue()
+
+        async def record(doctor_id):
+            await invalidated.put(doctor_id)
+
+        async def insert(patient_id, doctor_id):
+            await Patient(id=patient_id, name="N", city="A", age=30, gender="male", doctor_id=doctor_id).insert()
+
+        with patch.object(change_stream, "invalidate_doctor", record):
+            watcher = PatientChangeWatcher(checkpoint_seconds=0, persist_token=True)
+            task = asyncio.create_task(watcher.run())
+            await asyncio.sleep(1)
+            await insert("P001", "doc_a")
+            assert await asyncio.wait_for(invalidated.get(), 10) == "doc_a"
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+            # written while no watcher ran; the next one resumes from the stored token and still sees it
+            await insert("P002", "doc_b")
+            task = asyncio.create_task(PatientChangeWatcher(persist_token=True).run())
+            assert await asyncio.wait_for(invalidated.get(), 10) == "doc_b"
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        await client.drop_database("change_stream_test")
+        client.close()
+
+    asyncio.run(run())
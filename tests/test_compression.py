@@ -0,0 +1,87 @@
+import gzip
+import zlib
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from fastapi.testclient import TestClient
+
+from services.compression import CompressionMiddleware, negotiate_encoding
+
+
+@pytest.mark.parametrize("accept_encoding, brotli_available, expected", [
+    ("gzip, deflate, br", True, "br"),
+    ("gzip, deflate, br", False, "gzip"),
+    ("br;q=0, gzip", True, "gzip"),
+    ("gzip;q=0", True, None),
+    ("*", False, "gzip"),
+    ("identity", True, None),
+    (None, True, None),
+])
+def test_negotiate_encoding(accept_encoding, brotli_available, expected):
+    assert negotiate_encoding(accept_encoding, brotli_available) == expected
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=100)
+
+    @app.get("/small")
+    def small():
+        return PlainTextResponse("x" * 50, headers={"ETag": '"abc"'})
+
+    @app.get("/large")
+    def large():
+        return PlainTextResponse("x" * 5000, headers={"ETag": '"abc"'})
+
+    return TestClient(app)
+
+
+def raw_get(client, path, accept_encoding="gzip"):
+    with client.stream("GET", path, headers={"Accept-Encoding": accept_encoding}) as response:
+        return response, b"".join(response.iter_raw())
+
+
+def test_small_bodies_are_sent_uncompressed(client):
+    response, body = raw_get(client, "/small")
+    assert "content-encoding" not in response.headers
+    assert body == b"x" * 50
+    assert response.headers["etag"] == '"abc"'
+
+
+def test_large_bodies_are_gzipped_with_weak_etag(client):
+    response, body = raw_get(client, "/large")
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["etag"] == 'W/"abc"'
+    assert int(response.headers["content-length"]) == len(body) < 5000
+    assert gzip.decompress(body) == b"x" * 5000
+
+
+@pytest.mark.asyncio
+async def test_streams_are_flushed_per_chunk():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/x-ndjson")]})
+        await send({"type": "http.response.body", "body": b'{"a": 1}\n', "more_body": True})
+        await send({"type": "http.response.body", "body": b'{"b": 2}\n', "more_body": False})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", b"gzip")]}
+    await CompressionMiddleware(app, minimum_size=100)(scope, None, send)
+
+    decompressor = zlib.decompressobj(31)
+    lines = [decompressor.decompress(message["body"]) for message in sent[1:]]
+    # every line can be decoded as soon as its chunk arrives
+    assert lines == [b'{"a": 1}\n', b'{"b": 2}\n']
+    assert decompressor.eof
+
+
+def test_identity_is_left_alone(client):
+    response, body = raw_get(client, "/large", accept_encoding="identity")
+    assert "content-encoding" not in response.headers
+    assert body == b"x" * 5000
@@ -0,0 +1,41 @@
+from datetime import date, datetime
+
+import pytest
+
+from services.filters import diagnosis_filter, months_ago
+
+
+@pytest.mark.parametrize("today, months, expected", [
+    (date(2024, 3, 31), 1, date(2024, 2, 29)),
+    (date(2023, 3, 31), 1, date(2023, 2, 28)),
+    (date(2024, 1, 15), 1, date(2023, 12, 15)),
+    (date(2024, 5, 31), 3, date(2024, 2, 29)),
+    (date(2024, 6, 10), 24, date(2022, 6, 10)),
+    (date(2024, 6, 10), 0, date(2024, 6, 10)),
+])
+def test_months_ago_uses_calendar_months(today, months, expected):
+    assert months_ago(today, months) == expected
+
+
+def test_months_ago_clamps_before_year_one():
+    assert months_ago(date(2024, 6, 10), 24400) == date.min
+    assert months_ago(date(2024, 6, 10), 2023 * 12 + 5) == date(1, 1, 10)
+
+
+def test_diagnosis_filter_ties_predicates_to_one_diagnosis():
+    query = diagnosis_filter("Type 2 Diabetes", "exact", "Chronic", 6, today=date(2024, 8, 31))
+    assert query == {"diagnoses_history": {"$elemMatch": {
+        "disease_token": "type 2 diabetes",
+        "condition": "Chronic",
+        "diagnosis_on": {"$gte": datetime(2024, 2, 29)},
+    }}}
+
+
+def test_diagnosis_filter_without_predicates_is_empty():
+    assert diagnosis_filter() == {}
+    assert diagnosis_filter("   ") == {}
+
+
+def test_diagnosis_filter_keeps_fuzzy_search_top_level():
+    query = diagnosis_filter("diabetis", "fuzzy", "Stable", text_index=True)
+    assert query == {"$text": {"$search": "diabetis"}, "diagnoses_history": {"$elemMatch": {"condition": "Stable"}}}
@@ -0,0 +1,48 @@
+import time
+from types import SimpleNamespace
+
+from services import metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("demo_seconds", "Demo", ("route",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, "/a")
+    histogram.observe(0.5, "/a")
+    histogram.observe(5, "/a")
+
+    assert histogram.render() == [
+        "# HELP demo_seconds Demo",
+        "# TYPE demo_seconds histogram",
+        'demo_seconds_bucket{route="/a",le="0.1"} 1',
+        'demo_seconds_bucket{route="/a",le="1.0"} 2',
+        'demo_seconds_bucket{route="/a",le="+Inf"} 3',
+        'demo_seconds_sum{route="/a"} 5.55',
+        'demo_seconds_count{route="/a"} 3',
+    ]
+
+
+def test_command_timer_tags_collection_and_feeds_request_db_time():
+    timings = metrics.RequestTimings()
+    token = metrics._request_timings.set(timings)
+    try:
+        with metrics.record_phase("validation"):
+            started = SimpleNamespace(command_name="find", command={"find": "patients"}, connection_id=("db", 27017), request_id=1)
+            metrics.command_timer.started(started)
+            time.sleep(0.01)
+            metrics.command_timer.succeeded(SimpleNamespace(command_name="find", connection_id=("db", 27017), request_id=1, duration_micros=8000))
+    finally:
+        metrics._request_timings.reset(token)
+
+    assert timings.phases["db"] == 0.008
+    # the db time spent inside the block is not double counted as validation
+    assert 0 < timings.phases["validation"] < 0.01 + 0.005
+    assert 'mongodb_command_duration_seconds_count{collection="patients",command="find"}' in metrics.registry.render()
+
+
+def test_command_timer_tags_get_more_with_its_collection():
+    started = SimpleNamespace(command_name="getMore", command={"getMore": 7215309, "collection": "patients"},
+                              connection_id=("db", 27017), request_id=2)
+    metrics.command_timer.started(started)
+    metrics.command_timer.succeeded(SimpleNamespace(command_name="getMore", connection_id=("db", 27017), request_id=2, duration_micros=3000))
+
+    assert 'mongodb_command_duration_seconds_count{collection="patients",command="getMore"}' in metrics.registry.render()
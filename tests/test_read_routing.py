@@ -0,0 +1,140 @@
+import asyncio
+import os
+
+import pytest
+from beanie import init_beanie
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+from pydantic import ValidationError
+from pymongo.read_preferences import SecondaryPreferred
+
+from app import app
+from config import ReadRoute
+from models.doctor import Doctor
+from models.patient import Patient
+from models.patient_stats import PatientStats
+from models.revoked_token import RevokedToken
+from routers import patients as patients_router
+from services import read_routing
+from services.auth import get_current_doctor
+
+READ_OPERATIONS = {"find", "find_one", "aggregate", "count_documents"}
+
+ROUTES = {
+    "detail": ReadRoute(read_preference="primary"),
+    "analytics": ReadRoute(read_preference="secondaryPreferred", max_staleness_seconds=120, read_concern="local"),
+}
+
+
+class ReplicaSetStandIn:
+    """Wraps a mongomock_motor collection, recording the read preference and concern every read is sent with.
+
+    mongomock_motor's own with_options() returns a synchronous collection, and
+    a single mongod cannot tell which member served a read, so the routing is
+    checked on what the driver would have been asked for.
+    """
+
+    def __init__(self, collection, reads: list, read_preference=None, read_concern=None):
+        self.collection = collection
+        self.reads = reads
+        self.read_preference = read_preference
+        self.read_concern = read_concern
+
+    def with_options(self, read_preference=None, read_concern=None, **kwargs):
+        return ReplicaSetStandIn(self.collection, self.reads, read_preference or self.read_preference,
+                                 read_concern or self.read_concern)
+
+    def __getattr__(self, name):
+        if name in READ_OPERATIONS:
+            mode = self.read_preference.mongos_mode if self.read_preference else "client"
+            staleness = self.read_preference.max_staleness if self.read_preference else None
+            level = self.read_concern.level if self.read_concern else None
+            self.reads.append((name, mode, staleness, level))
+        return getattr(self.collection, name)
+
+
+@pytest.fixture
+def reads():
+    mock_client = AsyncMongoMockClient()
+    recorded = []
+
+    async def init_test_db():
+        await init_beanie(database=mock_client.get_database(name="routing_db"),
+                          document_models=[Doctor, Patient, RevokedToken, PatientStats])
+        await Patient(id="P001", name="Alice", city="A", age=30, gender="female", doctor_id="test_doctor").insert()
+        await patients_router.group_cache.clear()
+        await patients_router.response_cache.clear()
+
+    asyncio.run(init_test_db())
+    settings = Patient.get_settings()
+    settings.motor_collection = ReplicaSetStandIn(settings.motor_collection, recorded)
+    read_routing.install(Patient, ROUTES)
+    app.dependency_overrides[get_current_doctor] = lambda: "test_doctor"
+    yield recorded
+    app.dependency_overrides = {}
+
+
+def test_routes_read_with_their_configured_preference(reads):
+    client = TestClient(app)
+
+    assert client.get("/patients/group?by=city").status_code == 200
+    assert reads == [("aggregate", "secondaryPreferred", 120, "local")]
+
+    reads.clear()
+    assert client.get("/patients/patient/P001").status_code == 200
+    # the client default is primary already, so detail reads need no view of their own
+    assert reads == [("find_one", "client", None, None)]
+
+    reads.clear()
+    assert client.get("/patients/view").status_code == 200
+    assert {mode for _, mode, _, _ in reads} == {"client"}
+
+
+def test_streamed_routes_keep_their_read_route(reads):
+    read_routing.install(Patient, {"list": ReadRoute(read_preference="nearest")})
+    response = TestClient(app).get("/patients/export?format=ndjson")
+    assert response.status_code == 200
+    assert reads == [("find", "nearest", -1, None)]
+
+
+def test_reads_outside_a_routed_request_use_the_client_settings(reads):
+    assert TestClient(app).get("/patients/stats").status_code == 200
+    assert {mode for _, mode, _, _ in reads} == {"secondaryPreferred"}
+
+    reads.clear()
+    asyncio.run(Patient.get_motor_collection().find_one({"_id": "P001"}))
+    assert reads == [("find_one", "client", None, None)]
+
+
+def test_read_options():
+    assert read_routing.read_options(ReadRoute()) == {}
+    assert read_routing.read_options(ReadRoute(read_preference="primary")) == {}
+    assert read_routing.read_options(ReadRoute(read_preference="primary"), "secondaryPreferred")["read_preference"].mongos_mode == "primary"
+    options = read_routing.read_options(ReadRoute(read_preference="secondaryPreferred", max_staleness_seconds=90))
+    assert options == {"read_preference": SecondaryPreferred(max_staleness=90)}
+
+    with pytest.raises(ValidationError):
+        ReadRoute(read_preference="primary", max_staleness_seconds=120)
+    with pytest.raises(ValidationError):
+        ReadRoute(read_preference="secondary", max_staleness_seconds=30)
+
+
+@pytest.mark.skipif(not os.environ.get("MONGO_TEST_REPLICA_SET_URL"), reason="set MONGO_TEST_REPLICA_SET_URL to a replica set")
+def test_routing_against_a_replica_set():
+    import motor.motor_asyncio
+
+    async def run():
+        client = motor.motor_asyncio.AsyncIOMotorClient(os.environ["MONGO_TEST_REPLICA_SET_URL"])
+        database = client.get_database("read_routing_test")
+        await init_beanie(database=database, document_models=[Doctor, Patient, RevokedToken, PatientStats])
+        read_routing.install(Patient, ROUTES)
+        collection = Patient.get_motor_collection()
+        assert collection.views["analytics"].read_preference == SecondaryPreferred(max_staleness=120)
+        await Patient(id="P001", name="Alice", city="A", age=30, gender="female", doctor_id="test_doctor").insert()
+        read_routing._read_route.set("analytics")
+        # secondaryPreferred falls back to the primary, so the read succeeds even while secondaries lag
+        await collection.aggregate([{"$match": {"doctor_id": "test_doctor"}}]).to_list(None)
+        await client.drop_database("read_routing_test")
+        client.close()
+
+    asyncio.run(run())